@@ -23,14 +23,13 @@ import argparse
 import subprocess
 import stat
 import signal
+import errno
 import functools
 import tempfile
 import shutil
+import time
 
 from pathlib import Path
-from queue import Queue
-from threading import (Thread, Event)
-
 import urwid
 
 import xdg.BaseDirectory
@@ -48,16 +47,25 @@ from .bookmarks import (Bookmarks, BOOKMARK_KEYS)
 from .dlg_error import DlgError
 from .dlg_question import DlgQuestion
 from .dlg_dirscan import DlgDirscan
-from .rnr_dirscan import rnr_dirscan
+from .rnr_dirscan import (rnr_dirscan, dirscan_progress)
 from .dlg_delete_progress import DlgDeleteProgress
-from .rnr_delete import rnr_delete
+from .rnr_delete import (rnr_delete, delete_progress)
 from .dlg_report import DlgReport
 from .dlg_cpmv import DlgCpMv
 from .dlg_cpmv_progress import DlgCpMvProgress
-from .rnr_cpmv import rnr_cpmv
+from .rnr_cpmv import (rnr_cpmv, cpmv_progress)
+from .preflight import check_free_space
+from .trash import (new_trash_slot, rnr_reap)
+from .backend import Backend
+from .archive_resolver import ArchiveResolver
+from .dir_counter import DirCounter
+from .inotify import (Inotify, IN_CREATE, IN_DELETE, IN_MODIFY, IN_ATTRIB, IN_MOVED_FROM, IN_MOVED_TO, IN_CLOSE_WRITE, IN_DELETE_SELF, IN_MOVE_SELF, IN_ONLYDIR, IN_Q_OVERFLOW, IN_IGNORED)
+from .scheduler import JobScheduler
+from .dlg_jobs import DlgJobs
 from .database import DataBase
 from .dlg_pending_job import DlgPendingJob
 from .dlg_cancelable import DlgCancelable
+from .utils import existing_dir
 from .debug_print import (debug_print, debug_pprint, set_debug_fh)
 
 
@@ -162,6 +170,15 @@ class Screen(urwid.WidgetWrap):
 		if error_cb:
 			error_cb()
 
+		self.controller.schedule_pending_reports()
+
+	def get_dialog(self):
+		w = self.pile.contents[self.main_area][0]
+		if w is self.center:
+			return None
+
+		return w.top_w
+
 	def error(self, e, title='Error', error=True, callback=None):
 		try:
 			self.center.focus.force_focus()
@@ -183,13 +200,16 @@ class Screen(urwid.WidgetWrap):
 		except AttributeError:
 			pass
 
-		self.pile.contents[self.main_area] = (urwid.Overlay(DlgCancelable(self, title, message, on_cancel), self.center,
+		dlg = DlgCancelable(self, title, message, on_cancel)
+		self.pile.contents[self.main_area] = (urwid.Overlay(dlg, self.center,
 			'center', len(message) + 6,
 			'middle', 'pack',
 		), self.pile.options())
 
 		self.in_error = True
 
+		return dlg
+
 
 class App(object):
 	def __init__(self, printwd, dbfile, monochrome, vertical, tabsize):
@@ -214,8 +234,27 @@ class App(object):
 		self.editor = EDITOR
 		self.use_internal_viewer = USE_INTERNAL_VIEWER
 		self.count_directories = COUNT_DIRECTORIES
+		self.dir_counter = DirCounter(DIR_COUNT_WORKERS)
+
+		self.watches = {}
+		try:
+			self.inotify = Inotify() if LIVE_REFRESH else None
+		except OSError:
+			self.inotify = None
+		self.one_filesystem = ONE_FILESYSTEM
+		self.scan_by_device = SCAN_BY_DEVICE
+		self.copy_physical_order = COPY_PHYSICAL_ORDER
+		self.progress_refresh_interval = PROGRESS_REFRESH_INTERVAL
+		self.preview_delay = PREVIEW_DELAY
+		self.backend = Backend(WORKER_BACKEND)
+		self.delete_workers = DELETE_WORKERS
+		self.fsync_policy = FSYNC_POLICY
+		self.fsync_interval = FSYNC_INTERVAL
+		self.delete_to_trash = DELETE_TO_TRASH
+		self.trash_reap_delay = TRASH_REAP_DELAY
 
 		self.archive_dirs = []
+		self.archive_resolver = ArchiveResolver(self.archive_dirs)
 		self.archives = []
 		self.archive_file = None
 		self.archive_panel = None
@@ -230,9 +269,13 @@ class App(object):
 		self.loop = None
 		self.screen = Screen(self, vertical)
 		self.screen.update_focus()
-		self.ev_interrupt = Event()
+		self.ev_interrupt = self.backend.event()
 		self.suspend = set()
 		self.pending_jobs = []
+		self.pending_reports = []
+		self.scheduler = JobScheduler(MAX_JOBS_PER_DEVICE)
+		self.reaper_job = None
+		self.reaper_alarm_handle = None
 		self.focused_quickviewer = False
 
 		self.bookmarks = Bookmarks(CONFIG_DIR / 'bookmarks')
@@ -249,6 +292,14 @@ class App(object):
 
 		signal.signal(signal.SIGTERM, self.signal_handler)
 
+		self.screen.left.start_counting()
+		self.screen.right.start_counting()
+
+		if self.inotify:
+			self.loop.watch_file(self.inotify.fd, self.poll_inotify)
+
+		self.schedule_reaper()
+
 		try:
 			self.loop.run()
 		except KeyboardInterrupt:
@@ -337,6 +388,8 @@ class App(object):
 				self.screen.center.focus.untag_all()
 			elif key in ('f', '/'):
 				self.screen.center.focus.filter('')
+			elif key == 'd':
+				self.undo_delete()
 
 			self.screen.command_bar.reset()
 		elif self.screen.command_bar.leader == 'c':
@@ -382,6 +435,10 @@ class App(object):
 				self.screen.command_bar.set_leader(key)
 			elif key == 'u':
 				self.screen.command_bar.set_leader(key)
+			elif key in ('meta h', 'meta left'):
+				self.screen.center.focus.go_back()
+			elif key in ('meta l', 'meta right'):
+				self.screen.center.focus.go_forward()
 			elif key == 'meta i':
 				cwd = self.screen.center.focus.cwd
 
@@ -445,6 +502,8 @@ class App(object):
 
 				self.update_focus()
 				self.reload()
+			elif key == 'meta j':
+				self.show_jobs()
 			elif key == 'meta v':
 				focus_position = self.screen.center.focus_position
 				center = [x[0] for x in self.screen.center.contents]
@@ -590,10 +649,11 @@ class App(object):
 	def do_dirscan(self, files, cwd, on_complete):
 		self.screen.center.focus.force_focus()
 
-		q = Queue()
-		ev_abort = Event()
-		ev_skip = Event()
-		dlg = DlgDirscan(self, cwd, q, ev_abort, ev_skip, on_complete)
+		q = self.backend.queue()
+		info = dirscan_progress(cwd)
+		ev_abort = self.backend.event()
+		ev_skip = self.backend.event()
+		dlg = DlgDirscan(self, cwd, q, info, ev_abort, ev_skip, on_complete)
 		self.screen.pile.contents[self.screen.main_area] = (urwid.Overlay(dlg, self.screen.center,
 			'center', ('relative', 50),
 			'middle', 'pack',
@@ -603,7 +663,8 @@ class App(object):
 		dlg.fd = fd
 
 		files = [self.unarchive_path(x, include_self=False)[0] for x in files]
-		Thread(target=rnr_dirscan, args=(files, cwd, fd, q, self.ev_interrupt, ev_abort, ev_skip, self.archive_path)).start()
+		worker = self.backend.worker(rnr_dirscan, (files, cwd, fd, q, info, self.ev_interrupt, ev_abort, ev_skip, self.archive_path, self.one_filesystem, self.scan_by_device))
+		self.backend.start(worker, fd)
 
 	def on_finish(self, completed_list, error_list, skipped_list, aborted_list, operation, files, cwd, dest, scan_error, scan_skipped, job_id):
 		warnings = [x for x in completed_list if x['message']]
@@ -629,8 +690,181 @@ class App(object):
 		for file in files:
 			self.umount_archive(file)
 
+		if self.delete_to_trash and self.dbfile:
+			files = self.trash_files(files)
+			if not files:
+				self.reload()
+				return
+
 		self.do_dirscan(files, cwd, functools.partial(self.do_delete, files=files, cwd=cwd, job_id=None))
 
+	def trash_files(self, files):
+		db = DataBase(self.dbfile)
+		batch = db.new_trash_batch()
+
+		# Whatever cannot be renamed into a trash directory on the same
+		# filesystem gets deleted the usual way
+		remaining = []
+		parents = set()
+		for file in files:
+			(actual_file, archive_file, temp_dir) = self.unarchive_path(file, include_self=False)
+			if archive_file:
+				remaining.append(file)
+				continue
+
+			try:
+				trash = new_trash_slot(str(actual_file), DATA_DIR / 'trash')
+			except OSError:
+				remaining.append(file)
+				continue
+
+			trash_id = db.add_trash(batch, actual_file, trash)
+			try:
+				os.rename(actual_file, trash)
+				parents.add(actual_file.parent)
+			except OSError:
+				db.delete_trash(trash_id)
+				remaining.append(file)
+				try:
+					os.rmdir(os.path.dirname(trash))
+				except OSError:
+					pass
+
+		del db
+
+		for parent in parents:
+			try:
+				parent_fd = os.open(parent, os.O_RDONLY | os.O_DIRECTORY)
+				try:
+					os.fsync(parent_fd)
+				finally:
+					os.close(parent_fd)
+			except OSError:
+				pass
+
+		if len(remaining) < len(files):
+			self.schedule_reaper()
+
+		return remaining
+
+	def undo_delete(self):
+		entries = []
+		if self.dbfile:
+			db = DataBase(self.dbfile)
+			entries = db.get_last_trash_batch()
+			del db
+
+		if not entries:
+			self.screen.error('Nothing to undo', title='Undo', error=False)
+			return
+
+		db = DataBase(self.dbfile)
+		error = None
+		for entry in entries:
+			# The reaper may be removing the entry already, and it keeps going
+			# through its directory fds even after a rename
+			if not db.claim_trash(entry['id'], 'RESTORING'):
+				error = 'Already removed from the trash'
+				continue
+
+			try:
+				if os.path.lexists(entry['file']):
+					raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST))
+
+				os.rename(entry['trash'], entry['file'])
+			except OSError as e:
+				db.set_trash_status(entry['id'], 'TRASHED')
+				error = f'{e.strerror} ({e.errno})'
+				continue
+
+			db.delete_trash(entry['id'])
+			try:
+				os.rmdir(os.path.dirname(entry['trash']))
+			except OSError:
+				pass
+
+		del db
+
+		self.reload(Path(entries[0]['file']), only_focused=True)
+
+		if error:
+			self.screen.error(error)
+
+	def schedule_reaper(self):
+		if (not self.dbfile) or (self.loop is None) or (self.reaper_job is not None):
+			return
+
+		db = DataBase(self.dbfile)
+		entries = db.get_trash()
+		del db
+
+		if self.reaper_alarm_handle is not None:
+			self.loop.remove_alarm(self.reaper_alarm_handle)
+			self.reaper_alarm_handle = None
+
+		if entries:
+			delay = max(min(x['time'] for x in entries) + self.trash_reap_delay - time.time(), 0)
+			self.reaper_alarm_handle = self.loop.set_alarm_in(delay, self.reap_trash)
+
+	def reap_trash(self, loop=None, user_data=None):
+		self.reaper_alarm_handle = None
+
+		db = DataBase(self.dbfile)
+		entries = db.get_trash(before=(time.time() - self.trash_reap_delay))
+		del db
+
+		if not entries:
+			self.schedule_reaper()
+			return
+
+		q = self.backend.queue()
+		ev_suspend = self.backend.event()
+		ev_suspend.set()
+		self.suspend.add(ev_suspend)
+
+		job = {
+			'title': 'Empty trash',
+			'dlg': None,
+			'devices': self.get_devices(*[os.path.dirname(x['trash']) for x in entries]),
+			'priority': REAPER_PRIORITY,
+			'background': True,
+			'ev_suspend': ev_suspend,
+		}
+
+		fd = self.loop.watch_pipe(functools.partial(self.on_reaped, job, q))
+		worker = self.backend.worker(rnr_reap, (entries, fd, q, ev_suspend, self.ev_interrupt, self.dbfile))
+		job['start'] = functools.partial(self.backend.start, worker, fd)
+
+		self.reaper_job = job
+		self.scheduler.submit(job)
+
+	def on_reaped(self, job, q, data):
+		result = self.backend.receive(q, data)
+
+		self.suspend.discard(job['ev_suspend'])
+		self.scheduler.finish(job)
+		self.reaper_job = None
+		self.schedule_reaper()
+
+		# The entries that could not be removed stay in the trash, and are
+		# retried the next time rnr starts
+		if result is None:
+			message = 'The worker ended before finishing the job'
+		elif result['error']:
+			error = result['error'][0]
+			message = f'Cannot empty the trash: {error["file"]}: {error["message"]}'
+		else:
+			message = None
+
+		if message is not None:
+			report = lambda: self.screen.error(message)
+			if self.old_screen or (self.screen.get_dialog() is not None):
+				self.pending_reports.append(report)
+			else:
+				report()
+
+		return False
+
 	def do_delete(self, file_list, scan_error, scan_skipped, files, cwd, job_id):
 		self.screen.center.focus.force_focus()
 
@@ -640,23 +874,21 @@ class App(object):
 			job_id = db.new_job('Delete', file_list, scan_error, scan_skipped, files, cwd, archives=archives)
 			del db
 
-		q = Queue()
-		ev_skip = Event()
-		ev_suspend = Event()
+		q = self.backend.queue()
+		info = delete_progress()
+		ev_skip = self.backend.event()
+		ev_suspend = self.backend.event()
 		ev_suspend.set()
 		self.suspend.add(ev_suspend)
-		ev_abort = Event()
-		ev_nodb = Event()
-		dlg = DlgDeleteProgress(self, len(file_list), sum((x['lstat'].st_size for x in file_list)), q, ev_skip, ev_suspend, ev_abort, ev_nodb, functools.partial(self.on_finish, operation='Delete', files=files, cwd=cwd, dest=None, scan_error=scan_error, scan_skipped=scan_skipped, job_id=job_id))
-		self.screen.pile.contents[self.screen.main_area] = (urwid.Overlay(dlg, self.screen.center,
-			'center', ('relative', 75),
-			'middle', 'pack',
-		), self.screen.pile.options())
+		ev_abort = self.backend.event()
+		ev_nodb = self.backend.event()
+		dlg = DlgDeleteProgress(self, len(file_list), sum((x['lstat'].st_size for x in file_list)), q, info, ev_skip, ev_suspend, ev_abort, ev_nodb, functools.partial(self.on_finish, operation='Delete', files=files, cwd=cwd, dest=None, scan_error=scan_error, scan_skipped=scan_skipped, job_id=job_id))
 
 		fd = self.loop.watch_pipe(dlg.on_pipe_data)
 		dlg.fd = fd
 
-		Thread(target=rnr_delete, args=(file_list, fd, q, ev_skip, ev_suspend, self.ev_interrupt, ev_abort, ev_nodb, self.dbfile, job_id, self.unarchive_path)).start()
+		worker = self.backend.worker(rnr_delete, (file_list, fd, q, info, ev_skip, ev_suspend, self.ev_interrupt, ev_abort, ev_nodb, self.dbfile, job_id, self.unarchive_path, self.delete_workers, self.fsync_policy, self.fsync_interval))
+		self.submit_job('Delete', f'Delete: {cwd}', dlg, worker, self.get_devices(cwd), ev_suspend, job_id)
 
 	def on_copy(self, files, cwd, dest, on_conflict):
 		self.screen.close_dialog()
@@ -680,7 +912,7 @@ class App(object):
 					if (unarchive_cwd.resolve() == unarchive_dest.resolve()) and (on_conflict in ('overwrite', 'skip')):
 						pass
 					else:
-						self.do_dirscan(files, cwd, functools.partial(self.do_copy, files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
+						self.do_dirscan(files, cwd, functools.partial(self.do_preflight, operation='Copy', files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
 				else:
 					dest_parent = path_dest.parent
 					if not self.unarchive_path(dest_parent)[0].is_dir():
@@ -688,17 +920,47 @@ class App(object):
 					elif (unarchive_cwd.resolve() == unarchive_dest.resolve()) and (on_conflict in ('overwrite', 'skip')):
 						pass
 					else:
-						self.do_dirscan(files, cwd, functools.partial(self.do_copy, files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
+						self.do_dirscan(files, cwd, functools.partial(self.do_preflight, operation='Copy', files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
 			else:
 				if not unarchive_dest.is_dir():
 					self.screen.error(f'{dest} is not a directory')
 				elif (unarchive_cwd.resolve() == unarchive_dest.resolve()) and (on_conflict in ('overwrite', 'skip')):
 					pass
 				else:
-					self.do_dirscan(files, cwd, functools.partial(self.do_copy, cwd=cwd, files=files, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
+					self.do_dirscan(files, cwd, functools.partial(self.do_preflight, operation='Copy', cwd=cwd, files=files, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
 		except OSError as e:
 			self.screen.error(f'{e.strerror} ({e.errno})')
 
+	def do_preflight(self, file_list, scan_error, scan_skipped, files, cwd, dest, on_conflict, job_id, operation):
+		if operation == 'Move':
+			mode = 'mv'
+			do_job = self.do_move
+		else:
+			mode = 'cp'
+			do_job = self.do_copy
+
+		try:
+			messages = check_free_space(mode, file_list, dest, self.unarchive_path)
+		except OSError:
+			messages = []
+
+		if not messages:
+			do_job(file_list, scan_error, scan_skipped, files, cwd, dest, on_conflict, job_id)
+			return
+
+		def on_yes(button):
+			self.screen.close_dialog()
+			do_job(file_list, scan_error, scan_skipped, files, cwd, dest, on_conflict, job_id)
+
+		question = f'Target: {", ".join(messages)}. Continue?'
+
+		self.screen.center.focus.force_focus()
+		self.screen.pile.contents[self.screen.main_area] = (urwid.Overlay(DlgQuestion(self, title=operation, question=question,
+			on_yes=on_yes, on_no=lambda x: self.screen.close_dialog()), self.screen.center,
+			'center', max(len(question) + 6, 21),
+			'middle', 'pack',
+		), self.screen.pile.options())
+
 	def do_copy(self, file_list, scan_error, scan_skipped, files, cwd, dest, on_conflict, job_id):
 		self.screen.center.focus.force_focus()
 
@@ -708,23 +970,21 @@ class App(object):
 			job_id = db.new_job('Copy', file_list, scan_error, scan_skipped, files, cwd, dest, on_conflict, archives=archives)
 			del db
 
-		q = Queue()
-		ev_skip = Event()
-		ev_suspend = Event()
+		q = self.backend.queue()
+		info = cpmv_progress()
+		ev_skip = self.backend.event()
+		ev_suspend = self.backend.event()
 		ev_suspend.set()
 		self.suspend.add(ev_suspend)
-		ev_abort = Event()
-		ev_nodb = Event()
-		dlg = DlgCpMvProgress(self, 'Copy', len(file_list), sum((x['lstat'].st_size for x in file_list)), q, ev_skip, ev_suspend, ev_abort, ev_nodb, functools.partial(self.on_finish, operation='Copy', files=files, cwd=cwd, dest=dest, scan_error=scan_error, scan_skipped=scan_skipped, job_id=job_id))
-		self.screen.pile.contents[self.screen.main_area] = (urwid.Overlay(dlg, self.screen.center,
-			'center', ('relative', 75),
-			'middle', 'pack',
-		), self.screen.pile.options())
+		ev_abort = self.backend.event()
+		ev_nodb = self.backend.event()
+		dlg = DlgCpMvProgress(self, 'Copy', len(file_list), sum((x['lstat'].st_size for x in file_list)), q, info, ev_skip, ev_suspend, ev_abort, ev_nodb, functools.partial(self.on_finish, operation='Copy', files=files, cwd=cwd, dest=dest, scan_error=scan_error, scan_skipped=scan_skipped, job_id=job_id))
 
 		fd = self.loop.watch_pipe(dlg.on_pipe_data)
 		dlg.fd = fd
 
-		Thread(target=rnr_cpmv, args=('cp', file_list, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, self.ev_interrupt, ev_abort, ev_nodb, self.dbfile, job_id, self.unarchive_path)).start()
+		worker = self.backend.worker(rnr_cpmv, ('cp', file_list, cwd, dest, on_conflict, fd, q, info, ev_skip, ev_suspend, self.ev_interrupt, ev_abort, ev_nodb, self.dbfile, job_id, self.unarchive_path, self.copy_physical_order, self.fsync_policy, self.fsync_interval))
+		self.submit_job('Copy', f'Copy: {cwd} -> {dest}', dlg, worker, self.get_devices(cwd, dest), ev_suspend, job_id)
 
 	def on_move(self, files, cwd, dest, on_conflict):
 		self.screen.close_dialog()
@@ -751,7 +1011,7 @@ class App(object):
 						for file in files:
 							self.umount_archive(file)
 
-						self.do_dirscan(files, cwd, functools.partial(self.do_move, files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
+						self.do_dirscan(files, cwd, functools.partial(self.do_preflight, operation='Move', files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
 				else:
 					dest_parent = path_dest.parent
 					if not self.unarchive_path(dest_parent)[0].is_dir():
@@ -762,7 +1022,7 @@ class App(object):
 						for file in files:
 							self.umount_archive(file)
 
-						self.do_dirscan(files, cwd, functools.partial(self.do_move, files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
+						self.do_dirscan(files, cwd, functools.partial(self.do_preflight, operation='Move', files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
 			else:
 				if not unarchive_dest.is_dir():
 					self.screen.error(f'{dest} is not a directory')
@@ -772,7 +1032,7 @@ class App(object):
 					for file in files:
 						self.umount_archive(file)
 
-					self.do_dirscan(files, cwd, functools.partial(self.do_move, files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
+					self.do_dirscan(files, cwd, functools.partial(self.do_preflight, operation='Move', files=files, cwd=cwd, dest=str(path_dest), on_conflict=on_conflict, job_id=None))
 		except OSError as e:
 			self.screen.error(f'{e.strerror} ({e.errno})')
 
@@ -785,23 +1045,100 @@ class App(object):
 			job_id = db.new_job('Move', file_list, scan_error, scan_skipped, files, cwd, dest, on_conflict, archives=archives)
 			del db
 
-		q = Queue()
-		ev_skip = Event()
-		ev_suspend = Event()
+		q = self.backend.queue()
+		info = cpmv_progress()
+		ev_skip = self.backend.event()
+		ev_suspend = self.backend.event()
 		ev_suspend.set()
 		self.suspend.add(ev_suspend)
-		ev_abort = Event()
-		ev_nodb = Event()
-		dlg = DlgCpMvProgress(self, 'Move', len(file_list), sum((x['lstat'].st_size for x in file_list)), q, ev_skip, ev_suspend, ev_abort, ev_nodb, functools.partial(self.on_finish, operation='Move', files=files, cwd=cwd, dest=dest, scan_error=scan_error, scan_skipped=scan_skipped, job_id=job_id))
-		self.screen.pile.contents[self.screen.main_area] = (urwid.Overlay(dlg, self.screen.center,
+		ev_abort = self.backend.event()
+		ev_nodb = self.backend.event()
+		dlg = DlgCpMvProgress(self, 'Move', len(file_list), sum((x['lstat'].st_size for x in file_list)), q, info, ev_skip, ev_suspend, ev_abort, ev_nodb, functools.partial(self.on_finish, operation='Move', files=files, cwd=cwd, dest=dest, scan_error=scan_error, scan_skipped=scan_skipped, job_id=job_id))
+
+		fd = self.loop.watch_pipe(dlg.on_pipe_data)
+		dlg.fd = fd
+
+		worker = self.backend.worker(rnr_cpmv, ('mv', file_list, cwd, dest, on_conflict, fd, q, info, ev_skip, ev_suspend, self.ev_interrupt, ev_abort, ev_nodb, self.dbfile, job_id, self.unarchive_path, False, self.fsync_policy, self.fsync_interval))
+		self.submit_job('Move', f'Move: {cwd} -> {dest}', dlg, worker, self.get_devices(cwd, dest), ev_suspend, job_id)
+
+	def get_devices(self, *paths):
+		devices = set()
+		for path in paths:
+			try:
+				devices.add(os.stat(existing_dir(self.unarchive_path(path)[0])).st_dev)
+			except OSError:
+				pass
+
+		return devices
+
+	def submit_job(self, operation, title, dlg, worker, devices, ev_suspend, job_id):
+		def start():
+			if self.dbfile and (job_id is not None):
+				db = DataBase(self.dbfile)
+				db.set_job_status(job_id, 'IN_PROGRESS')
+				del db
+
+			self.backend.start(worker, dlg.fd)
+			dlg.start_refresh()
+
+		job = {
+			'title': title,
+			'dlg': dlg,
+			'devices': devices,
+			'ev_suspend': ev_suspend,
+			'start': start,
+		}
+
+		if self.scheduler.submit(job):
+			self.show_job(job)
+		else:
+			if self.dbfile and (job_id is not None):
+				db = DataBase(self.dbfile)
+				db.set_job_status(job_id, 'QUEUED')
+				del db
+
+			self.screen.error(f'{operation} job queued (ALT-J to show the jobs)', title='Jobs', error=False)
+
+	def show_job(self, job):
+		self.screen.center.focus.force_focus()
+
+		self.screen.pile.contents[self.screen.main_area] = (urwid.Overlay(job['dlg'], self.screen.center,
 			'center', ('relative', 75),
 			'middle', 'pack',
 		), self.screen.pile.options())
 
-		fd = self.loop.watch_pipe(dlg.on_pipe_data)
-		dlg.fd = fd
+		if job['status'] == 'RUNNING':
+			job['dlg'].start_refresh()
+
+	def show_jobs(self):
+		self.screen.center.focus.force_focus()
+
+		self.screen.pile.contents[self.screen.main_area] = (urwid.Overlay(DlgJobs(self, self.scheduler), self.screen.center,
+			'center', ('relative', 75),
+			'middle', ('relative', 50),
+		), self.screen.pile.options())
+
+	def finish_job(self, dlg, on_complete):
+		for job in self.scheduler.jobs:
+			if job['dlg'] is dlg:
+				self.scheduler.finish(job)
+				break
+
+		if self.old_screen or (self.screen.get_dialog() is not None):
+			self.pending_reports.append(on_complete)
+		else:
+			on_complete()
 
-		Thread(target=rnr_cpmv, args=('mv', file_list, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, self.ev_interrupt, ev_abort, ev_nodb, self.dbfile, job_id, self.unarchive_path)).start()
+	def schedule_pending_reports(self):
+		if self.pending_reports and self.loop:
+			self.loop.set_alarm_in(0, self.show_pending_reports)
+
+	def show_pending_reports(self, loop=None, user_data=None):
+		if self.old_screen:
+			return
+
+		while self.pending_reports and (self.screen.get_dialog() is None):
+			self.pending_reports.pop(0)()
 
 	def check_pending_jobs(self):
 		if not self.dbfile:
@@ -809,6 +1146,7 @@ class App(object):
 
 		db = DataBase(self.dbfile)
 		self.pending_jobs.extend(db.get_jobs())
+		db.recover_trash()
 		del db
 
 		if self.pending_jobs:
@@ -845,6 +1183,7 @@ class App(object):
 			self.loop.widget = self.screen
 			self.set_input_rnr()
 			self.reload()
+			self.schedule_pending_reports()
 		elif key in ('q', 'Q', 'f10'):
 			self.quit()
 
@@ -857,30 +1196,63 @@ class App(object):
 		self.loop._unhandled_input = self.keypress
 
 	def unarchive_path(self, file, include_self=True):
-		file = Path(os.path.normpath(file))
+		return self.archive_resolver.unarchive_path(file, include_self)
 
-		for archive_file, temp_dir, panels in reversed(self.archive_dirs):
-			if (include_self and (file == archive_file)) or (archive_file in file.parents):
-				file = Path(str(file).replace(str(archive_file), str(temp_dir), 1))
-				break
-		else:
-			archive_file = None
-			temp_dir = None
+	def archive_path(self, file, include_self=True):
+		return self.archive_resolver.archive_path(file, include_self)
 
-		return (file, archive_file, temp_dir)
+	def watch_dir(self, panel, path):
+		if not self.inotify:
+			return
 
-	def archive_path(self, file, include_self=True):
-		file = Path(os.path.normpath(file))
+		try:
+			wd = self.inotify.add_watch(path, IN_CREATE | IN_DELETE | IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+		except OSError:
+			self.unwatch_dir(panel)
+			return
 
-		for archive_file, temp_dir, panels in self.archive_dirs:
-			if (include_self and (file == temp_dir)) or (temp_dir in file.parents):
-				file = Path(str(file).replace(str(temp_dir), str(archive_file), 1))
-				break
-		else:
-			archive_file = None
-			temp_dir = None
+		if wd != panel.watch_wd:
+			self.unwatch_dir(panel)
+			self.watches.setdefault(wd, set()).add(panel)
+			panel.watch_wd = wd
+
+	def unwatch_dir(self, panel):
+		wd = panel.watch_wd
+		if wd is None:
+			return
+
+		panel.watch_wd = None
+
+		panels = self.watches.get(wd, set())
+		panels.discard(panel)
+		if not panels:
+			self.watches.pop(wd, None)
+			try:
+				self.inotify.rm_watch(wd)
+			except OSError:
+				pass
 
-		return (file, archive_file, temp_dir)
+	def poll_inotify(self):
+		try:
+			events = self.inotify.read_events()
+		except OSError:
+			return
+
+		for wd, mask, cookie, name in events:
+			if mask & IN_Q_OVERFLOW:
+				panels = set().union(*self.watches.values())
+			else:
+				panels = self.watches.get(wd, ())
+
+			for panel in panels:
+				panel.on_dir_event(mask, name)
+
+			# The watch of a directory that is gone is removed by the kernel,
+			# and its number may be given to another directory later
+			if mask & IN_IGNORED:
+				for panel in self.watches.pop(wd, ()):
+					if panel.watch_wd == wd:
+						panel.watch_wd = None
 
 	def add_archive_dir(self, archive_file, temp_dir, panel):
 		for existing_archive_file, existing_temp_dir, panels in self.archive_dirs:
@@ -890,6 +1262,7 @@ class App(object):
 		else:
 			self.archive_dirs.append((archive_file, temp_dir, {panel}))
 			self.archive_dirs.sort(key=lambda x: str(x[0]).replace(os.sep, '\0'))
+			self.archive_resolver = ArchiveResolver(self.archive_dirs)
 
 	def update_archive_dirs(self, cwd, old_cwd, panel):
 		i_umount = []
@@ -904,6 +1277,7 @@ class App(object):
 
 		for i in i_umount:
 			(archive_file, temp_dir, panels) = self.archive_dirs.pop(i)
+			self.archive_resolver = ArchiveResolver(self.archive_dirs)
 
 			try:
 				umount_proc = subprocess.run(['umount', temp_dir], cwd=self.unarchive_path(cwd)[0], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
@@ -1036,7 +1410,29 @@ class App(object):
 			self.archive_mounter_proc = None
 			self.archive_mounter_alarm_handle = None
 
-	def quit(self):
+	def quit(self, force=False):
+		active_jobs = [x for x in self.scheduler.jobs if x['dlg'] is not None]
+		if active_jobs and (not force):
+			def on_yes(button):
+				self.screen.close_dialog()
+				self.quit(force=True)
+
+			self.screen.center.focus.force_focus()
+
+			question = f'{len(active_jobs)} jobs still active. Interrupt them and quit?'
+			self.screen.pile.contents[self.screen.main_area] = (urwid.Overlay(DlgQuestion(self, title='Quit', question=question,
+				on_yes=on_yes, on_no=lambda x: self.screen.close_dialog()), self.screen.center,
+				'center', len(question) + 6,
+				'middle', 'pack',
+			), self.screen.pile.options())
+			return
+
+		if self.scheduler.jobs:
+			self.ev_interrupt.set()
+
+			for ev in self.suspend:
+				ev.set()
+
 		cwd = self.screen.center.focus.cwd
 		while True:
 			(cwd, archive_file, temp_dir) = self.unarchive_path(cwd)
@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+from pathlib import Path
+
+from .debug_print import (debug_print, debug_pprint)
+
+
+CACHE_SIZE = 65536
+
+
+class ArchiveResolver(object):
+	# The mounted archives never change during the life of a resolver: the
+	# App creates a new one at every mount and umount, so that the workers
+	# can share it without locking
+	def __init__(self, archive_dirs):
+		self.archives = {}
+		self.temp_dirs = {}
+		for archive_file, temp_dir, panels in archive_dirs:
+			self.archives[str(archive_file)] = (archive_file, temp_dir)
+			self.temp_dirs.setdefault(str(temp_dir), (archive_file, temp_dir))
+
+		self.unarchive_cache = {}
+		self.archive_cache = {}
+
+	def resolve(self, prefixes, cache, file, include_self, reverse):
+		key = (file, include_self)
+		result = cache.get(key)
+		if result is not None:
+			return result
+
+		file = os.path.normpath(file)
+		result = None
+
+		if prefixes:
+			# Longest prefix match, from the file up to the root
+			prefix = file if include_self else os.path.dirname(file)
+			while True:
+				entry = prefixes.get(prefix)
+				if entry is not None:
+					(archive_file, temp_dir) = entry
+					new_prefix = str(archive_file if reverse else temp_dir)
+					result = (Path(new_prefix + file[len(prefix):]), archive_file, temp_dir)
+					break
+
+				parent = os.path.dirname(prefix)
+				if parent == prefix:
+					break
+
+				prefix = parent
+
+		if result is None:
+			result = (Path(file), None, None)
+
+		if len(cache) >= CACHE_SIZE:
+			cache.clear()
+
+		cache[key] = result
+
+		return result
+
+	def unarchive_path(self, file, include_self=True):
+		return self.resolve(self.archives, self.unarchive_cache, file, include_self, False)
+
+	def archive_path(self, file, include_self=True):
+		return self.resolve(self.temp_dirs, self.archive_cache, file, include_self, True)
@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+import signal
+import multiprocessing
+
+from queue import Queue
+from threading import (Thread, Event)
+
+from .debug_print import (debug_print, debug_pprint)
+
+
+def process_main(target, *args):
+	# CTRL-C reaches the whole process group: the UI process interrupts the
+	# workers through ev_interrupt, so the workers themselves ignore it
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	target(*args)
+
+
+class Backend(object):
+	def __init__(self, kind):
+		self.ctx = None
+
+		# The workers are forked from a process that already runs the
+		# directory counting, listing and preview threads. A forked worker
+		# must only touch the objects made for it, as the locks of the other
+		# threads are copied in whatever state they were
+		if kind == 'process':
+			try:
+				self.ctx = multiprocessing.get_context('fork')
+			except ValueError:
+				pass
+
+	def event(self):
+		if self.ctx:
+			return self.ctx.Event()
+
+		return Event()
+
+	def queue(self):
+		if self.ctx:
+			return self.ctx.SimpleQueue()
+
+		return Queue()
+
+	def worker(self, target, args):
+		if self.ctx:
+			return self.ctx.Process(target=process_main, args=(target, *args))
+
+		return Thread(target=target, args=args)
+
+	def start(self, worker, fd):
+		worker.start()
+
+		# The worker process got its own copy of the write end of the pipe,
+		# and it closes it when done
+		if self.ctx:
+			os.close(fd)
+
+	def receive(self, q, data):
+		# A worker process that died before sending its result closes the
+		# pipe without writing to it: the read is empty, and nothing is queued
+		if (not data) and q.empty():
+			return None
+
+		return q.get()
@@ -6,6 +6,21 @@ EDITOR = os.environ.get('VISUAL', os.environ.get('EDITOR', 'vi'))
 
 USE_INTERNAL_VIEWER = True
 COUNT_DIRECTORIES = True
+ONE_FILESYSTEM = False
+SCAN_BY_DEVICE = False
+COPY_PHYSICAL_ORDER = False
+MAX_JOBS_PER_DEVICE = 1
+PROGRESS_REFRESH_INTERVAL = 0.1
+WORKER_BACKEND = 'thread'
+DELETE_WORKERS = 4
+DELETE_TO_TRASH = False
+TRASH_REAP_DELAY = 300
+REAPER_PRIORITY = -10
+FSYNC_POLICY = 'file'
+FSYNC_INTERVAL = 5
+DIR_COUNT_WORKERS = 4
+LIVE_REFRESH = True
+PREVIEW_DELAY = 0.1
 
 # Theme
 SHOW_BUTTONBAR = True
@@ -19,6 +19,7 @@
 import sys
 import os
 
+import time
 import sqlite3
 import json
 
@@ -104,6 +105,15 @@ class DataBase(object):
 					FOREIGN KEY (job_id) REFERENCES jobs(id) ON DELETE CASCADE
 				);
 
+				CREATE TABLE IF NOT EXISTS trash (
+					id INTEGER NOT NULL PRIMARY KEY,
+					batch INTEGER NOT NULL,
+					file TEXT NOT NULL,
+					trash TEXT NOT NULL,
+					time REAL NOT NULL,
+					status TEXT NOT NULL
+				);
+
 				CREATE TABLE IF NOT EXISTS misc (
 					k TEXT NOT NULL PRIMARY KEY,
 					v TEXT
@@ -210,6 +220,16 @@ class DataBase(object):
 		except sqlite3.OperationalError:
 			pass
 
+	def set_files_status(self, file_status_list):
+		if self.conn is None:
+			return
+
+		try:
+			with self.conn:
+				self.conn.executemany('''UPDATE files SET status = ?, message = ? WHERE id = ?''', [(status, message, file['id']) for file, status, message in file_status_list])
+		except sqlite3.OperationalError:
+			pass
+
 	def set_job_status(self, job_id, status):
 		if self.conn is None:
 			return
@@ -414,3 +434,136 @@ class DataBase(object):
 
 		return file_list
 
+	def new_trash_batch(self):
+		batch = None
+
+		if self.conn is None:
+			return batch
+
+		try:
+			with self.conn:
+				c = self.conn.execute('''SELECT MAX(batch) FROM trash''')
+				batch = (c.fetchone()[0] or 0) + 1
+				c.close()
+		except sqlite3.OperationalError:
+			pass
+
+		return batch
+
+	def add_trash(self, batch, file, trash):
+		trash_id = None
+
+		if self.conn is None:
+			return trash_id
+
+		try:
+			with self.conn:
+				c = self.conn.execute('''INSERT INTO trash (batch, file, trash, time, status) VALUES (?, ?, ?, ?, ?)''', (
+					batch,
+					str(file),
+					str(trash),
+					time.time(),
+					'TRASHED',
+				))
+				trash_id = c.lastrowid
+				c.close()
+		except sqlite3.OperationalError:
+			pass
+
+		return trash_id
+
+	def get_trash(self, before=None):
+		trash = []
+
+		if self.conn is None:
+			return trash
+
+		try:
+			with self.conn:
+				if before is None:
+					c = self.conn.execute('''SELECT * FROM trash WHERE status = ? ORDER BY id''', ('TRASHED',))
+				else:
+					c = self.conn.execute('''SELECT * FROM trash WHERE status = ? AND time < ? ORDER BY id''', ('TRASHED', before))
+
+				trash.extend([dict(x) for x in c.fetchall()])
+				c.close()
+		except sqlite3.OperationalError:
+			pass
+
+		return trash
+
+	def get_last_trash_batch(self):
+		trash = []
+
+		if self.conn is None:
+			return trash
+
+		try:
+			with self.conn:
+				c = self.conn.execute('''SELECT * FROM trash WHERE status = ? AND batch = (SELECT MAX(batch) FROM trash WHERE status = ?) ORDER BY id''', ('TRASHED', 'TRASHED'))
+				trash.extend([dict(x) for x in c.fetchall()])
+				c.close()
+		except sqlite3.OperationalError:
+			pass
+
+		return trash
+
+	def set_trash_status(self, trash_id, status):
+		if self.conn is None:
+			return
+
+		try:
+			with self.conn:
+				self.conn.execute('''UPDATE trash SET status = ? WHERE id = ?''', (
+					status,
+					trash_id,
+				))
+		except sqlite3.OperationalError:
+			pass
+
+	def claim_trash(self, trash_id, status):
+		claimed = False
+
+		if self.conn is None:
+			return claimed
+
+		try:
+			with self.conn:
+				c = self.conn.execute('''UPDATE trash SET status = ? WHERE id = ? AND status = ?''', (
+					status,
+					trash_id,
+					'TRASHED',
+				))
+				claimed = (c.rowcount == 1)
+				c.close()
+		except sqlite3.OperationalError:
+			pass
+
+		return claimed
+
+	def recover_trash(self):
+		if self.conn is None:
+			return
+
+		# Whatever was being reaped or restored when rnr died, and whatever
+		# could not be removed last time, gets another chance
+		try:
+			with self.conn:
+				self.conn.execute('''UPDATE trash SET status = ? WHERE status <> ?''', (
+					'TRASHED',
+					'TRASHED',
+				))
+		except sqlite3.OperationalError:
+			pass
+
+	def delete_trash(self, trash_id):
+		if self.conn is None:
+			return
+
+		try:
+			with self.conn:
+				self.conn.execute('''DELETE FROM trash WHERE id = ?''', (
+					trash_id,
+				))
+		except sqlite3.OperationalError:
+			pass
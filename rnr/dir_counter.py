@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+import queue
+import threading
+
+from .debug_print import (debug_print, debug_pprint)
+
+
+CACHE_SIZE = 65536
+
+
+class DirCounter(object):
+	def __init__(self, num_workers):
+		self.num_workers = max(num_workers, 1)
+		self.workers = []
+		self.requests = queue.Queue()
+
+		# A directory gets a new mtime whenever an entry is added or
+		# removed, so a cached count is valid as long as the key matches
+		self.cache = {}
+		self.lock = threading.Lock()
+
+	def get(self, st):
+		with self.lock:
+			return self.cache.get((st.st_dev, st.st_ino, st.st_mtime_ns))
+
+	def count(self, file, path, fd, q, ev_cancel):
+		# The workers are daemon threads, so that a scandir hanging on a
+		# dead network file system does not keep rnr from quitting
+		if len(self.workers) < self.num_workers:
+			worker = threading.Thread(target=self.worker, daemon=True)
+			worker.start()
+			self.workers.append(worker)
+
+		self.requests.put((file, path, fd, q, ev_cancel))
+
+	def worker(self):
+		while True:
+			self.count_entries(*self.requests.get())
+
+	def count_entries(self, file, path, fd, q, ev_cancel):
+		if ev_cancel.is_set():
+			return
+
+		st = file['stat']
+		try:
+			length = 0
+			with os.scandir(path) as it:
+				for entry in it:
+					length += 1
+
+			with self.lock:
+				if len(self.cache) >= CACHE_SIZE:
+					self.cache.clear()
+
+				self.cache[(st.st_dev, st.st_ino, st.st_mtime_ns)] = length
+		except OSError:
+			length = -1
+
+		try:
+			q.put((ev_cancel, file, length))
+			os.write(fd, b'\n')
+		except OSError:
+			pass
@@ -29,7 +29,8 @@ class DlgCancelable(urwid.WidgetWrap):
 	def __init__(self, controller, title, message, on_cancel):
 		self.controller = controller
 
-		w = urwid.Filler(urwid.Text(f' {message} ', align='center', layout=TildeLayout))
+		self.message = urwid.Text(f' {message} ', align='center', layout=TildeLayout)
+		w = urwid.Filler(self.message)
 		w = urwid.LineBox(w, title, title_attr='dialog_title', bline='')
 		top = urwid.Padding(w, left=1, right=1)
 
@@ -57,3 +58,5 @@ class DlgCancelable(urwid.WidgetWrap):
 		if key in (' ', 'enter'):
 			return super().keypress(size, key)
 
+	def set_message(self, message):
+		self.message.set_text(f' {message} ')
@@ -19,6 +19,8 @@
 import sys
 import os
 
+import functools
+
 import urwid
 
 from .utils import (human_readable_size, format_seconds, TildeLayout)
@@ -26,11 +28,12 @@ from .debug_print import (debug_print, debug_pprint)
 
 
 class DlgCpMvProgress(urwid.WidgetWrap):
-	def __init__(self, controller, title, num_files, total_size, q, ev_skip, ev_suspend, ev_abort, ev_nodb, on_complete):
+	def __init__(self, controller, title, num_files, total_size, q, info, ev_skip, ev_suspend, ev_abort, ev_nodb, on_complete):
 		self.controller = controller
 		self.num_files = num_files
 		self.total_size = total_size
 		self.q = q
+		self.info = info
 		self.ev_skip = ev_skip
 		self.ev_suspend = ev_suspend
 		self.ev_abort = ev_abort
@@ -75,7 +78,9 @@ class DlgCpMvProgress(urwid.WidgetWrap):
 		attr_btn_abort = urwid.AttrMap(self.btn_abort, 'dialog', 'dialog_focus')
 		self.btn_nodb = urwid.Button('No DB', lambda x: self.on_nodb())
 		attr_btn_nodb = urwid.AttrMap(self.btn_nodb, 'dialog', 'dialog_focus')
-		w = urwid.Columns([urwid.Divider(' '), (8, attr_btn_skip), (1, urwid.Text(' ')), (12, attr_btn_suspend), (1, urwid.Text(' ')), (9, attr_btn_abort), (1, urwid.Text(' ')), (9, attr_btn_nodb), urwid.Divider(' ')])
+		self.btn_background = urwid.Button('Background', lambda x: self.on_background())
+		attr_btn_background = urwid.AttrMap(self.btn_background, 'dialog', 'dialog_focus')
+		w = urwid.Columns([urwid.Divider(' '), (8, attr_btn_skip), (1, urwid.Text(' ')), (12, attr_btn_suspend), (1, urwid.Text(' ')), (9, attr_btn_abort), (1, urwid.Text(' ')), (9, attr_btn_nodb), (1, urwid.Text(' ')), (14, attr_btn_background), urwid.Divider(' ')])
 		w = urwid.LineBox(urwid.Filler(w), tlcorner='├', trcorner='┤')
 		bottom = urwid.Padding(w, left=1, right=1)
 
@@ -90,6 +95,8 @@ class DlgCpMvProgress(urwid.WidgetWrap):
 
 		super().__init__(w)
 
+		self.alarm_handle = None
+
 	def keypress(self, size, key):
 		if key in ('left', 'right', ' ', 'enter'):
 			return super().keypress(size, key)
@@ -100,37 +107,60 @@ class DlgCpMvProgress(urwid.WidgetWrap):
 
 	def on_pipe_data(self, data):
 		retval = None
-		info = None
-		while not self.q.empty():
-			info = self.q.get()
+		info = self.controller.backend.receive(self.q, data)
 
-		if not info:
-			pass
-		elif 'result' in info:
+		if (info is None) or ('result' in info):
 			retval = False
-			self.controller.screen.close_dialog()
-			self.controller.suspend.discard(self.ev_suspend)
-			self.on_complete(info['result'], info['error'], info['skipped'], info['aborted'])
-		else:
-			self.source.set_text(info['cur_source'])
-			self.target.set_text(info['cur_target'])
-			self.progress_current.done = info['cur_size'] or 1
+			if self.alarm_handle is not None:
+				self.controller.loop.remove_alarm(self.alarm_handle)
+				self.alarm_handle = None
 
-			bps = info['cur_bytes'] / (info['cur_time'] or 1)
-			eta = max(int(round((info['cur_size'] - info['cur_bytes']) / (bps or 1))), 0)
-			self.time_current.set_text(f'{human_readable_size(info["cur_bytes"])}/{human_readable_size(info["cur_size"])} ETA {format_seconds(eta)} ({human_readable_size(int(round(bps)))}/s)')
-			self.progress_current.set_completion(info['cur_bytes'])
+			if self.controller.screen.get_dialog() is self:
+				self.controller.screen.close_dialog()
 
-			self.divider.set_title(f'Total: {human_readable_size(info["bytes"])}/{human_readable_size(self.total_size)}')
-			self.files.set_text(f'Files processed: {info["files"]}/{self.num_files}')
+			self.controller.suspend.discard(self.ev_suspend)
 
-			bps = info['bytes'] / (info['time'] or 1)
-			eta = max(int(round((self.total_size - info['bytes']) / (bps or 1))), 0)
-			self.time.set_text(f'Time: {format_seconds(info["time"])} ETA {format_seconds(eta)} ({human_readable_size(int(round(bps)))}/s)')
-			self.progress_total.set_completion(info['bytes'])
+			# The job stays in the database, and can be resumed
+			if info is None:
+				self.controller.finish_job(self, lambda: self.controller.screen.error('The worker ended before finishing the job', callback=self.controller.reload))
+			else:
+				self.controller.finish_job(self, functools.partial(self.on_complete, info['result'], info['error'], info['skipped'], info['aborted']))
 
 		return retval
 
+	def start_refresh(self):
+		if self.alarm_handle is None:
+			self.on_refresh()
+
+	def on_refresh(self, loop=None, user_data=None):
+		self.alarm_handle = None
+
+		# The progress is refreshed only while the dialog is shown, and the
+		# job is running
+		if self.controller.screen.get_dialog() is not self:
+			return
+
+		info = self.info.snapshot()
+
+		self.source.set_text(info['cur_source'])
+		self.target.set_text(info['cur_target'])
+		self.progress_current.done = info['cur_size'] or 1
+
+		bps = info['cur_bytes'] / (info['cur_time'] or 1)
+		eta = max(int(round((info['cur_size'] - info['cur_bytes']) / (bps or 1))), 0)
+		self.time_current.set_text(f'{human_readable_size(info["cur_bytes"])}/{human_readable_size(info["cur_size"])} ETA {format_seconds(eta)} ({human_readable_size(int(round(bps)))}/s)')
+		self.progress_current.set_completion(info['cur_bytes'])
+
+		self.divider.set_title(f'Total: {human_readable_size(info["bytes"])}/{human_readable_size(self.total_size)}')
+		self.files.set_text(f'Files processed: {info["files"]}/{self.num_files}')
+
+		bps = info['bytes'] / (info['time'] or 1)
+		eta = max(int(round((self.total_size - info['bytes']) / (bps or 1))), 0)
+		self.time.set_text(f'Time: {format_seconds(info["time"])} ETA {format_seconds(eta)} ({human_readable_size(int(round(bps)))}/s)')
+		self.progress_total.set_completion(info['bytes'])
+
+		self.alarm_handle = self.controller.loop.set_alarm_in(self.controller.progress_refresh_interval, self.on_refresh)
+
 	def on_skip(self):
 		if self.aborted:
 			return
@@ -165,3 +195,6 @@ class DlgCpMvProgress(urwid.WidgetWrap):
 	def on_nodb(self):
 		self.ev_nodb.set()
 
+	def on_background(self):
+		self.controller.screen.close_dialog()
+
@@ -26,9 +26,10 @@ from .debug_print import (debug_print, debug_pprint)
 
 
 class DlgDirscan(urwid.WidgetWrap):
-	def __init__(self, controller, cwd, q, ev_abort, ev_skip, on_complete):
+	def __init__(self, controller, cwd, q, info, ev_abort, ev_skip, on_complete):
 		self.controller = controller
 		self.q = q
+		self.info = info
 		self.ev_abort = ev_abort
 		self.ev_skip = ev_skip
 		self.on_complete = on_complete
@@ -62,6 +63,8 @@ class DlgDirscan(urwid.WidgetWrap):
 
 		super().__init__(w)
 
+		self.alarm_handle = self.controller.loop.set_alarm_in(self.controller.progress_refresh_interval, self.on_refresh)
+
 	def keypress(self, size, key):
 		if key in ('left', 'right', ' ', 'enter'):
 			return super().keypress(size, key)
@@ -72,24 +75,33 @@ class DlgDirscan(urwid.WidgetWrap):
 
 	def on_pipe_data(self, data):
 		retval = None
-		info = None
-		while not self.q.empty():
-			info = self.q.get()
+		info = self.controller.backend.receive(self.q, data)
 
-		if not info:
-			pass
-		elif 'result' in info:
+		if (info is None) or ('result' in info):
 			retval = False
+			self.controller.loop.remove_alarm(self.alarm_handle)
+			self.alarm_handle = None
+
 			self.controller.screen.close_dialog()
-			if not self.ev_abort.is_set():
+			if info is None:
+				self.controller.screen.error('The worker ended before finishing the job')
+			elif not self.ev_abort.is_set():
 				self.on_complete(info['result'], info['error'], info['skipped'])
-		else:
-			self.current.set_text(info['current'])
-			self.files.set_text(f'Files: {info["files"]}')
-			self.bytes.set_text(f'Total size: {human_readable_size(info["bytes"])}')
 
 		return retval
 
+	def on_refresh(self, loop=None, user_data=None):
+		if self.alarm_handle is None:
+			return
+
+		info = self.info.snapshot()
+
+		self.current.set_text(info['current'])
+		self.files.set_text(f'Files: {info["files"]}')
+		self.bytes.set_text(f'Total size: {human_readable_size(info["bytes"])}')
+
+		self.alarm_handle = self.controller.loop.set_alarm_in(self.controller.progress_refresh_interval, self.on_refresh)
+
 	def on_abort(self):
 		self.ev_abort.set()
 		self.controller.screen.close_dialog()
@@ -0,0 +1,142 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+import urwid
+
+from .panel import SelectableColumns
+from .utils import TildeLayout
+from .debug_print import (debug_print, debug_pprint)
+
+
+class DlgJobs(urwid.WidgetWrap):
+	def __init__(self, controller, scheduler):
+		self.controller = controller
+		self.scheduler = scheduler
+
+		self.walker = urwid.SimpleFocusListWalker([])
+		self.listbox = urwid.ListBox(self.walker)
+		w = urwid.LineBox(urwid.Padding(self.listbox, left=1, right=1), 'Jobs', title_attr='dialog_title', bline='')
+		top = urwid.Padding(w, left=1, right=1)
+
+		self.btn_show = urwid.Button('Show', lambda x: self.on_show())
+		attr_btn_show = urwid.AttrMap(self.btn_show, 'dialog', 'dialog_focus')
+		self.btn_up = urwid.Button('+Prio', lambda x: self.on_priority(1))
+		attr_btn_up = urwid.AttrMap(self.btn_up, 'dialog', 'dialog_focus')
+		self.btn_down = urwid.Button('-Prio', lambda x: self.on_priority(-1))
+		attr_btn_down = urwid.AttrMap(self.btn_down, 'dialog', 'dialog_focus')
+		self.btn_close = urwid.Button('Close', lambda x: self.on_close())
+		attr_btn_close = urwid.AttrMap(self.btn_close, 'dialog', 'dialog_focus')
+		w = urwid.Columns([urwid.Divider(' '), (8, attr_btn_show), (1, urwid.Text(' ')), (9, attr_btn_up), (1, urwid.Text(' ')), (9, attr_btn_down), (1, urwid.Text(' ')), (9, attr_btn_close), urwid.Divider(' ')])
+		w = urwid.LineBox(urwid.Filler(w), tlcorner='├', trcorner='┤')
+		bottom = urwid.Padding(w, left=1, right=1)
+
+		self.pile = urwid.Pile([
+			(1, urwid.Filler(urwid.Text(' '))),
+			top,
+			(3, bottom),
+			(1, urwid.Filler(urwid.Text(' '))),
+		])
+		self.pile.set_focus(1)
+		w = urwid.AttrMap(self.pile, 'dialog')
+
+		self.update_list()
+
+		super().__init__(w)
+
+	def update_list(self, focus_job=None):
+		self.jobs = self.scheduler.get_jobs()
+
+		l = []
+		for job in self.jobs:
+			w = SelectableColumns([(9, urwid.Text(self.scheduler.get_status(job))), (4, urwid.Text(f'{job["priority"]:+d}', align='right')), urwid.Text(job['title'], wrap='ellipsis', layout=TildeLayout)], dividechars=1)
+			l.append(urwid.AttrMap(w, 'dialog', 'dialog_focus'))
+
+		if not l:
+			l.append(urwid.Text('No jobs'))
+
+		self.walker[:] = l
+
+		if focus_job in self.jobs:
+			self.walker.set_focus(self.jobs.index(focus_job))
+
+	def get_focus(self):
+		if not self.jobs:
+			return None
+
+		return self.jobs[self.walker.focus]
+
+	def keypress(self, size, key):
+		if key in ('esc', 'f10', 'q', 'Q'):
+			self.btn_close.keypress(size, 'enter')
+			return
+
+		if key in ('left', 'right', ' '):
+			return super().keypress(size, key)
+		elif key == 'enter':
+			if self.pile.focus_position == 1:
+				self.on_show()
+			else:
+				return super().keypress(size, key)
+		elif key == 'h':
+			return super().keypress(size, 'left')
+		elif key == 'l':
+			return super().keypress(size, 'right')
+		elif key == '+':
+			self.on_priority(1)
+		elif key == '-':
+			self.on_priority(-1)
+		elif key in ('j', 'down'):
+			self.listbox.keypress(size, 'down')
+		elif key in ('k', 'up'):
+			self.listbox.keypress(size, 'up')
+		elif key in ('g', 'home'):
+			self.listbox.keypress(size, 'home')
+		elif key in ('G', 'end'):
+			self.listbox.keypress(size, 'end')
+
+	def mouse_event(self, size, event, button, col, row, focus):
+		super().mouse_event(size, event, button, col, row, focus)
+
+		if 'press' not in event.split():
+			return
+
+		if button == 4:
+			self.keypress(size, 'up')
+		elif button == 5:
+			self.keypress(size, 'down')
+
+	def on_show(self):
+		job = self.get_focus()
+		if (job is None) or (job['dlg'] is None):
+			return
+
+		self.controller.screen.close_dialog()
+		self.controller.show_job(job)
+
+	def on_priority(self, delta):
+		job = self.get_focus()
+		if job is None:
+			return
+
+		self.scheduler.set_priority(job, job['priority'] + delta)
+		self.update_list(job)
+
+	def on_close(self):
+		self.controller.screen.close_dialog()
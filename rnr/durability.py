@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+import time
+import ctypes
+
+from ctypes.util import find_library
+
+from .debug_print import (debug_print, debug_pprint)
+
+
+FSYNC_POLICIES = ('file', 'directory', 'checkpoint', 'job')
+
+
+libc = ctypes.CDLL(find_library('c'))
+prototype = ctypes.CFUNCTYPE(ctypes.c_int, *[ctypes.c_int], use_errno=True)
+
+try:
+	_syncfs = prototype(('syncfs', libc))
+except AttributeError:
+	_syncfs = None
+
+
+def syncfs(fd):
+	if _syncfs is None:
+		os.sync()
+		return
+
+	if _syncfs(fd) < 0:
+		e = ctypes.get_errno()
+		raise OSError(e, os.strerror(e))
+
+def open_dir(dir_):
+	# A directory that has been removed in the meantime is synced through
+	# its nearest existing ancestor
+	while True:
+		try:
+			return os.open(dir_, os.O_RDONLY | os.O_DIRECTORY)
+		except FileNotFoundError:
+			parent = os.path.dirname(dir_)
+			if parent == dir_:
+				raise
+
+			dir_ = parent
+
+def fsync_dir(dir_):
+	dir_fd = open_dir(dir_)
+	try:
+		os.fsync(dir_fd)
+	except OSError as e:
+		raise OSError(e.errno, e.strerror, dir_)
+	finally:
+		os.close(dir_fd)
+
+def syncfs_dirs(dirs):
+	devices = set()
+	for dir_ in dirs:
+		dir_fd = open_dir(dir_)
+		try:
+			dev = os.fstat(dir_fd).st_dev
+			if dev not in devices:
+				devices.add(dev)
+				try:
+					syncfs(dir_fd)
+				except OSError as e:
+					raise OSError(e.errno, e.strerror, dir_)
+		finally:
+			os.close(dir_fd)
+
+
+class Durability(object):
+	# The file statuses are written to the journal only after the changes
+	# they describe reached the disk, so that a resumed job redoes whatever
+	# was lost in a crash, instead of skipping it
+	def __init__(self, policy, interval, dbfile, sync_data=True):
+		if policy not in FSYNC_POLICIES:
+			policy = 'file'
+
+		if not dbfile:
+			policy = 'job'
+
+		self.policy = policy
+		self.interval = interval
+		self.sync_data = sync_data
+		self.dirs = set()
+		self.pending = []
+		self.last_sync = time.monotonic()
+		self.error = None
+
+	def data_sync(self):
+		return self.policy == 'file'
+
+	def add(self, dirs, entries, db):
+		dirs = set(dirs)
+
+		if (self.policy == 'directory') and self.dirs and (not dirs <= self.dirs):
+			self.flush(db)
+
+		self.dirs.update(dirs)
+		self.pending.extend(entries)
+
+		if self.policy == 'file':
+			self.flush(db)
+		elif (self.policy == 'checkpoint') and ((time.monotonic() - self.last_sync) >= self.interval):
+			self.flush(db)
+
+	def flush(self, db):
+		(dirs, pending) = (self.dirs, self.pending)
+		self.dirs = set()
+		self.pending = []
+		self.last_sync = time.monotonic()
+
+		try:
+			# With the file policy every change has already been synced by
+			# the caller, as it happened
+			if (self.policy == 'directory') and (not self.sync_data):
+				for dir_ in dirs:
+					fsync_dir(dir_)
+			elif self.policy != 'file':
+				syncfs_dirs(dirs)
+		except OSError as e:
+			# The entries stay IN_PROGRESS in the journal, and the sync is
+			# tried again at the next flush
+			self.dirs.update(dirs)
+			self.pending[:0] = pending
+			self.error = {'file': (e.filename or ''), 'message': f'Cannot sync to disk: {e.strerror} ({e.errno})'}
+			return False
+
+		if (db is not None) and pending:
+			db.set_files_status(pending)
+
+		return True
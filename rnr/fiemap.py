@@ -0,0 +1,53 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import os
+
+import fcntl
+import struct
+
+
+__all__ = ['physical_offset']
+
+
+FS_IOC_FIEMAP = 0xC020660B
+
+# struct fiemap, followed by a single struct fiemap_extent
+FIEMAP_HEADER = struct.Struct('=QQIIII')
+FIEMAP_EXTENT = struct.Struct('=QQQQQIIII')
+
+
+def physical_offset(file):
+	buf = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+	FIEMAP_HEADER.pack_into(buf, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+
+	fd = os.open(file, os.O_RDONLY | os.O_NOFOLLOW)
+	try:
+		fcntl.ioctl(fd, FS_IOC_FIEMAP, buf)
+	finally:
+		os.close(fd)
+
+	(fm_start, fm_length, fm_flags, fm_mapped_extents, fm_extent_count, fm_reserved) = FIEMAP_HEADER.unpack_from(buf, 0)
+	if not fm_mapped_extents:
+		return None
+
+	(fe_logical, fe_physical, fe_length, fe_reserved64_0, fe_reserved64_1, fe_flags, fe_reserved_0, fe_reserved_1, fe_reserved_2) = FIEMAP_EXTENT.unpack_from(buf, FIEMAP_HEADER.size)
+
+	return fe_physical
+
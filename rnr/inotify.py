@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+import errno
+import struct
+import ctypes
+
+from ctypes.util import find_library
+
+from .debug_print import (debug_print, debug_pprint)
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+libc = ctypes.CDLL(find_library('c'), use_errno=True)
+
+try:
+	inotify_init1 = libc.inotify_init1
+	inotify_init1.argtypes = [ctypes.c_int]
+	inotify_init1.restype = ctypes.c_int
+
+	inotify_add_watch = libc.inotify_add_watch
+	inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+	inotify_add_watch.restype = ctypes.c_int
+
+	inotify_rm_watch = libc.inotify_rm_watch
+	inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+	inotify_rm_watch.restype = ctypes.c_int
+except AttributeError:
+	inotify_init1 = None
+
+
+def check_errno(retval):
+	if retval < 0:
+		e = ctypes.get_errno()
+		raise OSError(e, os.strerror(e))
+
+	return retval
+
+
+class Inotify(object):
+	def __init__(self):
+		if inotify_init1 is None:
+			raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+
+		self.fd = check_errno(inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+	def add_watch(self, path, mask):
+		return check_errno(inotify_add_watch(self.fd, os.fsencode(path), mask))
+
+	def rm_watch(self, wd):
+		check_errno(inotify_rm_watch(self.fd, wd))
+
+	def read_events(self):
+		events = []
+		while True:
+			try:
+				buf = os.read(self.fd, 65536)
+			except BlockingIOError:
+				break
+
+			if not buf:
+				break
+
+			pos = 0
+			while pos < len(buf):
+				(wd, mask, cookie, length) = EVENT_HEADER.unpack_from(buf, pos)
+				pos += EVENT_HEADER.size
+				name = os.fsdecode(buf[pos:pos + length].rstrip(b'\0'))
+				pos += length
+				events.append((wd, mask, cookie, name))
+
+		return events
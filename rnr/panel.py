@@ -29,18 +29,20 @@ import subprocess
 import signal
 import fnmatch
 import re
+import time
+import queue
+import threading
 
 from pathlib import Path
 
 import urwid
 
-from fuzzyfinder import fuzzyfinder
-
+from .inotify import (IN_DELETE_SELF, IN_MOVE_SELF, IN_IGNORED, IN_Q_OVERFLOW)
 from .utils import (human_readable_size, format_date, natsort_key, tar_suffix, TildeLayout, TLineWidget)
 from .debug_print import (debug_print, debug_pprint)
 
 
-ARCHIVE_EXTENSIONS = list(map(natsort_key, [
+ARCHIVE_SUFFIXES = tuple(x.casefold() for x in [
 	'.tar',
 	'.tar.gz', '.tgz', '.taz'
 	'.tar.Z', '.taZ',
@@ -58,206 +60,334 @@ ARCHIVE_EXTENSIONS = list(map(natsort_key, [
 	'.rar',
 	'.cab',
 	'.7z',
-]))
-
-
-def sort_by_name(a, b, reverse=False):
-	if stat.S_ISDIR(a['stat'].st_mode) and (not stat.S_ISDIR(b['stat'].st_mode)):
-		return (1 if reverse else -1)
-	elif (not stat.S_ISDIR(a['stat'].st_mode)) and stat.S_ISDIR(b['stat'].st_mode):
-		return (-1 if reverse else 1)
-	elif a['key'] < b['key']:
-		return -1
-	elif a['key'] > b['key']:
-		return 1
-	elif a['file'].name < b['file'].name:
-		return -1
-	elif a['file'].name > b['file'].name:
-		return 1
-	else:
-		return 0
-
-def sort_by_extension(a, b, reverse=False):
-	if stat.S_ISDIR(a['stat'].st_mode) and (not stat.S_ISDIR(b['stat'].st_mode)):
-		return (1 if reverse else -1)
-	elif (not stat.S_ISDIR(a['stat'].st_mode)) and stat.S_ISDIR(b['stat'].st_mode):
-		return (-1 if reverse else 1)
-	elif a['extension'] < b['extension']:
-		return -1
-	elif a['extension'] > b['extension']:
-		return 1
-	else:
-		return sort_by_name(a, b, reverse)
-
-def sort_by_date(a, b, reverse=False):
-	if stat.S_ISDIR(a['stat'].st_mode) and (not stat.S_ISDIR(b['stat'].st_mode)):
-		return (1 if reverse else -1)
-	elif (not stat.S_ISDIR(a['stat'].st_mode)) and stat.S_ISDIR(b['stat'].st_mode):
-		return (-1 if reverse else 1)
-	elif a['lstat'].st_mtime < b['lstat'].st_mtime:
-		return -1
-	elif a['lstat'].st_mtime > b['lstat'].st_mtime:
-		return 1
-	else:
-		return sort_by_name(a, b, reverse)
-
-def sort_by_size(a, b, reverse=False):
-	if stat.S_ISDIR(a['stat'].st_mode) and (not stat.S_ISDIR(b['stat'].st_mode)):
-		return (1 if reverse else -1)
-	elif (not stat.S_ISDIR(a['stat'].st_mode)) and stat.S_ISDIR(b['stat'].st_mode):
-		return (-1 if reverse else 1)
-	elif a['length'] < b['length']:
-		return -1
-	elif a['length'] > b['length']:
-		return 1
-	else:
-		return sort_by_name(a, b, reverse)
+])
+
+ARCHIVE_EXTENSIONS = list(map(natsort_key, ARCHIVE_SUFFIXES))
+
+LISTING_BATCH_SIZE = 1024
+LISTING_BATCH_TIME = 0.1
+LISTING_FIRST_BATCH_TIME = 0.2
+LINE_CACHE_SIZE = 256
+REFRESH_DELAY = 0.2
+LISTING_CACHE_SIZE = 16
+LISTING_CACHE_FILES = 500000
+HISTORY_SIZE = 100
+NAME_CACHE_TTL = 60
+
+
+def sort_by_name(file):
+	return file['sort_name']
+
+def sort_by_extension(file):
+	return file['extension']
+
+def sort_by_date(file):
+	return file['lstat'].st_mtime
+
+def sort_by_size(file):
+	return file['length']
+
+def sort_files(files, sort_method, reverse=False, by_name=None):
+	# The directories come first, whatever the direction. As the sort is
+	# stable, the other methods start from the files sorted by name, and
+	# sort them by their own key only
+	if by_name is None:
+		by_name = sorted(files, key=sort_by_name)
+
+	dirs = [x for x in by_name if x['is_dir']]
+	others = [x for x in by_name if not x['is_dir']]
+
+	if reverse:
+		dirs.reverse()
+		others.reverse()
+
+	if sort_method != 'sort_by_name':
+		key = globals()[sort_method]
+		dirs.sort(key=key, reverse=reverse)
+		others.sort(key=key, reverse=reverse)
+
+	return dirs + others
+
+def is_subsequence(needle, haystack):
+	it = iter(haystack)
+	return all(c in it for c in needle)
+
+def fuzzy_filter(query, files):
+	if len(query) == 1:
+		return [x for x in files if query in x['match_name']]
+
+	regex = re.compile('.*?'.join(map(re.escape, query)))
+	return [x for x in files if regex.search(x['match_name'])]
+
+def best_match(query, files):
+	# Same ranking as fuzzyfinder: shortest match, then leftmost, then name.
+	# A contiguous match is always the shortest, so the regex is needed only
+	# when there is none
+	best = None
+	for file in files:
+		start = file['match_name'].find(query)
+		if (start >= 0) and ((best is None) or ((start, file['name']) < best[:2])):
+			best = (start, file['name'], file)
+
+	if best is not None:
+		return best[2]
+
+	regex = re.compile('(?=({0}))'.format('.*?'.join(map(re.escape, query))))
+	for file in files:
+		m = min(regex.finditer(file['match_name']), key=lambda x: len(x.group(1)), default=None)
+		if (m is not None) and ((best is None) or ((len(m.group(1)), m.start(), file['name']) < best[:3])):
+			best = (len(m.group(1)), m.start(), file['name'], file)
+
+	if best is not None:
+		return best[3]
+
+	return None
+
+def insert_sorted(files, new_files, key):
+	for file in new_files:
+		k = key(file)
+		lo = 0
+		hi = len(files)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if k < key(files[mid]):
+				hi = mid
+			else:
+				lo = mid + 1
+
+		files.insert(lo, file)
 
 
 def get_file_list(cwd, count_directories, unarchive_path=None):
-	cwd = Path(cwd)
+	return list(iter_file_list(cwd, count_directories, unarchive_path))
+
+def iter_file_list(cwd, count_directories, unarchive_path=None, dir_counter=None):
+	shown_cwd = Path(cwd)
 
 	if unarchive_path is None:
-		archive_file = None
-		temp_dir = None
+		cwd = shown_cwd
 	else:
-		(cwd, archive_file, temp_dir) = unarchive_path(cwd)
-
-	uid_cache = Cache(lambda x: pwd.getpwuid(x).pw_name)
-	gid_cache = Cache(lambda x: grp.getgrgid(x).gr_name)
-
-	files = []
-	for file in cwd.iterdir():
-		if archive_file:
-			shown_file = Path(str(file).replace(str(temp_dir), str(archive_file), 1))
-		else:
-			shown_file = file
-
-		obj = {
-			'file': shown_file,
-			'key': natsort_key(file.name),
-			'extension': natsort_key(tar_suffix(file)),
-		}
-
+		cwd = unarchive_path(shown_cwd)[0]
+
+	with os.scandir(cwd) as it:
+		for entry in it:
+			obj = get_file_info(entry.path, shown_cwd / entry.name, entry.name, count_directories, dir_counter)
+			if obj is not None:
+				yield obj
+
+def is_archive(name):
+	return name.casefold().endswith(ARCHIVE_SUFFIXES) and (natsort_key(tar_suffix(name)) in ARCHIVE_EXTENSIONS)
+
+def get_file_info(file, shown_file, name, count_directories, dir_counter):
+	try:
+		lstat = os.lstat(file)
+	except OSError:
+		return None
+
+	obj = FileInfo({
+		'file': shown_file,
+		'path': file,
+		'name': name,
+		'lstat': lstat,
+	})
+
+	if stat.S_ISLNK(lstat.st_mode):
 		try:
-			lstat = file.lstat()
-		except OSError:
-			continue
-
-		obj['lstat'] = lstat
-
-		if stat.S_ISLNK(lstat.st_mode):
-			try:
-				st = file.stat()
-				if stat.S_ISDIR(st.st_mode):
-					obj['label'] = f'~{file.name}'
-					obj['palette'] = 'dir_symlink'
-				else:
-					obj['label'] = f'@{file.name}'
-					if obj['extension'] in ARCHIVE_EXTENSIONS:
-						obj['palette'] = 'archive'
-					else:
-						obj['palette'] = 'symlink'
-			except OSError:
-				st = lstat
-				obj['label'] = f'!{file.name}'
-				obj['palette'] = 'stalelink'
-		else:
-			st = lstat
+			st = os.stat(file)
 			if stat.S_ISDIR(st.st_mode):
-				obj['label'] = f'/{file.name}'
-				obj['palette'] = 'directory'
-			elif stat.S_ISCHR(lstat.st_mode):
-				obj['label'] = f'-{file.name}'
-				obj['palette'] = 'device'
-			elif stat.S_ISBLK(lstat.st_mode):
-				obj['label'] = f'+{file.name}'
-				obj['palette'] = 'device'
-			elif stat.S_ISFIFO(lstat.st_mode):
-				obj['label'] = f'|{file.name}'
-				obj['palette'] = 'special'
-			elif stat.S_ISSOCK(lstat.st_mode):
-				obj['label'] = f'={file.name}'
-				obj['palette'] = 'special'
-			elif lstat.st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
-				obj['label'] = f'*{file.name}'
-				if obj['extension'] in ARCHIVE_EXTENSIONS:
-					obj['palette'] = 'archive'
-				else:
-					obj['palette'] = 'executable'
+				obj['label'] = f'~{name}'
+				obj['palette'] = 'dir_symlink'
 			else:
-				obj['label'] = f' {file.name}'
-				if obj['extension'] in ARCHIVE_EXTENSIONS:
+				obj['label'] = f'@{name}'
+				if is_archive(name):
 					obj['palette'] = 'archive'
 				else:
-					obj['palette'] = 'panel'
+					obj['palette'] = 'symlink'
+		except OSError:
+			st = lstat
+			obj['label'] = f'!{name}'
+			obj['palette'] = 'stalelink'
+	else:
+		st = lstat
+		if stat.S_ISDIR(st.st_mode):
+			obj['label'] = f'/{name}'
+			obj['palette'] = 'directory'
+		elif stat.S_ISCHR(lstat.st_mode):
+			obj['label'] = f'-{name}'
+			obj['palette'] = 'device'
+		elif stat.S_ISBLK(lstat.st_mode):
+			obj['label'] = f'+{name}'
+			obj['palette'] = 'device'
+		elif stat.S_ISFIFO(lstat.st_mode):
+			obj['label'] = f'|{name}'
+			obj['palette'] = 'special'
+		elif stat.S_ISSOCK(lstat.st_mode):
+			obj['label'] = f'={name}'
+			obj['palette'] = 'special'
+		elif lstat.st_mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+			obj['label'] = f'*{name}'
+			if is_archive(name):
+				obj['palette'] = 'archive'
+			else:
+				obj['palette'] = 'executable'
+		else:
+			obj['label'] = f' {name}'
+			if is_archive(name):
+				obj['palette'] = 'archive'
+			else:
+				obj['palette'] = 'panel'
 
-		obj['stat'] = st
+	obj['stat'] = st
+	obj['is_dir'] = stat.S_ISDIR(st.st_mode)
 
-		if stat.S_ISDIR(st.st_mode):
-			try:
-				if count_directories:
-					length = len(list(file.iterdir()))
+	if stat.S_ISDIR(st.st_mode):
+		try:
+			if count_directories and dir_counter:
+				length = dir_counter.get(st)
+				if length is None:
+					obj['length'] = (0,)
+					obj['size'] = '…'
+					obj['uncounted'] = file
+				else:
 					obj['length'] = (length,)
 					obj['size'] = str(length)
-				else:
-					obj['length'] = (0,)
-					obj['size'] = 'DIR'
-			except OSError:
-				obj['length'] = (-1,)
-				obj['size'] = '?'
-		elif stat.S_ISCHR(lstat.st_mode) or stat.S_ISBLK(lstat.st_mode):
-				major = os.major(lstat.st_rdev)
-				minor = os.minor(lstat.st_rdev)
-				obj['length'] = (major, minor)
-				obj['size'] = f'{major},{minor}'
-		else:
-			length = lstat.st_size
-			obj['length'] = (length,)
-			obj['size'] = human_readable_size(length)
+			elif count_directories:
+				length = len(os.listdir(file))
+				obj['length'] = (length,)
+				obj['size'] = str(length)
+			else:
+				obj['length'] = (0,)
+				obj['size'] = 'DIR'
+		except OSError:
+			obj['length'] = (-1,)
+			obj['size'] = '?'
+	elif stat.S_ISCHR(lstat.st_mode) or stat.S_ISBLK(lstat.st_mode):
+			major = os.major(lstat.st_rdev)
+			minor = os.minor(lstat.st_rdev)
+			obj['length'] = (major, minor)
+			obj['size'] = f'{major},{minor}'
+	else:
+		obj['length'] = (lstat.st_size,)
 
-		try:
-			uid = uid_cache[lstat.st_uid]
-		except KeyError:
-			uid = str(lstat.st_uid)
+	return obj
 
-		try:
-			gid = gid_cache[lstat.st_gid]
-		except KeyError:
-			gid = str(lstat.st_gid)
+def file_key(file):
+	return natsort_key(file['name'])
 
-		obj['details'] = f'{stat.filemode(lstat.st_mode)} {lstat.st_nlink} {uid} {gid}'
+def file_sort_name(file):
+	return (file['key'], file['name'])
 
-		if stat.S_ISLNK(lstat.st_mode):
-			try:
-				link_target = os.readlink(file)
+def file_match_name(file):
+	return file['name'].casefold()
 
-				obj['details'] = f'{obj["details"]} -> {link_target}'
-				if Path(link_target).is_absolute():
-					obj['link_target'] = Path(os.path.normpath(link_target))
-				else:
-					obj['link_target'] = Path(os.path.normpath(shown_file.parent / link_target))
-			except OSError:
-				obj['details'] = f'{obj["details"]} -> ?'
-				obj['link_target'] = shown_file
-		else:
-			obj['details'] = f'{obj["details"]} {file.name}'
+def file_extension(file):
+	return natsort_key(tar_suffix(file['name']))
 
-		files.append(obj)
+def file_size(file):
+	return human_readable_size(file['length'][0])
 
-	return files
+def file_details(file):
+	lstat = file['lstat']
+	details = f'{stat.filemode(lstat.st_mode)} {lstat.st_nlink} {uid_names[lstat.st_uid]} {gid_names[lstat.st_gid]}'
 
+	if stat.S_ISLNK(lstat.st_mode):
+		try:
+			return f'{details} -> {os.readlink(file["path"])}'
+		except OSError:
+			return f'{details} -> ?'
+	else:
+		return f'{details} {file["name"]}'
+
+def file_link_target(file):
+	try:
+		link_target = os.readlink(file['path'])
+	except OSError:
+		return file['file']
 
-class Cache(collections.defaultdict):
+	if Path(link_target).is_absolute():
+		return Path(os.path.normpath(link_target))
+	else:
+		return Path(os.path.normpath(file['file'].parent / link_target))
+
+LAZY_ATTRIBUTES = {
+	'key': file_key,
+	'sort_name': file_sort_name,
+	'match_name': file_match_name,
+	'extension': file_extension,
+	'size': file_size,
+	'details': file_details,
+	'link_target': file_link_target,
+}
+
+def rnr_listdir(file_iter, fd, q, ev_cancel):
+	files = []
+	last_update = time.monotonic()
+	try:
+		for file in file_iter:
+			if ev_cancel.is_set():
+				break
+
+			files.append(file)
+			if (len(files) >= LISTING_BATCH_SIZE) and ((time.monotonic() - last_update) >= LISTING_BATCH_TIME):
+				q.put({'files': files})
+				os.write(fd, b'\n')
+				files = []
+				last_update = time.monotonic()
+	except OSError:
+		pass
+
+	try:
+		q.put({'result': files})
+		os.write(fd, b'\n')
+	except OSError:
+		pass
+	os.close(fd)
+
+
+class FileInfo(dict):
+	# What is needed only for sorting, filtering or showing the details of
+	# an entry gets computed the first time that it is asked for
 	def __missing__(self, key):
-		if self.default_factory is None:
+		try:
+			value = LAZY_ATTRIBUTES[key](self)
+		except KeyError:
 			raise KeyError(key)
 
-		self[key] = value = self.default_factory(key)
+		self[key] = value
 
 		return value
 
 
+class NameCache(object):
+	def __init__(self, get_name, ttl):
+		self.get_name = get_name
+		self.ttl = ttl
+		self.names = {}
+
+	def __getitem__(self, key):
+		now = time.monotonic()
+
+		try:
+			(name, expiry) = self.names[key]
+			if now < expiry:
+				return name
+		except KeyError:
+			pass
+
+		try:
+			name = self.get_name(key)
+		except KeyError:
+			name = str(key)
+
+		self.names[key] = (name, now + self.ttl)
+
+		return name
+
+
+uid_names = NameCache(lambda x: pwd.getpwuid(x).pw_name, NAME_CACHE_TTL)
+gid_names = NameCache(lambda x: grp.getgrgid(x).gr_name, NAME_CACHE_TTL)
+
+
 class SelectableColumns(urwid.Columns):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
@@ -268,6 +398,80 @@ class SelectableColumns(urwid.Columns):
 		return key
 
 
+class FileListWalker(urwid.ListWalker):
+	# The line widgets are built only for the files that get on screen, and
+	# the most recent ones are kept around for scrolling back and forth
+	def __init__(self, is_tagged):
+		self.is_tagged = is_tagged
+		self.files = []
+		self.focus = 0
+		self.lines = collections.OrderedDict()
+
+	def __len__(self):
+		return len(self.files)
+
+	def set_files(self, files):
+		self.files = files
+		self._modified()
+
+	def set_focus(self, position):
+		self.focus = position
+		self._modified()
+
+	def positions(self, reverse=False):
+		if reverse:
+			return range(len(self.files) - 1, -1, -1)
+		else:
+			return range(len(self.files))
+
+	def invalidate(self, file=None):
+		if file is None:
+			self.lines.clear()
+		else:
+			self.lines.pop(file['file'], None)
+
+		self._modified()
+
+	def get_line(self, position):
+		if (position < 0) or (position >= len(self.files)):
+			return (None, None)
+
+		file = self.files[position]
+
+		try:
+			(model, w) = self.lines[file['file']]
+			if model is file:
+				self.lines.move_to_end(file['file'])
+				return (w, position)
+		except KeyError:
+			pass
+
+		if self.is_tagged(file['file']):
+			attr_map = 'marked'
+			focus_map = 'markselect'
+		else:
+			attr_map = file['palette']
+			focus_map = 'selected'
+
+		w = urwid.AttrMap(SelectableColumns([urwid.Text(file['label'], layout=TildeLayout), ('pack', urwid.Text(file['size'])), ('pack', urwid.Text(format_date(file['lstat'].st_mtime)))], dividechars=1), attr_map, focus_map)
+		w.model = file
+
+		self.lines[file['file']] = (file, w)
+		if len(self.lines) > LINE_CACHE_SIZE:
+			self.lines.popitem(last=False)
+
+		return (w, position)
+
+	def get_focus(self):
+		return self.get_line(self.focus)
+
+	def get_next(self, position):
+		return self.get_line(position + 1)
+
+	def get_prev(self, position):
+		return self.get_line(position - 1)
+
+
 class VimListBox(urwid.ListBox):
 	def keypress(self, size, key):
 		if self.controller.screen.command_bar.leader:
@@ -422,6 +626,26 @@ class VimListBox(urwid.ListBox):
 			self.model.show_preview(None)
 
 
+class CachedListing(object):
+	# A listing that is kept after leaving its directory. While it is kept,
+	# the directory stays watched, so that the changes that do not touch the
+	# directory mtime can be applied when returning
+	def __init__(self, st, files, sorted_files, focus_path, file_filter, changes):
+		self.st = st
+		self.files = files
+		self.sorted_files = sorted_files
+		self.focus_path = focus_path
+		self.file_filter = file_filter
+		self.changes = changes
+		self.watch_wd = None
+
+	def on_dir_event(self, mask, name):
+		if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED | IN_Q_OVERFLOW):
+			self.changes = None
+		elif name and (self.changes is not None):
+			self.changes.add(name)
+
+
 class Panel(urwid.WidgetWrap):
 	def __init__(self, controller):
 		self.controller = controller
@@ -429,7 +653,7 @@ class Panel(urwid.WidgetWrap):
 		self.title = TLineWidget(urwid.Text('', layout=TildeLayout), title_align='left', lcorner='┌', rcorner='┐')
 		title = urwid.AttrMap(self.title, 'panel')
 
-		self.walker = urwid.SimpleFocusListWalker([])
+		self.walker = FileListWalker(lambda x: x in self.tagged_files)
 		self.listbox = VimListBox(self.walker)
 		self.listbox.model = self
 		self.listbox.controller = controller
@@ -468,11 +692,28 @@ class Panel(urwid.WidgetWrap):
 		self.sort_method = 'sort_by_name'
 		self.reverse = False
 		self.file_filter = ''
+		self.filter_query = None
+		self.filter_stack = []
 		self.forced_focus = None
 		self.files = []
 		self.shown_files = []
 		self.filtered_files = []
-		self.tagged_files = set()
+		self.filtered_order = None
+		self.sorted_files = {}
+		self.tagged_files = {}
+		self.tagged_size = 0
+		self.dir_tags = {}
+		self.listing = None
+		self.uncounted = []
+		self.ev_count_cancel = threading.Event()
+		self.count_fd = None
+		self.count_q = queue.Queue()
+		self.watch_wd = None
+		self.changes = set()
+		self.refresh_alarm = None
+		self.listing_cache = collections.OrderedDict()
+		self.back_history = []
+		self.forward_history = []
 
 		self.focused = False
 
@@ -483,13 +724,16 @@ class Panel(urwid.WidgetWrap):
 
 		super().__init__(self.pile)
 
-	def chdir(self, cwd, focus_path=None):
+	def chdir(self, cwd, focus_path=None, history=True):
 		self.title.set_title(f' {str(cwd)} ')
 		old_file_filter = self.file_filter
 		self.file_filter = ''
-		old_tagged_files = self.tagged_files.copy()
-		self.tagged_files.clear()
-		self.update_tagged_count()
+
+		# Every directory keeps its own tags, that get back when returning
+		if self.tagged_files:
+			self.dir_tags[self.cwd] = self.tagged_files
+
+		self.set_tags(self.dir_tags.pop(Path(cwd), {}))
 
 		if focus_path is None:
 			focus_path = self.cwd
@@ -497,15 +741,27 @@ class Panel(urwid.WidgetWrap):
 		old_cwd = self.old_cwd
 		self.old_cwd = self.cwd
 
-		if self._reload(cwd, focus_path):
+		if Path(cwd) != self.cwd:
+			self.cache_listing(old_file_filter)
+
+		if self._reload(cwd, focus_path, use_cache=True):
+			if history and (Path(cwd) != self.cwd):
+				self.back_history.append(self.cwd)
+				del self.back_history[:-HISTORY_SIZE]
+				self.forward_history.clear()
+
 			self.cwd = cwd
 			return True
 		else:
+			self.drop_cached_listing(self.cwd)
 			self.old_cwd = old_cwd
 			self.title.set_title(f' {str(self.cwd)} ')
 			self.file_filter = old_file_filter
-			self.tagged_files = old_tagged_files
-			self.update_tagged_count()
+
+			if self.tagged_files:
+				self.dir_tags[Path(cwd)] = self.tagged_files
+
+			self.set_tags(self.dir_tags.pop(self.cwd, {}))
 
 			try:
 				self.show_details(self.walker.get_focus()[0].model)
@@ -515,15 +771,8 @@ class Panel(urwid.WidgetWrap):
 			return False
 
 	def reload(self, focus_path=None):
-		files_to_discard = []
-		for file in self.tagged_files:
-			if not os.path.lexists(file):
-				files_to_discard.append(file)
-
-		for file in files_to_discard:
-			self.tagged_files.discard(file)
-
-		self.update_tagged_count()
+		if self.refresh(focus_path):
+			return
 
 		try:
 			obj, focus_position = self.walker.get_focus()
@@ -551,9 +800,117 @@ class Panel(urwid.WidgetWrap):
 				if self.chdir(parent):
 					break
 
-	def _reload(self, cwd, focus_path, focus_position=0):
+	def go_back(self):
+		while self.back_history:
+			cwd = self.cwd
+			if self.chdir(self.back_history.pop(), history=False):
+				self.forward_history.append(cwd)
+				break
+
+	def go_forward(self):
+		while self.forward_history:
+			cwd = self.cwd
+			if self.chdir(self.forward_history.pop(), history=False):
+				self.back_history.append(cwd)
+				break
+
+	def cache_listing(self, file_filter):
+		if self.listing is not None:
+			return
+
+		# Without inotify, only the contents of an archive can't change
+		# unnoticed
+		(actual_cwd, archive_file, temp_dir) = self.unarchive_path(self.cwd)
+		if (self.watch_wd is None) and not archive_file:
+			return
+
+		try:
+			st = os.stat(actual_cwd)
+		except OSError:
+			return
+
+		try:
+			focus_path = self.get_focus()['file']
+		except TypeError:
+			focus_path = None
+
+		if self.changes is None:
+			changes = None
+		else:
+			changes = set(self.changes)
+
+		entry = CachedListing(st, self.files, dict(self.sorted_files), focus_path, file_filter, changes)
+		if self.watch_wd is not None:
+			self.controller.watch_dir(entry, actual_cwd)
+
+		self.drop_cached_listing(self.cwd)
+		self.listing_cache[self.cwd] = entry
+
+		total_files = sum(len(x.files) for x in self.listing_cache.values())
+		while (len(self.listing_cache) > LISTING_CACHE_SIZE) or (total_files > LISTING_CACHE_FILES):
+			(cwd, old_entry) = self.listing_cache.popitem(last=False)
+			self.controller.unwatch_dir(old_entry)
+			total_files -= len(old_entry.files)
+
+	def drop_cached_listing(self, cwd):
+		entry = self.listing_cache.pop(cwd, None)
+		if entry is not None:
+			self.controller.unwatch_dir(entry)
+
+		return entry
+
+	def restore_listing(self, cwd, focus_path):
+		entry = self.listing_cache.pop(cwd, None)
+		if entry is None:
+			return False
+
+		try:
+			st = os.stat(self.unarchive_path(cwd)[0])
+		except OSError:
+			st = None
+
+		# A listing is still good if the directory has the same mtime, and
+		# nothing happened to the directory itself in the meantime
+		if (st is None) or (entry.changes is None) or ((st.st_dev, st.st_ino, st.st_mtime_ns) != (entry.st.st_dev, entry.st.st_ino, entry.st.st_mtime_ns)):
+			self.controller.unwatch_dir(entry)
+			return False
+
+		self.watch(cwd)
+		self.controller.unwatch_dir(entry)
+
+		self.cancel_listing()
+		self.cancel_counting()
+		self.cancel_refresh()
+
+		self.show_preview(None)
+		self.controller.update_archive_dirs(cwd, self.old_cwd, self)
+
+		if (focus_path is None) or (focus_path.parent != cwd):
+			focus_path = entry.focus_path
+
+		self.files = entry.files
+		self.sorted_files = entry.sorted_files
+		self.apply_hidden(self.show_hidden)
+		self.apply_filter(entry.file_filter)
+		self.update_list_box(focus_path)
+		self.start_counting(self.files)
+		self.update_free_space(cwd)
+		self.validate_tags()
+
+		# The files changed in the meantime are refreshed as soon as the
+		# panel is in its new directory
+		self.changes = entry.changes
+		if self.changes and self.controller.loop:
+			self.refresh_alarm = self.controller.loop.set_alarm_in(0, self.on_refresh)
+
+		return True
+
+	def _reload(self, cwd, focus_path, focus_position=0, use_cache=False):
 		cwd = Path(cwd)
 
+		if use_cache and self.restore_listing(cwd, focus_path):
+			return True
+
 		listbox = self.pile.contents[1]
 		self.pile.contents[1] = (self.txt_loading, self.pile.options())
 		self.show_details(None)
@@ -567,47 +924,363 @@ class Panel(urwid.WidgetWrap):
 		else:
 			count_directories = self.controller.count_directories
 
+		# The directory is watched before being listed, so that no change
+		# gets lost in between
+		self.watch(cwd)
+
+		# Whatever can be listed in a short time is shown right away, the
+		# rest of a huge directory keeps streaming in from a thread
+		file_iter = iter_file_list(cwd, count_directories=count_directories, unarchive_path=self.unarchive_path, dir_counter=self.controller.dir_counter)
+		files = []
+		finished = True
 		try:
-			files = get_file_list(cwd, count_directories=count_directories, unarchive_path=self.unarchive_path)
+			t = time.monotonic()
+			for file in file_iter:
+				files.append(file)
+				if self.controller.loop and ((len(files) % 256) == 0) and ((time.monotonic() - t) >= LISTING_FIRST_BATCH_TIME):
+					finished = False
+					break
 		except OSError:
+			self.watch(self.cwd)
 			return False
 
+		self.cancel_listing()
+		self.cancel_counting()
+		self.cancel_refresh()
+
 		self.show_preview(None)
 		self.controller.update_archive_dirs(cwd, self.old_cwd, self)
 
 		self.files = files
+		self.sorted_files.clear()
 		self.apply_hidden(self.show_hidden)
 		self.apply_filter(self.file_filter)
 		self.update_list_box(focus_path, focus_position)
-		self.footer.set_title(f' Free: {human_readable_size(shutil.disk_usage(self.unarchive_path(cwd)[0]).free)} ')
+		self.start_counting(files)
+
+		if finished:
+			self.update_free_space(cwd)
+			self.validate_tags()
+		else:
+			self.start_listing(cwd, file_iter, focus_path)
 
 		return True
 
-	def update_list_box(self, focus_path, focus_position=0):
-		self.filtered_files.sort(key=functools.cmp_to_key(functools.partial(globals()[self.sort_method], reverse=self.reverse)), reverse=self.reverse)
+	def watch(self, cwd):
+		(actual_cwd, archive_file, temp_dir) = self.unarchive_path(cwd)
+		if archive_file:
+			self.controller.unwatch_dir(self)
+		else:
+			self.controller.watch_dir(self, actual_cwd)
 
-		focus = -1
-		labels = []
-		for file in self.filtered_files:
-			if file['file'] in self.tagged_files:
-				attr_map = 'marked'
-				focus_map = 'markselect'
+		self.changes = set()
+
+	def on_dir_event(self, mask, name):
+		if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED | IN_Q_OVERFLOW):
+			self.changes = None
+		elif name and (self.changes is not None):
+			self.changes.add(name)
+		else:
+			return
+
+		# Bursts of events, like the ones of a copy, are applied together
+		if (self.refresh_alarm is None) and self.controller.loop:
+			self.refresh_alarm = self.controller.loop.set_alarm_in(REFRESH_DELAY, self.on_refresh)
+
+	def cancel_refresh(self):
+		if self.refresh_alarm is not None:
+			self.controller.loop.remove_alarm(self.refresh_alarm)
+			self.refresh_alarm = None
+
+	def on_refresh(self, loop=None, user_data=None):
+		self.refresh_alarm = None
+
+		if self.listing is not None:
+			self.refresh_alarm = self.controller.loop.set_alarm_in(REFRESH_DELAY, self.on_refresh)
+		elif self.changes is None:
+			self.reload()
+		elif self.changes:
+			self.apply_changes()
+
+	def refresh(self, focus_path=None):
+		if (self.watch_wd is None) or (self.listing is not None):
+			return False
+
+		# The changes made right before the call are already queued
+		self.controller.poll_inotify()
+
+		if self.changes is None:
+			return False
+
+		self.cancel_refresh()
+
+		try:
+			if focus_path is not None:
+				rel_path = focus_path.relative_to(self.cwd)
+				focus_path = self.cwd / rel_path.parts[0]
+		except (ValueError, IndexError):
+			pass
+
+		# The content of the subdirectories is not watched, so their dates
+		# and counts get checked too
+		self.apply_changes(focus_path, recheck_dirs=True)
+
+		return True
+
+	def apply_changes(self, focus_path=None, recheck_dirs=False):
+		names = self.changes
+		self.changes = set()
+
+		actual_cwd = self.unarchive_path(self.cwd)[0]
+		removed = set()
+		for file in self.files:
+			name = file['name']
+			if name in names:
+				removed.add(id(file))
+			elif recheck_dirs and file['is_dir']:
+				try:
+					lstat = os.lstat(actual_cwd / name)
+					st = os.stat(actual_cwd / name)
+				except OSError:
+					lstat = None
+
+				if (lstat is None) or ((lstat.st_ctime_ns, lstat.st_mtime_ns, st.st_ctime_ns, st.st_mtime_ns) != (file['lstat'].st_ctime_ns, file['lstat'].st_mtime_ns, file['stat'].st_ctime_ns, file['stat'].st_mtime_ns)):
+					names.add(name)
+					removed.add(id(file))
+
+		if not names:
+			if focus_path is not None:
+				self.update_list_box(focus_path)
+
+			return
+
+		tagged_names = set(self.tagged_files)
+		new_files = []
+		for name in names:
+			file = get_file_info(str(actual_cwd / name), self.cwd / name, name, self.controller.count_directories, self.controller.dir_counter)
+			self.untag(self.cwd / name)
+			if file is not None:
+				new_files.append(file)
+				if file['file'] in tagged_names:
+					self.tag(file)
+
+		try:
+			(obj, focus_position) = self.walker.get_focus()
+			if focus_path is None:
+				focus_path = obj.model['file']
+		except AttributeError:
+			focus_position = 0
+
+		self.files = [x for x in self.files if id(x) not in removed]
+		self.files.extend(new_files)
+
+		# Only the order by name is kept, as the new entries can be inserted
+		# in place, while the other orders get sorted from it again
+		by_name = self.sorted_files.get(('sort_by_name', False))
+		self.sorted_files.clear()
+		if by_name is not None:
+			by_name = [x for x in by_name if id(x) not in removed]
+			insert_sorted(by_name, new_files, lambda x: (not x['is_dir'], x['sort_name']))
+			self.sorted_files[('sort_by_name', False)] = by_name
+
+		self.start_counting(new_files)
+		self.update_tagged_count()
+
+		self.shown_files = [x for x in self.shown_files if id(x) not in removed]
+		self.shown_files.extend(x for x in new_files if self.show_hidden or not x['name'].startswith('.'))
+		self.filter_query = None
+		self.apply_filter(self.file_filter)
+		self.update_list_box(focus_path, focus_position or 0)
+
+	def update_free_space(self, cwd):
+		self.footer.set_title(f' Free: {human_readable_size(shutil.disk_usage(self.unarchive_path(cwd)[0]).free)} ')
+
+	def start_listing(self, cwd, file_iter, focus_path):
+		listing = {
+			'cwd': cwd,
+			'q': queue.Queue(),
+			'ev_cancel': threading.Event(),
+			'pending': [],
+			'focus_path': focus_path,
+			'auto_focus': None,
+		}
+
+		try:
+			listing['auto_focus'] = self.get_focus()['file']
+		except TypeError:
+			pass
+
+		fd = self.controller.loop.watch_pipe(functools.partial(self.on_listing, listing))
+		threading.Thread(target=rnr_listdir, args=(file_iter, fd, listing['q'], listing['ev_cancel']), daemon=True).start()
+
+		self.listing = listing
+		self.footer.set_title(f' Loading: {len(self.files)} ')
+
+	def cancel_listing(self):
+		if self.listing is not None:
+			self.listing['ev_cancel'].set()
+			self.listing = None
+
+	def on_listing(self, listing, data):
+		finished = False
+		while True:
+			try:
+				info = listing['q'].get_nowait()
+			except queue.Empty:
+				break
+
+			if 'result' in info:
+				listing['pending'].extend(info['result'])
+				finished = True
 			else:
-				attr_map = file['palette']
-				focus_map = 'selected'
+				listing['pending'].extend(info['files'])
+
+		if listing is not self.listing:
+			return not finished
 
-			w = urwid.AttrMap(SelectableColumns([urwid.Text(file['label'], layout=TildeLayout), ('pack', urwid.Text(file['size'])), ('pack', urwid.Text(format_date(file['lstat'].st_mtime)))], dividechars=1), attr_map, focus_map)
-			w.model = file
+		# The list gets rebuilt every time it doubles, so that listing a
+		# huge directory costs about twice as much as a single rebuild
+		if finished or (len(listing['pending']) >= len(self.files)):
+			self.add_files(listing)
 
-			if file['file'] == focus_path:
-				focus = len(labels)
+		if finished:
+			self.listing = None
+			self.update_free_space(listing['cwd'])
+			self.validate_tags()
+		else:
+			self.footer.set_title(f' Loading: {len(self.files) + len(listing["pending"])} ')
+
+		return not finished
+
+	def start_counting(self, files=()):
+		self.uncounted.extend([x for x in files if 'uncounted' in x])
+
+		if not (self.controller.loop and self.uncounted):
+			return
+
+		if self.count_fd is None:
+			self.count_fd = self.controller.loop.watch_pipe(self.on_dir_count)
+
+		for file in self.uncounted:
+			self.controller.dir_counter.count(file, file['uncounted'], self.count_fd, self.count_q, self.ev_count_cancel)
+
+		self.uncounted = []
+
+	def cancel_counting(self):
+		self.ev_count_cancel.set()
+		self.ev_count_cancel = threading.Event()
+		self.uncounted = []
+
+	def on_dir_count(self, data):
+		counted = False
+		while True:
+			try:
+				(ev_count_cancel, file, length) = self.count_q.get_nowait()
+			except queue.Empty:
+				break
+
+			if ev_count_cancel is not self.ev_count_cancel:
+				continue
+
+			if length < 0:
+				file['length'] = (-1,)
+				file['size'] = '?'
+			else:
+				file['length'] = (length,)
+				file['size'] = str(length)
 
-			labels.append(w)
+			del file['uncounted']
+			self.walker.invalidate(file)
+			counted = True
+
+		if counted:
+			self.sorted_files.pop(('sort_by_size', False), None)
+			self.sorted_files.pop(('sort_by_size', True), None)
+			if self.sort_method == 'sort_by_size':
+				self.filtered_order = None
+				self.filter_stack = []
+
+		if counted and (self.sort_method == 'sort_by_size') and not any('uncounted' in x for x in self.walker.files):
+			try:
+				focus_path = self.get_focus()['file']
+			except TypeError:
+				focus_path = None
+
+			self.update_list_box(focus_path)
+
+	def add_files(self, listing):
+		files = listing['pending']
+		listing['pending'] = []
+
+		self.files.extend(files)
+		self.sorted_files.clear()
+		self.start_counting(files)
+
+		if not self.show_hidden:
+			files = [x for x in files if not x['name'].startswith('.')]
+
+		self.shown_files.extend(files)
+
+		if self.file_filter:
+			files = fuzzy_filter(self.file_filter.casefold(), files)
+
+		self.filtered_files.extend(files)
+		self.filtered_order = None
+		self.filter_stack = []
+
+		try:
+			focus_path = self.get_focus()['file']
+		except TypeError:
+			focus_path = None
 
-		self.walker[:] = labels
+		# Until the user moves, the focus goes to the file that was asked
+		# for, as soon as it gets listed
+		if (focus_path == listing['auto_focus']) and (listing['focus_path'] is not None):
+			if any(x['file'] == listing['focus_path'] for x in files):
+				focus_path = listing['focus_path']
+
+		self.update_list_box(focus_path)
+
+		try:
+			listing['auto_focus'] = self.get_focus()['file']
+		except TypeError:
+			listing['auto_focus'] = None
+
+	def update_list_box(self, focus_path, focus_position=0):
+		# The sorted order of all the files is kept for every sort method,
+		# so that switching method or changing filter needs no sorting
+		sort_key = (self.sort_method, self.reverse)
+		try:
+			files = self.sorted_files[sort_key]
+		except KeyError:
+			by_name = self.sorted_files.get(('sort_by_name', False))
+			if by_name is None:
+				by_name = sort_files(self.files, 'sort_by_name')
+				self.sorted_files[('sort_by_name', False)] = by_name
+
+			files = sort_files(self.files, self.sort_method, self.reverse, by_name)
+			self.sorted_files[sort_key] = files
+
+		if self.filtered_order != sort_key:
+			if len(self.filtered_files) < len(self.files):
+				filtered = set(map(id, self.filtered_files))
+				self.filtered_files = [x for x in files if id(x) in filtered]
+			else:
+				self.filtered_files = files[:]
+
+			self.filtered_order = sort_key
+
+		focus = -1
+		if focus_path is not None:
+			for i, file in enumerate(self.filtered_files):
+				if file['file'] == focus_path:
+					focus = i
+					break
+
+		self.walker.set_files(self.filtered_files)
 
 		if focus < 0:
-			focus = min(focus_position, len(labels) - 1)
+			focus = min(focus_position, len(self.filtered_files) - 1)
 
 		self.walker.set_focus(focus)
 
@@ -629,15 +1302,38 @@ class Panel(urwid.WidgetWrap):
 		if show_hidden:
 			self.shown_files = self.files[:]
 		else:
-			self.shown_files = [x for x in self.files if not x['file'].name.startswith('.')]
+			self.shown_files = [x for x in self.files if not x['name'].startswith('.')]
+
+		self.filter_query = None
 
 	def apply_filter(self, filter):
 		self.file_filter = filter
+		query = filter.casefold()
 
-		if filter:
-			self.filtered_files = list(fuzzyfinder(filter, self.shown_files, accessor=lambda x: x['file'].name))
+		# A query that extends a previous one can only narrow down its
+		# results, which are already in display order, so the results of the
+		# previous queries are kept while typing and deleting characters
+		if self.filter_query is not None:
+			self.filter_stack.append((self.filter_query, self.filtered_files, self.filtered_order))
+		else:
+			self.filter_stack = []
+
+		while self.filter_stack and not is_subsequence(self.filter_stack[-1][0], query):
+			self.filter_stack.pop()
+
+		if self.filter_stack and (self.filter_stack[-1][0] == query):
+			(query, self.filtered_files, self.filtered_order) = self.filter_stack.pop()
+		elif self.filter_stack:
+			self.filtered_files = fuzzy_filter(query, self.filter_stack[-1][1])
+			self.filtered_order = self.filter_stack[-1][2]
+		elif query:
+			self.filtered_files = fuzzy_filter(query, self.shown_files)
+			self.filtered_order = None
 		else:
 			self.filtered_files = self.shown_files[:]
+			self.filtered_order = None
+
+		self.filter_query = query
 
 	def open_archive(self, file, fallback_enter=True):
 		if fallback_enter:
@@ -652,15 +1348,15 @@ class Panel(urwid.WidgetWrap):
 	def enter(self, file, open_archive=True):
 		if stat.S_ISDIR(file['stat'].st_mode):
 			self.chdir(file['file'])
-		elif 'link_target' in file:
+		elif stat.S_ISLNK(file['lstat'].st_mode):
 			try:
 				if self.unarchive_path(file['link_target'])[0].is_dir():
 					if file['link_target'] != self.cwd:
 						self.chdir(file['link_target'])
 				elif os.path.lexists(self.unarchive_path(file['link_target'])[0]):
 					if file['link_target'].parent == self.cwd:
-						for (i, line) in enumerate(self.walker):
-							if line.model['file'] == file['link_target']:
+						for (i, x) in enumerate(self.walker.files):
+							if x['file'] == file['link_target']:
 								self.walker.set_focus(i)
 								break
 					else:
@@ -746,10 +1442,8 @@ class Panel(urwid.WidgetWrap):
 
 			file_to_preview = self.unarchive_path(file['file'], include_self=False)[0]
 
-			if stat.S_ISDIR(file['stat'].st_mode):
-				self.controller.screen.preview_panel.read_directory(file_to_preview)
-			elif stat.S_ISREG(file['stat'].st_mode):
-				self.controller.screen.preview_panel.read_file(file_to_preview, file['stat'].st_size)
+			if stat.S_ISDIR(file['stat'].st_mode) or stat.S_ISREG(file['stat'].st_mode):
+				self.controller.screen.preview_panel.preview(file_to_preview, file['stat'])
 			else:
 				self.controller.screen.preview_panel.clear()
 		else:
@@ -767,8 +1461,8 @@ class Panel(urwid.WidgetWrap):
 
 		if filter:
 			try:
-				focus_path = self.filtered_files[0]['file']
-			except IndexError:
+				focus_path = best_match(self.filter_query, self.filtered_files)['file']
+			except TypeError:
 				focus_path = None
 
 		self.update_list_box(focus_path)
@@ -833,9 +1527,42 @@ class Panel(urwid.WidgetWrap):
 
 		self.update_list_box(focus_path)
 
+	def tag(self, file):
+		if file['file'] not in self.tagged_files:
+			if stat.S_ISDIR(file['lstat'].st_mode):
+				size = 0
+			else:
+				size = file['lstat'].st_size
+
+			self.tagged_files[file['file']] = size
+			self.tagged_size += size
+
+	def untag(self, file):
+		self.tagged_size -= self.tagged_files.pop(file, 0)
+
+	def set_tags(self, tagged_files):
+		self.tagged_files = tagged_files
+		self.tagged_size = sum(tagged_files.values())
+		self.update_tagged_count()
+
+	def validate_tags(self):
+		# The sizes of the tags are taken again from the new listing, and the
+		# tags of the files that are gone are dropped
+		if not self.tagged_files:
+			return
+
+		tagged_files = self.tagged_files
+		self.tagged_files = {}
+		self.tagged_size = 0
+		for file in self.files:
+			if file['file'] in tagged_files:
+				self.tag(file)
+
+		self.update_tagged_count()
+
 	def update_tagged_count(self):
 		if self.tagged_files:
-			self.details_separator.set_title(f' {human_readable_size(sum([self.unarchive_path(x)[0].lstat().st_size for x in self.tagged_files if not stat.S_ISDIR(self.unarchive_path(x)[0].lstat().st_mode)]))} in {len(self.tagged_files)} file{("s" if len(self.tagged_files) != 1 else "")} ')
+			self.details_separator.set_title(f' {human_readable_size(self.tagged_size)} in {len(self.tagged_files)} file{("s" if len(self.tagged_files) != 1 else "")} ')
 			self.details_separator.set_title_attr('marked')
 		else:
 			self.details_separator.set_title('─')
@@ -849,73 +1576,60 @@ class Panel(urwid.WidgetWrap):
 			return False
 
 		if file in self.tagged_files:
-			self.tagged_files.discard(file)
-			line.set_attr_map({None: line.model['palette']})
-			line.set_focus_map({None: 'selected'})
+			self.untag(file)
 		else:
-			self.tagged_files.add(file)
-			line.set_attr_map({None: 'marked'})
-			line.set_focus_map({None: 'markselect'})
+			self.tag(line.model)
 
+		self.walker.invalidate(line.model)
 		self.update_tagged_count()
 
 		return True
 
 	def tag_toggle_all(self):
-		for line in self.walker:
-			file = line.model['file']
+		for x in self.walker.files:
+			file = x['file']
 
 			if file in self.tagged_files:
-				self.tagged_files.discard(file)
-				line.set_attr_map({None: line.model['palette']})
-				line.set_focus_map({None: 'selected'})
+				self.untag(file)
 			else:
-				self.tagged_files.add(file)
-				line.set_attr_map({None: 'marked'})
-				line.set_focus_map({None: 'markselect'})
+				self.tag(x)
 
+		self.walker.invalidate()
 		self.update_tagged_count()
 
 	def tag_glob(self, pattern):
 		expression = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
 
 		try:
-			for line in self.walker:
-				file = line.model['file']
-
-				if expression.match(file.name):
-					self.tagged_files.add(file)
-					line.set_attr_map({None: 'marked'})
-					line.set_focus_map({None: 'markselect'})
+			for x in self.walker.files:
+				if expression.match(x['name']):
+					self.tag(x)
 		except ValueError:
 			pass
 
+		self.walker.invalidate()
 		self.update_tagged_count()
 
 	def untag_glob(self, pattern):
 		expression = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
 
 		try:
-			for line in self.walker:
-				file = line.model['file']
+			for x in self.walker.files:
+				file = x['file']
 
-				if expression.match(file.name):
-					self.tagged_files.discard(file)
-					line.set_attr_map({None: line.model['palette']})
-					line.set_focus_map({None: 'selected'})
+				if expression.match(x['name']):
+					self.untag(file)
 		except ValueError:
 			pass
 
+		self.walker.invalidate()
 		self.update_tagged_count()
 
 	def untag_all(self):
-		for line in self.walker:
-			file = line.model['file']
-
-			self.tagged_files.discard(file)
-			line.set_attr_map({None: line.model['palette']})
-			line.set_focus_map({None: 'selected'})
+		for x in self.walker.files:
+			self.untag(x['file'])
 
+		self.walker.invalidate()
 		self.update_tagged_count()
 
 	def get_tagged_files(self):
@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import os
+
+from .utils import (human_readable_size, existing_dir)
+from .debug_print import (debug_print, debug_pprint)
+
+
+def check_free_space(mode, file_list, dest, unarchive_path):
+	actual_dest = existing_dir(unarchive_path(dest)[0])
+	dest_dev = os.stat(actual_dest).st_dev
+	st = os.statvfs(actual_dest)
+
+	block_size = st.f_frsize or st.f_bsize
+	needed_blocks = 0
+	needed_inodes = 0
+	for file in file_list:
+		if file['status'] in ('DONE', 'ERROR', 'SKIPPED'):
+			continue
+
+		# Moving inside the same file system is just a rename
+		if (mode == 'mv') and (file['lstat'].st_dev == dest_dev):
+			continue
+
+		needed_inodes += 1
+
+		if file['is_file']:
+			needed_blocks += -(-file['lstat'].st_size // block_size)
+		elif file['is_dir']:
+			needed_blocks += 1
+
+	messages = []
+
+	free_bytes = st.f_bavail * block_size
+	needed_bytes = needed_blocks * block_size
+	if needed_bytes > free_bytes:
+		messages.append(f'need {human_readable_size(needed_bytes)}, only {human_readable_size(free_bytes)} free')
+
+	# File systems without a fixed inode table report 0 total inodes
+	if st.f_files and (needed_inodes > st.f_favail):
+		messages.append(f'need {needed_inodes} inodes, only {st.f_favail} free')
+
+	return messages
+
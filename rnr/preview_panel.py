@@ -19,16 +19,50 @@
 import sys
 import os
 
+import stat
+import collections
+import queue
+import threading
+
 from pathlib import Path
 
 import urwid
 
 from . import rnrview
 
-from .utils import (TildeLayout, TLineWidget)
+from .utils import (TildeLayout, TLineWidget, InterruptError)
 from .debug_print import (debug_print, debug_pprint)
 
 
+PREVIEW_CACHE_SIZE = 16
+
+
+def load_view(filename, st, tabsize, use_line_highlight, ev_cancel=None):
+	view = rnrview.FileView(filename, tabsize, use_line_highlight, ev_cancel)
+	try:
+		if stat.S_ISDIR(st.st_mode):
+			view.read_directory()
+		else:
+			view.read_file(st.st_size)
+	except (OSError, InterruptError):
+		view.close()
+		return None
+
+	return view
+
+def rnr_preview(key, filename, st, tabsize, use_line_highlight, fd, q, ev_cancel):
+	if ev_cancel.is_set():
+		view = None
+	else:
+		view = load_view(filename, st, tabsize, use_line_highlight, ev_cancel)
+
+	q.put((key, view))
+	try:
+		os.write(fd, b'\n')
+	except OSError:
+		pass
+
+
 class PreviewPanel(urwid.WidgetWrap):
 	def __init__(self, controller):
 		self.controller = controller
@@ -38,7 +72,8 @@ class PreviewPanel(urwid.WidgetWrap):
 
 		self.walker = urwid.SimpleFocusListWalker([])
 		self.listbox = rnrview.FileViewListBox(controller, controller.tabsize, use_line_highlight=True)
-		self.attr_listbox = urwid.AttrMap(self.listbox, 'Text')
+		urwid.connect_signal(self.listbox, 'matches', self.on_matches)
+		self.attr_listbox = urwid.AttrMap(urwid.Columns([self.listbox, (1, rnrview.MatchMap(self.listbox))]), 'Text')
 		listbox = urwid.LineBox(self.attr_listbox, tline='', bline='')
 		listbox = urwid.AttrMap(listbox, 'panel')
 
@@ -49,6 +84,15 @@ class PreviewPanel(urwid.WidgetWrap):
 
 		self.focused = False
 
+		self.views = collections.OrderedDict()
+		self.view_key = None
+		self.preview_alarm = None
+		self.next_preview = None
+		self.loading = False
+		self.ev_cancel = threading.Event()
+		self.preview_fd = None
+		self.preview_q = queue.Queue()
+
 		try:
 			cwd = Path.cwd()
 		except OSError:
@@ -64,28 +108,106 @@ class PreviewPanel(urwid.WidgetWrap):
 
 		super().__init__(self.pile)
 
-	def read_file(self, filename, file_size):
-		try:
-			self.attr_listbox.set_attr_map({None: 'Text'})
-			self.listbox.read_file(filename, file_size)
-			self.cwd = Path(filename).parent
-		except OSError:
-			self.listbox.clear()
+	def preview(self, filename, st):
+		# The file is read only once the cursor rests on it, away from the UI
+		# thread, and the most recent previews are kept around
+		self.cancel_preview()
+
+		key = (str(filename), st.st_mtime_ns, st.st_size)
+		self.view_key = key
 
-	def read_directory(self, filename):
 		try:
+			self.views.move_to_end(key)
+			self.show_view(self.views[key])
+			return
+		except KeyError:
+			pass
+
+		self.listbox.clear()
+
+		if self.controller.loop:
+			self.preview_alarm = self.controller.loop.set_alarm_in(self.controller.preview_delay, self.start_preview, (key, filename, st))
+		else:
+			self.add_view(key, load_view(filename, st, self.listbox.tabsize, self.listbox.use_line_highlight))
+
+	def start_preview(self, loop, user_data):
+		self.preview_alarm = None
+
+		# Only one file is read at a time, and only the last one asked for
+		# is read next
+		if self.loading:
+			self.next_preview = user_data
+			return
+
+		self.loading = True
+
+		if self.preview_fd is None:
+			self.preview_fd = self.controller.loop.watch_pipe(self.on_preview)
+
+		(key, filename, st) = user_data
+		threading.Thread(target=rnr_preview, args=(key, filename, st, self.listbox.tabsize, self.listbox.use_line_highlight, self.preview_fd, self.preview_q, self.ev_cancel), daemon=True).start()
+
+	def cancel_preview(self):
+		if self.preview_alarm is not None:
+			self.controller.loop.remove_alarm(self.preview_alarm)
+			self.preview_alarm = None
+
+		self.ev_cancel.set()
+		self.ev_cancel = threading.Event()
+		self.view_key = None
+
+	def on_preview(self, data):
+		while True:
+			try:
+				(key, view) = self.preview_q.get_nowait()
+			except queue.Empty:
+				break
+
+			self.add_view(key, view)
+			self.loading = False
+
+		if (self.next_preview is not None) and not self.loading:
+			(next_preview, self.next_preview) = (self.next_preview, None)
+			if next_preview[0] == self.view_key:
+				self.start_preview(self.controller.loop, next_preview)
+
+	def add_view(self, key, view):
+		# The views that drop out of the cache are never shown, so their
+		# files can be closed right away
+		if view is not None:
+			self.views[key] = view
+			if len(self.views) > PREVIEW_CACHE_SIZE:
+				self.views.popitem(last=False)[1].close()
+
+		if key == self.view_key:
+			if view is not None:
+				self.show_view(view)
+			else:
+				self.listbox.clear()
+
+	def show_view(self, view):
+		if isinstance(view.walker, rnrview.TextDirectoryWalker):
 			self.attr_listbox.set_attr_map({None: 'panel'})
-			self.listbox.read_directory(filename)
-			self.cwd = Path(filename)
-		except OSError:
-			self.listbox.clear()
+			self.cwd = Path(view.filename)
+		else:
+			self.attr_listbox.set_attr_map({None: 'Text'})
+			self.cwd = Path(view.filename).parent
+
+		self.listbox.set_view(view)
 
 	def clear(self):
+		self.cancel_preview()
 		self.listbox.clear()
 
 	def set_title_attr(self, attr):
 		self.title.set_title_attr(attr)
 
+	def on_matches(self, listbox, text):
+		if text:
+			self.footer.set_title(f' {text} ')
+		else:
+			self.footer.set_title('')
+
 	def set_title(self, title):
 		self.title.set_title(f' (Preview) {str(title)} ')
 
@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+import ctypes
+
+from threading import Lock
+from multiprocessing.sharedctypes import RawArray
+
+from .debug_print import (debug_print, debug_pprint)
+
+
+MAX_STRING_SIZE = 4096
+
+
+class Progress(object):
+	def __init__(self, fields):
+		self.int_fields = {}
+		self.str_fields = {}
+
+		for key, value in fields.items():
+			if isinstance(value, str):
+				self.str_fields[key] = RawArray(ctypes.c_char, MAX_STRING_SIZE)
+			else:
+				self.int_fields[key] = len(self.int_fields)
+
+		# The last slot is a sequence counter: it is odd while a string is
+		# being written, so that readers can detect a torn read and retry
+		self.seq = len(self.int_fields)
+		self.ints = RawArray(ctypes.c_longlong, len(self.int_fields) + 1)
+
+		# The writers are the threads of the worker process: they take turns,
+		# so that the sequence counter stays consistent
+		self.lock = Lock()
+
+		self.update(fields)
+
+	def __getitem__(self, key):
+		try:
+			return self.ints[self.int_fields[key]]
+		except KeyError:
+			return os.fsdecode(self.str_fields[key].value)
+
+	def __setitem__(self, key, value):
+		with self.lock:
+			try:
+				self.ints[self.int_fields[key]] = value
+			except KeyError:
+				buf = self.str_fields[key]
+				self.ints[self.seq] += 1
+				buf.value = os.fsencode(str(value))[:MAX_STRING_SIZE - 1]
+				self.ints[self.seq] += 1
+
+	def add(self, key, value):
+		with self.lock:
+			self.ints[self.int_fields[key]] += value
+
+	def update(self, fields):
+		for key, value in fields.items():
+			self[key] = value
+
+	def snapshot(self):
+		for i in range(10):
+			seq = self.ints[self.seq]
+			info = {key: self[key] for key in self.str_fields}
+			if (not (seq & 1)) and (self.ints[self.seq] == seq):
+				break
+
+		info.update({key: self.ints[i] for key, i in self.int_fields.items()})
+
+		return info
@@ -27,24 +27,27 @@ import shutil
 from pathlib import Path
 
 from .database import DataBase
+from .progress import Progress
+from .durability import Durability
 from .utils import (InterruptError, AbortedError, SkippedError)
 from .debug_print import (debug_print, debug_pprint)
 
 from .fallocate import *
+from .fiemap import physical_offset
 
 
-def rnr_copyfile(cur_file, cur_target, file_size, block_size, resume, info, timers, fd, q, ev_skip, ev_suspend, ev_interrupt, ev_abort, dbfile):
+def rnr_copyfile(cur_file, cur_target, file_size, block_size, resume, info, timers, ev_skip, ev_suspend, ev_interrupt, ev_abort, sync):
 	with open(cur_file, 'rb') as fh:
 		if resume:
 			try:
-				target_fd = os.open(cur_target, os.O_WRONLY | (os.O_DSYNC if dbfile else 0), stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
+				target_fd = os.open(cur_target, os.O_WRONLY | (os.O_DSYNC if sync else 0), stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
 			except OSError as e:
 				if e.errno == errno.EOPNOTSUPP:
-					target_fd = os.open(cur_target, os.O_TRUNC | os.O_WRONLY | (os.O_DSYNC if dbfile else 0), stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
+					target_fd = os.open(cur_target, os.O_TRUNC | os.O_WRONLY | (os.O_DSYNC if sync else 0), stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
 				else:
 					raise
 		else:
-			target_fd = os.open(cur_target, os.O_CREAT | os.O_EXCL | os.O_TRUNC | os.O_WRONLY | (os.O_DSYNC if dbfile else 0), stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
+			target_fd = os.open(cur_target, os.O_CREAT | os.O_EXCL | os.O_TRUNC | os.O_WRONLY | (os.O_DSYNC if sync else 0), stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
 
 		try:
 			if resume:
@@ -52,8 +55,8 @@ def rnr_copyfile(cur_file, cur_target, file_size, block_size, resume, info, time
 				pos = max((int(bytes_written / block_size) - 1) * block_size, 0)
 				os.lseek(target_fd, pos, os.SEEK_SET)
 				fh.seek(pos)
-				info['cur_bytes'] += pos
-				info['bytes'] += pos
+				info.add('cur_bytes', pos)
+				info.add('bytes', pos)
 			else:
 				try:
 					fallocate(target_fd, FALLOC_FL_KEEP_SIZE, 0, file_size)
@@ -87,26 +90,76 @@ def rnr_copyfile(cur_file, cur_target, file_size, block_size, resume, info, time
 				while bytes_written < buffer_length:
 					bytes_written += os.write(target_fd, buf[bytes_written:])
 
-				info['cur_bytes'] += bytes_written
-				info['bytes'] += bytes_written
+				info.add('cur_bytes', bytes_written)
+				info.add('bytes', bytes_written)
 				now = time.monotonic()
 				if (now - timers['last_write']) > 0.05:
 					timers['last_write'] = now
 					info['cur_time'] = int(round(now - timers['cur_start']))
 					info['time'] = int(round(now - timers['start']))
-					q.put(info.copy())
-					try:
-						os.write(fd, b'\n')
-					except OSError:
-						pass
 		finally:
 			os.close(target_fd)
 
-def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev_interrupt, ev_abort, ev_nodb, dbfile, job_id, unarchive_path):
+def sort_by_physical_offset(file_list, cwd, unarchive_path, info, ev_suspend, ev_interrupt, ev_abort):
+	# Directories, symlinks and special files keep their path order, so that
+	# directories are created before the files they contain
+	other_files = []
+	regular_files = []
+	for file in file_list:
+		if not file['is_file']:
+			other_files.append(file)
+			continue
+
+		ev_suspend.wait()
+
+		# Once the job is interrupted or aborted, the remaining files are
+		# not looked up anymore, and are ordered by inode number
+		offset = None
+		if (file['status'] not in ('DONE', 'ERROR', 'SKIPPED')) and (not ev_interrupt.is_set()) and (not ev_abort.is_set()):
+			info['cur_source'] = str(Path(file['file']).relative_to(cwd))
+			try:
+				offset = physical_offset(unarchive_path(file['file'], include_self=False)[0])
+			except OSError:
+				pass
+
+		# Files whose extents are unknown are ordered by inode number,
+		# that is a good proxy of their position on most file systems
+		if offset is None:
+			key = (file['lstat'].st_dev, 1, file['lstat'].st_ino)
+		else:
+			key = (file['lstat'].st_dev, 0, offset)
+
+		regular_files.append((key, file))
+
+	regular_files.sort(key=lambda x: x[0])
+
+	return other_files + [x[1] for x in regular_files]
+
+def cpmv_progress():
+	return Progress({
+		'cur_source': '',
+		'cur_target': '',
+		'cur_size': 0,
+		'cur_bytes': 0,
+		'cur_time': 0,
+		'files': 0,
+		'bytes': 0,
+		'time': 0,
+	})
+
+def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, info, ev_skip, ev_suspend, ev_interrupt, ev_abort, ev_nodb, dbfile, job_id, unarchive_path, physical_order=False, fsync_policy='file', fsync_interval=5):
 	if dbfile:
 		db = DataBase(dbfile)
 
+	durability = Durability(fsync_policy, fsync_interval, dbfile)
+
 	file_list = sorted(files, key=lambda x: x['file'].replace(os.sep, '\0'))
+
+	# The skip and rename directory stacks rely on every file coming right
+	# after its parent directory, so only plain copies can be reordered
+	if physical_order and (mode == 'cp') and (on_conflict != 'rename_copy'):
+		file_list = sort_by_physical_offset(file_list, cwd, unarchive_path, info, ev_suspend, ev_interrupt, ev_abort)
+
 	error_list = [{'file': x['file'], 'message': x['message']} for x in file_list if x['status'] == 'ERROR']
 	skipped_list = [{'file': x['file'], 'message': x['message']} for x in file_list if x['status'] == 'SKIPPED']
 	completed_list = [{'file': x['file'], 'message': x['message']} for x in file_list if x['status'] == 'DONE']
@@ -122,17 +175,6 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 	except (OSError, AttributeError):
 		block_size = default_block_size
 
-	info = {
-		'cur_source': '',
-		'cur_target': '',
-		'cur_size': 0,
-		'cur_bytes': 0,
-		'cur_time': 0,
-		'files': 0,
-		'bytes': 0,
-		'time': 0,
-	}
-
 	timers = {}
 
 	if dbfile:
@@ -155,6 +197,8 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 		if dbfile:
 			db.set_replace_first_path(job_id, replace_first_path)
 
+	interrupted = False
+	aborted = False
 	total_bytes = 0
 	timers['start'] = time.monotonic()
 	timers['last_write'] = timers['start']
@@ -167,6 +211,7 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 				db.delete_job(job_id)
 				del db
 				dbfile = None
+				durability.policy = 'job'
 
 			if file['status'] in ('DONE', 'ERROR', 'SKIPPED'):
 				raise SkippedError('no_log')
@@ -229,9 +274,24 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 						cur_target = Path(x)
 						actual_target = unarchive_path(cur_target, include_self=False)[0]
 
+					if (mode == 'mv') and os.path.lexists(actual_target) and (not os.path.lexists(actual_file)):
+						# Moved before the crash, but not yet marked as DONE
+						if file['is_dir']:
+							skip_dir_stack.append(cur_file)
+							if dbfile:
+								db.set_skip_dir_stack(job_id, skip_dir_stack)
+
+						raise SkippedError('no_log')
+
 					if os.path.lexists(actual_target):
 						resume = True
 
+						# Without synchronous writes the data on disk might
+						# be older than the file size, so the copy restarts
+						if file['is_file'] and (not file.get('sync_writes', True)):
+							when = 'truncate'
+							os.truncate(actual_target, 0)
+
 						if warning:
 							if not warning.startswith('Resumed'):
 								warning = f'Resumed -- {warning}'
@@ -300,6 +360,11 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 					file['target_is_symlink'] = target_is_symlink
 					file['cur_target'] = str(cur_target)
 
+				# A file moved across filesystems must be on disk before its
+				# source gets removed, whatever the policy
+				sync_writes = bool(dbfile) and (durability.data_sync() or (mode == 'mv'))
+				file['sync_writes'] = sync_writes
+
 				if dbfile:
 					db.update_file(file, 'IN_PROGRESS')
 
@@ -323,11 +388,6 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 					timers['last_write'] = now
 					info['cur_time'] = int(round(now - timers['cur_start']))
 					info['time'] = int(round(now - timers['start']))
-					q.put(info.copy())
-					try:
-						os.write(fd, b'\n')
-					except OSError:
-						pass
 
 				if skip_dir:
 					raise SkippedError('no_log')
@@ -365,7 +425,7 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 							db.set_dir_list(job_id, dir_list)
 					elif file['is_file']:
 						when = 'copyfile'
-						rnr_copyfile(actual_file, actual_target, file['lstat'].st_size, block_size, resume, info, timers, fd, q, ev_skip, ev_suspend, ev_interrupt, ev_abort, dbfile)
+						rnr_copyfile(actual_file, actual_target, file['lstat'].st_size, block_size, resume, info, timers, ev_skip, ev_suspend, ev_interrupt, ev_abort, sync_writes)
 					else:
 						in_error = True
 						message = f'Special file'
@@ -404,7 +464,7 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 						when = 'fsync'
 						parent_fd = os.open(parent_dir, 0)
 						try:
-							if dbfile:
+							if sync_writes:
 								os.fsync(parent_fd)
 						finally:
 							os.close(parent_fd)
@@ -417,21 +477,26 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 					when = 'fsync'
 					parent_fd = os.open(actual_file.parent, 0)
 					try:
-						if dbfile:
+						if dbfile and durability.data_sync():
 							os.fsync(parent_fd)
 					finally:
 						os.close(parent_fd)
 
 				if not in_error:
 					completed_list.append({'file': file['file'], 'message': warning})
-					if dbfile:
-						db.set_file_status(file, 'DONE', warning)
+
+					dirs = [parent_dir]
+					if mode == 'mv':
+						dirs.append(actual_file.parent)
+
+					durability.add(dirs, [(file, 'DONE', warning)], (db if dbfile else None))
 			except OSError as e:
 				message = f'({when}) {e.strerror} ({e.errno})'
 				error_list.append({'file': file['file'], 'message': message})
 				if dbfile:
 					db.set_file_status(file, 'ERROR', message)
 		except InterruptError as e:
+			interrupted = True
 			break
 		except AbortedError as e:
 			try:
@@ -440,9 +505,7 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 				pass
 
 			aborted_list.extend([{'file': x['file'], 'message': ''} for x in file_list[i_file:]])
-			if dbfile:
-				db.set_job_status(job_id, 'ABORTED')
-
+			aborted = True
 			break
 		except SkippedError as e:
 			if str(e) == 'no_log':
@@ -469,7 +532,10 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 
 		total_bytes += file['lstat'].st_size
 		info['bytes'] = total_bytes
-		info['files'] += 1
+		info.add('files', 1)
+
+	# Moving the directories relies on their files being moved for good
+	durability.flush(db if dbfile else None)
 
 	for entry in reversed(dir_list):
 		try:
@@ -480,6 +546,7 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 				db.delete_job(job_id)
 				del db
 				dbfile = None
+				durability.policy = 'job'
 
 			timers['cur_start'] = time.monotonic()
 
@@ -514,11 +581,6 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 				timers['last_write'] = now
 				info['cur_time'] = int(round(now - timers['cur_start']))
 				info['time'] = int(round(now - timers['start']))
-				q.put(info.copy())
-				try:
-					os.write(fd, b'\n')
-				except OSError:
-					pass
 
 			when = ''
 			try:
@@ -554,11 +616,12 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 				when = 'fsync'
 				parent_fd = os.open(parent_dir, 0)
 				try:
-					if dbfile:
+					if dbfile and durability.data_sync():
 						os.fsync(parent_fd)
 				finally:
 					os.close(parent_fd)
 
+				dirs = [parent_dir]
 				if mode == 'mv':
 					when = 'rmdir'
 					os.rmdir(actual_file)
@@ -566,24 +629,24 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 					when = 'fsync'
 					parent_fd = os.open(actual_file.parent, 0)
 					try:
-						if dbfile:
+						if dbfile and durability.data_sync():
 							os.fsync(parent_fd)
 					finally:
 						os.close(parent_fd)
+
+					dirs.append(actual_file.parent)
+
+				durability.add(dirs, [], (db if dbfile else None))
 			except OSError as e:
 				message = f'({when}) {e.strerror} ({e.errno})'
 				error_list.append({'file': file['file'], 'message': message})
 				if dbfile:
 					db.set_file_status(file, 'ERROR', message)
-
-			if dbfile:
-				db.set_job_status(job_id, 'DONE')
 		except InterruptError as e:
+			interrupted = True
 			break
 		except AbortedError as e:
-			if dbfile:
-				db.set_job_status(job_id, 'ABORTED')
-
+			aborted = True
 			break
 		except SkippedError as e:
 			if str(e) == 'no_log':
@@ -604,12 +667,20 @@ def rnr_cpmv(mode, files, cwd, dest, on_conflict, fd, q, ev_skip, ev_suspend, ev
 				if dbfile:
 					db.set_file_status(file, 'SKIPPED', message)
 
-	if not dbfile:
-		os.sync()
+	# A job whose changes could not be synced stays IN_PROGRESS, so that
+	# it gets redone if they are lost
+	synced = durability.flush(db if dbfile else None)
+	if not synced:
+		error_list.append(durability.error)
+
+	if dbfile and synced and (not interrupted):
+		db.set_job_status(job_id, ('ABORTED' if aborted else 'DONE'))
 
-	q.put({'result': completed_list, 'error': error_list, 'skipped': skipped_list, 'aborted': aborted_list})
 	try:
+		# The wake up comes first: with the process backend a large result
+		# would fill the queue pipe before the UI starts reading it
 		os.write(fd, b'\n')
+		q.put({'result': completed_list, 'error': error_list, 'skipped': skipped_list, 'aborted': aborted_list})
 	except OSError:
 		pass
 	os.close(fd)
@@ -15,147 +15,200 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
-
 import sys
 import os
 
 import time
 import errno
+import concurrent.futures
+
+from concurrent.futures import ThreadPoolExecutor
 
 from .database import DataBase
-from .utils import (InterruptError, AbortedError, SkippedError)
+from .progress import Progress
+from .durability import (Durability, fsync_dir)
 from .debug_print import (debug_print, debug_pprint)
 
 
-def rnr_delete(files, fd, q, ev_skip, ev_suspend, ev_interrupt, ev_abort, ev_nodb, dbfile, job_id, unarchive_path):
-	if dbfile:
-		db = DataBase(dbfile)
+CHUNK_SIZE = 1024
 
-	file_list = sorted(files, key=lambda x: x['file'].replace(os.sep, '\0'), reverse=True)
-	error_list = [{'file': x['file'], 'message': x['message']} for x in file_list if x['status'] == 'ERROR']
-	skipped_list = [{'file': x['file'], 'message': x['message']} for x in file_list if x['status'] == 'SKIPPED']
-	completed_list = [{'file': x['file'], 'message': x['message']} for x in file_list if x['status'] == 'DONE']
-	aborted_list = []
 
-	info = {
+def delete_progress():
+	return Progress({
 		'current': '',
 		'files': 0,
 		'bytes': 0,
 		'time': 0,
-	}
+	})
 
-	timers = {}
+def delete_entries(parent, actual_parent, entries, info, ev_skip, ev_suspend, ev_interrupt, ev_abort):
+	results = []
 
-	timers['start'] = time.monotonic()
-	timers['last_write'] = timers['start']
-	for i_file, file in enumerate(file_list):
-		try:
-			if ev_interrupt.is_set():
-				raise InterruptError()
-
-			if dbfile and ev_nodb.is_set():
-				db.delete_job(job_id)
-				del db
-				dbfile = None
-
-			t1 = time.monotonic()
-			ev_suspend.wait()
-			t2 = time.monotonic()
-			timers['start'] += round(t2 - t1)
+	info['current'] = parent
 
-			if ev_abort.is_set():
-				raise AbortedError()
+	try:
+		dir_fd = os.open(actual_parent, os.O_RDONLY | os.O_DIRECTORY)
+	except OSError as e:
+		if e.errno == errno.ENOENT:
+			return [(file, 'DONE', '') for file in entries]
 
-			if ev_skip.is_set():
-				ev_skip.clear()
-				raise SkippedError('ev_skip')
+		message = f'{e.strerror} ({e.errno})'
+		return [(file, 'ERROR', message) for file in entries]
 
-			if file['status'] in ('DONE', 'ERROR', 'SKIPPED'):
-				raise SkippedError('no_log')
+	try:
+		for file in entries:
+			ev_suspend.wait()
 
-			info['current'] = file['file']
+			if ev_interrupt.is_set() or ev_abort.is_set():
+				break
 
-			now = time.monotonic()
-			if (now - timers['last_write']) > 0.05:
-				timers['last_write'] = now
-				info['time'] = int(round(now - timers['start']))
-				q.put(info.copy())
-				try:
-					os.write(fd, b'\n')
-				except OSError:
-					pass
+			if ev_skip.is_set():
+				ev_skip.clear()
+				results.append((file, 'SKIPPED', ''))
+				continue
 
+			name = os.path.basename(file['file'])
 			try:
-				if dbfile:
-					db.set_file_status(file, 'IN_PROGRESS')
-
-				actual_file = unarchive_path(file['file'], include_self=False)[0]
-				parent_dir = actual_file.resolve().parent
-
 				if file['is_dir']:
-					os.rmdir(actual_file)
+					os.rmdir(name, dir_fd=dir_fd)
 				else:
-					os.remove(actual_file)
-
-				parent_fd = os.open(parent_dir, 0)
-				try:
-					if dbfile:
-						os.fsync(parent_fd)
-				finally:
-					os.close(parent_fd)
-
-				completed_list.append({'file': file['file'], 'message': ''})
-				if dbfile:
-					db.set_file_status(file, 'DONE', '')
+					os.unlink(name, dir_fd=dir_fd)
+
+				results.append((file, 'DONE', ''))
 			except OSError as e:
 				if e.errno == errno.ENOENT:
-					completed_list.append({'file': file['file'], 'message': ''})
-					if dbfile:
-						db.set_file_status(file, 'DONE', '')
+					results.append((file, 'DONE', ''))
 				else:
-					message = f'{e.strerror} ({e.errno})'
-					error_list.append({'file': file['file'], 'message': message})
-					if dbfile:
-						db.set_file_status(file, 'ERROR', message)
-
-			if dbfile:
-				db.set_job_status(job_id, 'DONE')
-		except InterruptError as e:
-			break
-		except AbortedError as e:
-			aborted_list.extend([{'file': x['file'], 'message': ''} for x in file_list[i_file:]])
-			if dbfile:
-				db.set_job_status(job_id, 'ABORTED')
-			break
-		except SkippedError as e:
-			if str(e) == 'no_log':
-				if file['status'] == 'ERROR':
-					error_list.append({'file': file['file'], 'message': file['message']})
-				elif file['status'] == 'SKIPPED':
-					skipped_list.append({'file': file['file'], 'message': file['message']})
-				else:
-					completed_list.append({'file': file['file'], 'message': ''})
-					if dbfile and file['status'] != 'DONE':
-						db.set_file_status(file, 'DONE', '')
-			else:
-				message = str(e)
-				if message == 'ev_skip':
-					message = ''
+					results.append((file, 'ERROR', f'{e.strerror} ({e.errno})'))
+	finally:
+		os.close(dir_fd)
+
+	return results
 
-				skipped_list.append({'file': file['file'], 'message': message})
-				if dbfile:
-					db.set_file_status(file, 'SKIPPED', message)
+def rnr_delete(files, fd, q, info, ev_skip, ev_suspend, ev_interrupt, ev_abort, ev_nodb, dbfile, job_id, unarchive_path, num_workers=1, fsync_policy='file', fsync_interval=5):
+	if dbfile:
+		db = DataBase(dbfile)
 
-		info['bytes'] += file['lstat'].st_size
-		info['files'] += 1
+	durability = Durability(fsync_policy, fsync_interval, dbfile, sync_data=False)
+
+	error_list = [{'file': x['file'], 'message': x['message']} for x in files if x['status'] == 'ERROR']
+	skipped_list = [{'file': x['file'], 'message': x['message']} for x in files if x['status'] == 'SKIPPED']
+	completed_list = [{'file': x['file'], 'message': x['message']} for x in files if x['status'] == 'DONE']
+	aborted_list = []
 
-	if not dbfile:
-		os.sync()
+	# Every directory is emptied before its parent gets processed, so the
+	# entries are grouped by parent directory, and the parents by depth
+	levels = {}
+	for file in files:
+		if file['status'] in ('DONE', 'ERROR', 'SKIPPED'):
+			info.add('bytes', file['lstat'].st_size)
+			info.add('files', 1)
+			continue
+
+		parent = os.path.dirname(file['file'])
+		levels.setdefault(parent.count(os.sep), {}).setdefault(parent, []).append(file)
+
+	sync_errors = []
+
+	timers = {}
+
+	timers['start'] = time.monotonic()
+	with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+		for depth in sorted(levels, reverse=True):
+			if ev_interrupt.is_set() or ev_abort.is_set():
+				break
+
+			# Sibling directories are independent of each other, and a big
+			# directory is split in chunks, so that they all run in parallel
+			tasks = {}
+			remaining = {}
+			results = {}
+			for parent, entries in levels[depth].items():
+				actual_parent = unarchive_path(parent)[0]
+				remaining[parent] = 0
+				results[parent] = []
+				for i in range(0, len(entries), CHUNK_SIZE):
+					future = executor.submit(delete_entries, parent, actual_parent, entries[i:i + CHUNK_SIZE], info, ev_skip, ev_suspend, ev_interrupt, ev_abort)
+					tasks[future] = (parent, actual_parent)
+					remaining[parent] += 1
+
+			pending = set(tasks)
+			while pending:
+				(done, pending) = concurrent.futures.wait(pending, timeout=0.05, return_when=concurrent.futures.FIRST_COMPLETED)
+
+				if dbfile and ev_nodb.is_set():
+					db.delete_job(job_id)
+					del db
+					dbfile = None
+					durability.policy = 'job'
+
+				if not ev_suspend.is_set():
+					t1 = time.monotonic()
+					ev_suspend.wait()
+					t2 = time.monotonic()
+					timers['start'] += t2 - t1
+
+				info['time'] = int(round(time.monotonic() - timers['start']))
+
+				for future in done:
+					(parent, actual_parent) = tasks[future]
+					results[parent].extend(future.result())
+					remaining[parent] -= 1
+					if remaining[parent]:
+						continue
+
+					# The directory is synced before its entries are marked as
+					# DONE, so that a resumed job never skips a file that is
+					# still there. If it can't be synced, they stay IN_PROGRESS
+					if dbfile and durability.data_sync():
+						try:
+							fsync_dir(actual_parent)
+						except OSError as e:
+							sync_errors.append({'file': parent, 'message': f'Cannot sync to disk: {e.strerror} ({e.errno})'})
+						else:
+							durability.add([actual_parent], results[parent], db)
+					else:
+						durability.add([actual_parent], results[parent], (db if dbfile else None))
+
+					for file, status, message in results[parent]:
+						file['status'] = status
+						file['message'] = message
+
+						if status == 'DONE':
+							completed_list.append({'file': file['file'], 'message': message})
+						elif status == 'ERROR':
+							error_list.append({'file': file['file'], 'message': message})
+						else:
+							skipped_list.append({'file': file['file'], 'message': message})
+
+						info.add('bytes', file['lstat'].st_size)
+						info.add('files', 1)
+
+	# A job whose changes could not be synced stays IN_PROGRESS, so that
+	# it gets redone if they are lost
+	synced = durability.flush(db if dbfile else None)
+	if not synced:
+		error_list.append(durability.error)
+
+	if sync_errors:
+		error_list.extend(sync_errors)
+		synced = False
+
+	if ev_abort.is_set() and (not ev_interrupt.is_set()):
+		for parents in levels.values():
+			for entries in parents.values():
+				aborted_list.extend([{'file': x['file'], 'message': ''} for x in entries if x['status'] not in ('DONE', 'ERROR', 'SKIPPED')])
+
+		if dbfile and synced:
+			db.set_job_status(job_id, 'ABORTED')
+	elif dbfile and synced and (not ev_interrupt.is_set()):
+		db.set_job_status(job_id, 'DONE')
 
-	q.put({'result': completed_list, 'error': error_list, 'skipped': skipped_list, 'aborted': aborted_list})
 	try:
+		# The wake up comes first: with the process backend a large result
+		# would fill the queue pipe before the UI starts reading it
 		os.write(fd, b'\n')
+		q.put({'result': completed_list, 'error': error_list, 'skipped': skipped_list, 'aborted': aborted_list})
 	except OSError:
 		pass
 	os.close(fd)
-
@@ -19,18 +19,23 @@
 import sys
 import os
 
-import time
+from threading import (Thread, Event)
 
+from .progress import Progress
 from .debug_print import (debug_print, debug_pprint)
 
 
-def recursive_dirscan(dir_, file_list, error_list, skipped_list, info, last_write, fd, q, ev_interrupt, ev_abort, ev_skip, archive_path):
+SCAN_POLL_INTERVAL = 0.05
+
+
+def recursive_dirscan(dir_, file_list, error_list, skipped_list, info, ev_interrupt, ev_abort, ev_skip, archive_path, root_dev=None):
 	files = []
 	errors = []
 	old_files = info['files']
 	old_bytes = info['bytes']
 
 	shown_dir = str(archive_path(dir_, include_self=False)[0])
+	info['current'] = shown_dir
 	for file in os.scandir(dir_):
 		if ev_interrupt.is_set():
 			return False
@@ -48,29 +53,24 @@ def recursive_dirscan(dir_, file_list, error_list, skipped_list, info, last_writ
 		shown_file = str(archive_path(file.path, include_self=False)[0])
 		try:
 			lstat = file.stat(follow_symlinks=False)
-			info['current'] = shown_dir
+			if (root_dev is not None) and (lstat.st_dev != root_dev) and file.is_dir(follow_symlinks=False):
+				skipped_list.append({'file': shown_file, 'message': 'Mountpoint'})
+				continue
+
 			info['files'] += 1
 			info['bytes'] += lstat.st_size
 			if file.is_symlink():
 				files.append({'file': shown_file, 'is_dir': False, 'is_symlink': True, 'is_file': False, 'lstat': lstat, 'status': 'TO_DO', 'message': ''})
 			elif file.is_dir():
 				files.append({'file': shown_file, 'is_dir': True, 'is_symlink': False, 'is_file': False, 'lstat': lstat, 'status': 'TO_DO', 'message': ''})
-				if not recursive_dirscan(file.path, file_list, error_list, skipped_list, info, last_write, fd, q, ev_interrupt, ev_abort, ev_skip, archive_path):
+				if not recursive_dirscan(file.path, file_list, error_list, skipped_list, info, ev_interrupt, ev_abort, ev_skip, archive_path, root_dev):
 					files.pop()
 					info['files'] -= 1
 					info['bytes'] -= lstat.st_size
 
+				info['current'] = shown_dir
 			else:
 				files.append({'file': shown_file, 'is_dir': False, 'is_symlink': False, 'is_file': file.is_file(), 'lstat': lstat, 'status': 'TO_DO', 'message': ''})
-
-			now = time.monotonic()
-			if (now - last_write[0]) > 0.05:
-				last_write[0] = now
-				q.put(info.copy())
-				try:
-					os.write(fd, b'\n')
-				except OSError:
-					pass
 		except OSError as e:
 			errors.append({'file': shown_file, 'message': f'{e.strerror} ({e.errno})'})
 
@@ -79,18 +79,19 @@ def recursive_dirscan(dir_, file_list, error_list, skipped_list, info, last_writ
 
 	return True
 
-def rnr_dirscan(files, cwd, fd, q, ev_interrupt, ev_abort, ev_skip, archive_path):
-	file_list = []
-	error_list = []
-	skipped_list = []
+def group_by_device(files):
+	groups = {}
+	for file in files:
+		try:
+			dev = os.lstat(file).st_dev
+		except OSError:
+			dev = None
 
-	info = {
-		'current': cwd,
-		'files': 0,
-		'bytes': 0,
-	}
+		groups.setdefault(dev, []).append(file)
 
-	last_write = [time.monotonic()]
+	return list(groups.values())
+
+def scan_files(files, cwd, file_list, error_list, skipped_list, info, ev_interrupt, ev_abort, ev_skip, ev_skip_all, archive_path, one_filesystem):
 	for file in files:
 		if ev_interrupt.is_set():
 			break
@@ -98,15 +99,13 @@ def rnr_dirscan(files, cwd, fd, q, ev_interrupt, ev_abort, ev_skip, archive_path
 		if ev_abort.is_set():
 			break
 
+		if ev_skip_all.is_set():
+			return False
+
 		if ev_skip.is_set():
 			ev_skip.clear()
-			del file_list[:]
-			del error_list[:]
-			del skipped_list[:]
-			info['files'] = 0
-			info['bytes'] = 0
-			skipped_list.append({'file': cwd, 'message': ''})
-			break
+			ev_skip_all.set()
+			return False
 
 		shown_file = str(archive_path(file, include_self=False)[0])
 		try:
@@ -118,32 +117,90 @@ def rnr_dirscan(files, cwd, fd, q, ev_interrupt, ev_abort, ev_skip, archive_path
 				file_list.append({'file': shown_file, 'is_dir': False, 'is_symlink': True, 'is_file': False, 'lstat': lstat, 'status': 'TO_DO', 'message': ''})
 			elif file.is_dir():
 				file_list.append({'file': shown_file, 'is_dir': True, 'is_symlink': False, 'is_file': False, 'lstat': lstat, 'status': 'TO_DO', 'message': ''})
-				if not recursive_dirscan(str(file), file_list, error_list, skipped_list, info, last_write, fd, q, ev_interrupt, ev_abort, ev_skip, archive_path):
+				if not recursive_dirscan(str(file), file_list, error_list, skipped_list, info, ev_interrupt, ev_abort, ev_skip, archive_path, (lstat.st_dev if one_filesystem else None)):
 					file_list.pop()
 					info['files'] -= 1
 					info['bytes'] -= lstat.st_size
 			else:
 				file_list.append({'file': shown_file, 'is_dir': False, 'is_symlink': False, 'is_file': file.is_file(), 'lstat': lstat, 'status': 'TO_DO', 'message': ''})
-
-			now = time.monotonic()
-			if (now - last_write[0]) > 0.05:
-				last_write[0] = now
-				q.put(info.copy())
-				try:
-					os.write(fd, b'\n')
-				except OSError:
-					pass
 		except OSError as e:
 			error_list.append({'file': shown_file, 'message': f'{e.strerror} ({e.errno})'})
 
+	return True
+
+def dirscan_progress(cwd):
+	return Progress({
+		'current': cwd,
+		'files': 0,
+		'bytes': 0,
+	})
+
+def rnr_dirscan(files, cwd, fd, q, info, ev_interrupt, ev_abort, ev_skip, archive_path, one_filesystem=False, group_by_dev=False):
+	file_list = []
+	error_list = []
+	skipped_list = []
+
+	ev_skip_all = Event()
+
+	if group_by_dev:
+		groups = group_by_device(files)
+	else:
+		groups = [files]
+
+	if len(groups) > 1:
+		# Every device gets its own scanning thread, so that a slow device
+		# does not hold back the scan of the others
+		results = [([], [], []) for x in groups]
+		counters = [{'current': cwd, 'files': 0, 'bytes': 0} for x in groups]
+		skips = [Event() for x in groups]
+		threads = [Thread(target=scan_files, args=(group, cwd, *result, counter, ev_interrupt, ev_abort, ev_skip_thread, ev_skip_all, archive_path, one_filesystem)) for group, result, counter, ev_skip_thread in zip(groups, results, counters, skips)]
+		for thread in threads:
+			thread.start()
+
+		# Every thread counts on its own, and only this one writes the
+		# progress. The directory shown is the one that a skip applies to
+		while True:
+			info['files'] = sum(x['files'] for x in counters)
+			info['bytes'] = sum(x['bytes'] for x in counters)
+
+			alive = [(thread, counter, ev_skip_thread) for thread, counter, ev_skip_thread in zip(threads, counters, skips) if thread.is_alive()]
+			if not alive:
+				break
+
+			(thread, counter, ev_skip_thread) = alive[0]
+			info['current'] = counter['current']
+			if ev_skip.is_set():
+				ev_skip.clear()
+				ev_skip_thread.set()
+
+			thread.join(SCAN_POLL_INTERVAL)
+
+		for result in results:
+			file_list.extend(result[0])
+			error_list.extend(result[1])
+			skipped_list.extend(result[2])
+	else:
+		for group in groups:
+			scan_files(group, cwd, file_list, error_list, skipped_list, info, ev_interrupt, ev_abort, ev_skip, ev_skip_all, archive_path, one_filesystem)
+
+	if ev_skip_all.is_set():
+		del file_list[:]
+		del error_list[:]
+		del skipped_list[:]
+		info['files'] = 0
+		info['bytes'] = 0
+		skipped_list.append({'file': cwd, 'message': ''})
+
 	old_file_list = file_list[:]
 	if error_list:
 		err = [x['file'] for x in error_list]
 		file_list = [x for x in file_list if x['file'] not in err]
 
-	q.put({'result': file_list, 'error': error_list, 'skipped': skipped_list})
 	try:
+		# The wake up comes first: with the process backend a large result
+		# would fill the queue pipe before the UI starts reading it
 		os.write(fd, b'\n')
+		q.put({'result': file_list, 'error': error_list, 'skipped': skipped_list})
 	except OSError:
 		pass
 	os.close(fd)
@@ -9,10 +9,21 @@ import fnmatch
 import argparse
 import functools
 import signal
+import mmap
+import array
+import bisect
+import threading
+import inspect
+import collections
+import itertools
+import operator
+import queue
+import time
 
 from pathlib import Path
 
 import pygments
+import pygments.lexer
 import pygments.lexers
 import pygments.util
 
@@ -20,21 +31,45 @@ import urwid
 
 from pygments.token import Token
 
+try:
+	from pygments.token import _TokenType
+except ImportError:
+	_TokenType = None
+
 from . import __version__
 
 from .import_config import *
 from .palette import PALETTE
-from .panel import (get_file_list, sort_by_name)
+from .panel import (get_file_list, sort_files)
 from .buttonbar import ButtonBar
 from .dlg_goto import DlgGoto
 from .dlg_error import DlgError
 from .dlg_search import DlgSearch
-from .utils import (TildeLayout, format_date)
+from .dlg_cancelable import DlgCancelable
+from .utils import (TildeLayout, format_date, InterruptError)
 from .debug_print import (debug_print, debug_pprint, set_debug_fh)
 
 
 MAX_TEXT_FILE_SIZE = 2097152
+LINE_INDEX_CHUNK_SIZE = 1048576
+MAX_LINE_SIZE = 65536
+GUESS_LEXER_SIZE = 16384
+HIGHLIGHT_LINES = 100
+HIGHLIGHT_CACHE_SIZE = 100
+MAX_LEX_AHEAD = 10000
+LEX_WINDOW_SIZE = 65536
+MAX_LEX_WINDOW_SIZE = 1048576
+SEARCH_CHUNK_SIZE = 1048576
+SEARCH_PROGRESS_INTERVAL = 0.2
+MAX_SEARCH_MATCHES = 1000000
+MATCH_MAP_CHARS = ' ░▒▓█'
 NON_PRINTABLE_MASK = '·'
+RENDER_CACHE_SIZE = 256
+
+MASK_TABLE = bytes(x if 0x20 <= x < 0x7F else ord(NON_PRINTABLE_MASK) for x in range(256))
+
+# lex_with_state follows the internals of RegexLexer, as they are in pygments 2
+LEX_WITH_STATE = ((pygments.__version__.split('.')[0] == '2') and (_TokenType is not None))
 
 
 StyleFromToken = {
@@ -71,61 +106,644 @@ Labels = [
 ]
 
 
+@functools.lru_cache(maxsize=None)
+def style_from_token(tokentype):
+	for k, v in StyleFromToken.items():
+		if tokentype in k:
+			return v
+
+	return 'Text'
+
+
+def get_lexer(filename, code, tabsize):
+	try:
+		name = filename.name
+		if name == name.upper():
+			filename = filename.parent / filename.name.lower()
+
+		return pygments.lexers.get_lexer_for_filename(filename, stripnl=False, tabsize=tabsize)
+	except pygments.util.ClassNotFound:
+		try:
+			return pygments.lexers.guess_lexer(code[:GUESS_LEXER_SIZE], stripnl=False, tabsize=tabsize)
+		except pygments.util.ClassNotFound:
+			return pygments.lexers.special.TextLexer(stripnl=False, tabsize=tabsize)
+
+
+def lex_with_state(lexer, text, statestack):
+	# The same as RegexLexer.get_tokens_unprocessed of pygments 2, but it
+	# works in place on the stack that it gets, so that the state of the lexer
+	# can be read between the tokens. A token can be lexed again from the same
+	# state only if it is the first one of its match
+	pos = 0
+	tokendefs = lexer._tokens
+	statetokens = tokendefs[statestack[-1]]
+	while True:
+		for rexmatch, action, new_state in statetokens:
+			m = rexmatch(text, pos)
+			if m:
+				if action is not None:
+					if type(action) is _TokenType:
+						yield (pos, action, m.group(), True)
+					else:
+						resumable = True
+						for i, tokentype, value in action(lexer, m):
+							yield (i, tokentype, value, resumable and (i == pos))
+							resumable = False
+
+				pos = m.end()
+				if new_state is not None:
+					if isinstance(new_state, tuple):
+						for state in new_state:
+							if state == '#pop':
+								if len(statestack) > 1:
+									statestack.pop()
+							elif state == '#push':
+								statestack.append(statestack[-1])
+							else:
+								statestack.append(state)
+					elif isinstance(new_state, int):
+						if abs(new_state) >= len(statestack):
+							del statestack[1:]
+						else:
+							del statestack[new_state:]
+					elif new_state == '#push':
+						statestack.append(statestack[-1])
+
+					statetokens = tokendefs[statestack[-1]]
+
+				break
+		else:
+			try:
+				if text[pos] == '\n':
+					statestack[:] = ['root']
+					statetokens = tokendefs['root']
+					yield (pos, Token.Text.Whitespace, '\n', False)
+					pos += 1
+					continue
+
+				yield (pos, Token.Error, text[pos], False)
+				pos += 1
+			except IndexError:
+				break
+
+
+def find_break(tokens, min_lines, stop_line=None):
+	# Returns the tokens up to the first line after min_lines (or stop_line)
+	# that starts with a new match, and the offset in the text where that
+	# line starts. Without such a line, the offset is None
+	result = []
+	num_lines = 0
+	line_start = 0
+	for pos, tokentype, value, resumable in tokens:
+		if resumable and (pos == line_start) and num_lines and ((num_lines >= min_lines) or (num_lines == stop_line)):
+			return (result, pos)
+
+		result.append((pos, tokentype, value))
+
+		i = value.rfind('\n')
+		if i >= 0:
+			num_lines += value.count('\n')
+			line_start = pos + i + 1
+
+	return (result, None)
+
+
+def split_lines(tokens, text_end):
+	# Returns the lines of styled text, up to the offset text_end, that is
+	# the start of a line
+	segment = [[]]
+	for pos, tokentype, value in tokens:
+		if (pos + len(value)) > text_end:
+			value = value[:text_end-pos]
+
+		style = style_from_token(tokentype)
+		parts = value.split('\n')
+		if parts[0]:
+			segment[-1].append((style, parts[0]))
+
+		for part in parts[1:]:
+			segment.append([])
+			if part:
+				segment[-1].append((style, part))
+
+	del segment[-1]
+
+	for line in segment:
+		if not line:
+			line.append(('Text', ''))
+
+	return segment
+
+
 def masked_string(b, attr_normal, attr_highlight):
+	# The mask character is in latin-1, so that a whole chunk can be masked
+	# by translating its bytes
 	chars = []
 	for highlight, data in b:
-		tmp = []
-		for x in data:
-			if (x < 0x20) or (x >= 0x7F):
-				tmp.append(NON_PRINTABLE_MASK)
-			else:
-				tmp.append(chr(x))
-
 		if highlight:
-			chars.append((attr_highlight, ''.join(tmp)))
+			chars.append((attr_highlight, data.translate(MASK_TABLE).decode('latin-1')))
 		else:
-			chars.append((attr_normal, ''.join(tmp)))
+			chars.append((attr_normal, data.translate(MASK_TABLE).decode('latin-1')))
 
 	return chars
 
 
 def hex_string(b, attr_normal, attr_highlight):
+	# The whole line is formatted at once, as groups of 4 bytes, and cut
+	# around the highlighted bytes: byte i starts at column 3*i + (i+3)//4
+	data = b''.join([x[1] for x in b])
+	text = data.hex(' ').upper()
+	text = ' %s ' % ('  '.join([text[i:i+11] for i in range(0, len(text), 12)]))
+
 	chars = []
 	i = 0
 
 	for highlight, data in b:
 		if highlight:
 			for e in data:
+				start = (3 * i) + ((i + 3) // 4)
 				if (i % 4) == 0:
 					chars.append((attr_normal, ' '))
+					start += 1
 
-				chars.append((attr_highlight, '%02X' % e))
+				chars.append((attr_highlight, text[start:start+2]))
 				chars.append((attr_normal, ' '))
 
 				i += 1
 		else:
-			tmp = []
-			for e in data:
-				if (i % 4) == 0:
-					fmt = ' %02X '
+			end = i + len(data)
+			chars.append((attr_normal, text[(3 * i) + ((i + 3) // 4):(3 * end) + ((end + 3) // 4)]))
+			i = end
+
+	return chars
+
+
+class LineIndex(object):
+	# The offsets where the lines of a buffer start. The buffer is indexed a
+	# chunk at a time, either from a thread, or as soon as a line that is
+	# not yet indexed is needed
+	def __init__(self, data, newline=b'\n'):
+		self.data = data
+		self.newline = newline
+		self.size = len(data)
+		self.offsets = array.array('Q', [0])
+		self.pos = 0
+		self.len_lines = 0
+		self.done = False
+		self.lock = threading.Lock()
+		self.ev_cancel = threading.Event()
+
+		if self.size == 0:
+			self.offsets = array.array('Q')
+			self.done = True
+
+	def __len__(self):
+		if self.done:
+			return self.len_lines
+
+		return len(self.offsets) - 1
+
+	def __getitem__(self, line):
+		self.index_to_line(line)
+		return self.offsets[line]
+
+	def index_chunk(self):
+		if self.done:
+			return
+
+		data = self.data
+		offsets = self.offsets
+		end = min(self.pos + LINE_INDEX_CHUNK_SIZE, self.size)
+
+		i = data.find(self.newline, self.pos, end)
+		while i >= 0:
+			offsets.append(i + 1)
+			i = data.find(self.newline, i + 1, end)
+
+		self.pos = end
+		if end >= self.size:
+			if offsets[-1] >= self.size:
+				self.len_lines = len(offsets) - 1
+			else:
+				self.len_lines = len(offsets)
+
+			self.done = True
+
+	def index_to_line(self, line):
+		if self.done or (len(self.offsets) > (line + 1)):
+			return
+
+		with self.lock:
+			while (not self.done) and (len(self.offsets) <= (line + 1)):
+				self.index_chunk()
+
+	def index_to_offset(self, offset):
+		if self.done or (self.pos > offset):
+			return
+
+		with self.lock:
+			while (not self.done) and (self.pos <= offset):
+				self.index_chunk()
+
+	def index_all(self):
+		while not self.done:
+			with self.lock:
+				if self.ev_cancel.is_set():
+					return
+
+				self.index_chunk()
+
+	def start(self):
+		threading.Thread(target=self.index_all, daemon=True).start()
+
+	def cancel(self):
+		self.ev_cancel.set()
+
+	def has_line(self, line):
+		self.index_to_line(line)
+		return line < len(self)
+
+	def get_line(self, line):
+		self.index_to_line(line)
+
+		start = self.offsets[line]
+		try:
+			end = self.offsets[line + 1]
+		except IndexError:
+			end = self.size
+
+		return self.data[start:end]
+
+	def line_from_offset(self, offset):
+		self.index_to_offset(offset)
+		return max(bisect.bisect_right(self.offsets, offset) - 1, 0)
+
+
+class Highlighter(object):
+	# Lexes a file a segment of lines at a time, keeping the last segments
+	# around. The state of the lexer at the start of every segment is kept
+	# as a checkpoint, so that any line can be highlighted by lexing from
+	# the checkpoint before it. Jumping far ahead, the lexer starts from
+	# scratch, and the checkpoints that follow are approximate, until the
+	# lexing from an exact checkpoint gets to them
+	def __init__(self, lexer, get_text, has_line):
+		self.lexer = lexer
+		self.get_text = get_text
+		self.has_line = has_line
+		self.segments = collections.OrderedDict()
+
+		# The state can be followed only for the lexers that work like a
+		# RegexLexer, and that can start from a given state. The tokens are
+		# always the ones of the lexer itself, and for a plain RegexLexer
+		# they must be the same as the ones of lex_with_state
+		self.use_state = False
+		self.check_state = False
+		if LEX_WITH_STATE and isinstance(lexer, pygments.lexer.RegexLexer) and not isinstance(lexer, pygments.lexer.ExtendedRegexLexer):
+			get_tokens_unprocessed = type(lexer).get_tokens_unprocessed
+			if get_tokens_unprocessed is pygments.lexer.RegexLexer.get_tokens_unprocessed:
+				self.use_state = True
+				self.check_state = True
+			elif 'stack' in inspect.signature(get_tokens_unprocessed).parameters:
+				self.use_state = True
+
+		self.reset()
+
+	def reset(self):
+		self.checkpoints = [0]
+		self.states = {0: self.initial_state()}
+		self.approximate = set()
+		self.segments.clear()
+
+	def initial_state(self):
+		if self.use_state:
+			return ['root']
+		else:
+			return None
+
+	def get_tokens(self, line):
+		i = bisect.bisect_right(self.checkpoints, line) - 1
+		start = self.checkpoints[i]
+
+		if (line - start) > MAX_LEX_AHEAD:
+			start = line - (line % HIGHLIGHT_LINES)
+			self.add_checkpoint(start, self.initial_state(), approximate=True)
+
+		while True:
+			try:
+				segment = self.segments[start]
+				self.segments.move_to_end(start)
+			except KeyError:
+				segment = self.lex_segment(start)
+				if segment is None:
+					return self.get_tokens(line)
+
+			if not segment:
+				return [('Text', '')]
+
+			if (line - start) < len(segment):
+				return segment[line - start]
+
+			start += len(segment)
+
+	def add_checkpoint(self, line, state, approximate=False):
+		if line in self.states:
+			if approximate or (line not in self.approximate):
+				return
+
+			self.approximate.discard(line)
+			if state == self.states[line]:
+				return
+
+			self.segments.pop(line, None)
+		else:
+			bisect.insort(self.checkpoints, line)
+			if approximate:
+				self.approximate.add(line)
+
+		self.states[line] = state
+
+		if not approximate:
+			# The approximate checkpoints that follow are lexed again from here
+			i = bisect.bisect_right(self.checkpoints, line)
+			while (i < len(self.checkpoints)) and (self.checkpoints[i] in self.approximate):
+				self.drop_checkpoint(self.checkpoints[i])
+
+	def drop_checkpoint(self, line):
+		self.checkpoints.remove(line)
+		self.approximate.discard(line)
+		del self.states[line]
+		self.segments.pop(line, None)
+
+	def lex_segment(self, start):
+		# A segment goes on until a line that starts with a new match, so that
+		# lexing can start again from there. The lexer gets the text after the
+		# segment too, so that the tokens are not cut at its end, and it gets
+		# more of it while no such line is found
+		state = self.states[start]
+		approximate = (start in self.approximate)
+
+		i = bisect.bisect_right(self.checkpoints, start)
+		if i < len(self.checkpoints):
+			stop_line = self.checkpoints[i] - start
+		else:
+			stop_line = None
+
+		size = LEX_WINDOW_SIZE
+		while True:
+			(text, at_eof) = self.get_text(start, size)
+			if not text:
+				return []
+
+			if self.use_state:
+				statestack = list(state)
+				tokens = lex_with_state(self.lexer, text, statestack)
+			else:
+				tokens = ((i, tokentype, value, True) for i, tokentype, value in self.lexer.get_tokens_unprocessed(text))
+
+			(tokens, text_end) = find_break(tokens, HIGHLIGHT_LINES, stop_line)
+			if text_end is not None:
+				if self.use_state:
+					next_state = list(statestack)
 				else:
-					fmt = '%02X '
+					next_state = None
 
-				tmp.append(fmt % e)
+				break
 
-				i += 1
+			if at_eof:
+				text_end = len(text)
+				next_state = None
+				break
+
+			if self.use_state and (size < MAX_LEX_WINDOW_SIZE):
+				size *= 2
+				continue
+
+			# A token longer than the whole window gets cut, and the lexer
+			# starts from scratch after it
+			text_end = 0
+			for _ in range(HIGHLIGHT_LINES):
+				j = text.find('\n', text_end)
+				if j < 0:
+					break
 
-			chars.append((attr_normal, ''.join(tmp)))
+				text_end = j + 1
 
-	return chars
+			next_state = self.initial_state()
+			approximate = True
+			break
+
+		tokens = [x for x in tokens if x[0] < text_end]
+		if self.use_state:
+			lexer_tokens = []
+			for (pos, tokentype, value) in self.lexer.get_tokens_unprocessed(text, stack=state):
+				if pos >= text_end:
+					break
+
+				lexer_tokens.append((pos, tokentype, value))
+
+			if self.check_state and (lexer_tokens != tokens):
+				# The lexer does not work like lex_with_state expects
+				self.use_state = False
+				self.check_state = False
+				self.reset()
+				return None
+
+			tokens = lexer_tokens
+
+		segment = split_lines(tokens, text_end)
+		end = start + len(segment)
+
+		for line in self.checkpoints[i:]:
+			if line >= end:
+				break
+
+			if line in self.approximate:
+				self.drop_checkpoint(line)
+
+		if self.has_line(end):
+			self.add_checkpoint(end, next_state, approximate)
+
+		self.segments[start] = segment
+		if len(self.segments) > HIGHLIGHT_CACHE_SIZE:
+			self.segments.popitem(last=False)
+
+		return segment
+
+
+class MatchIndex(object):
+	def __init__(self, walker):
+		self.walker = walker
+		self.search_expression = walker.search_expression
+		self.positions = array.array('Q')
+		self.done = False
+		self.truncated = False
+		self.ev_cancel = threading.Event()
+
+	def __len__(self):
+		return len(self.positions)
+
+	def is_complete(self):
+		return self.done and not self.truncated
+
+	def find(self, pos, backwards):
+		# The matches are indexed from the start of the file, so the answer
+		# is known only if there is a match after pos, or if the index is
+		# complete
+		len_positions = len(self.positions)
+		if backwards:
+			if pos is None:
+				i = len_positions
+			else:
+				i = bisect.bisect_right(self.positions, pos, 0, len_positions)
+
+			if (i >= len_positions) and not self.is_complete():
+				return (False, None)
+
+			if i > 0:
+				return (True, self.positions[i - 1])
+		else:
+			i = bisect.bisect_left(self.positions, pos, 0, len_positions)
+			if i < len_positions:
+				return (True, self.positions[i])
+
+		if not self.is_complete():
+			return (False, None)
+
+		if not len_positions:
+			return (True, None)
+
+		if backwards:
+			return (True, self.positions[len_positions - 1])
+		else:
+			return (True, self.positions[0])
+
+	def count(self, pos):
+		len_positions = len(self.positions)
+		i = bisect.bisect_right(self.positions, pos, 0, len_positions)
+		if (i >= len_positions) and not self.is_complete():
+			if (not len_positions) or (self.positions[len_positions - 1] != pos):
+				return None
+
+		return i
+
+	def count_range(self, start, end):
+		len_positions = len(self.positions)
+		return bisect.bisect_left(self.positions, end, 0, len_positions) - bisect.bisect_left(self.positions, start, 0, len_positions)
+
+
+def rnr_match_index(walker, match_index, fd):
+	last_update = time.monotonic()
+
+	finished = False
+	try:
+		for pos in walker.search_all(match_index.search_expression, match_index.ev_cancel):
+			if len(match_index.positions) >= MAX_SEARCH_MATCHES:
+				match_index.truncated = True
+				break
+
+			match_index.positions.append(pos)
+			if (time.monotonic() - last_update) >= SEARCH_PROGRESS_INTERVAL:
+				os.write(fd, b'\n')
+				last_update = time.monotonic()
+
+		finished = True
+	except (OSError, ValueError):
+		# ValueError comes from a mapping closed along with its view
+		pass
+	finally:
+		if not finished:
+			match_index.truncated = True
+
+		if not match_index.ev_cancel.is_set():
+			match_index.done = True
+
+		try:
+			os.write(fd, b'\n')
+		except OSError:
+			pass
+		os.close(fd)
+
+def rnr_search(walker, expression, pos, backwards, fd, q, ev_cancel):
+	last_update = time.monotonic()
+
+	def progress(fraction):
+		nonlocal last_update
+
+		if (time.monotonic() - last_update) >= SEARCH_PROGRESS_INTERVAL:
+			q.put({'progress': fraction})
+			os.write(fd, b'\n')
+			last_update = time.monotonic()
+
+	result = None
+	try:
+		result = walker.search_from_pos(expression, pos, backwards, ev_cancel, progress)
+	except (OSError, ValueError):
+		# ValueError comes from a mapping closed along with its view
+		pass
+	finally:
+		try:
+			q.put({'result': result})
+			os.write(fd, b'\n')
+		except OSError:
+			pass
+		os.close(fd)
 
 
 class TopBar(urwid.WidgetWrap):
 	def __init__(self, filename):
-		w = urwid.Text(os.path.abspath(filename), layout=TildeLayout)
+		self.matches = urwid.Text('', layout=TildeLayout)
+		w = urwid.Columns([urwid.Text(os.path.abspath(filename), layout=TildeLayout), ('pack', self.matches)], dividechars=1)
 		w = urwid.AttrMap(w, 'selected')
 		super().__init__(w)
 
+	def on_matches(self, list_box, text):
+		self.matches.set_text(text)
+
+
+class MatchMap(urwid.Widget):
+	_sizing = frozenset(['box'])
+	no_cache = ['render']
+
+	def __init__(self, list_box):
+		self.list_box = list_box
+		super().__init__()
+
+	def render(self, size, focus=False):
+		# Every row shows how many matches fall in its share of the file
+		(maxcol, maxrow) = size
+
+		match_index = self.list_box.get_match_index()
+		if (match_index is None) or (maxrow < 1):
+			return urwid.SolidCanvas(' ', maxcol, maxrow)
+
+		extent = max(self.list_box.get_search_extent(), 1)
+		counts = [match_index.count_range((i * extent) // maxrow, ((i + 1) * extent) // maxrow) for i in range(maxrow)]
+		max_count = max(max(counts), 1)
+
+		try:
+			focus_row = (self.list_box.focus_position * maxrow) // extent
+		except IndexError:
+			focus_row = None
+
+		markup = []
+		for i, count in enumerate(counts):
+			if count:
+				char = MATCH_MAP_CHARS[1 + (((count * (len(MATCH_MAP_CHARS) - 1)) - 1) // max_count)]
+			else:
+				char = MATCH_MAP_CHARS[0]
+
+			if i < (maxrow - 1):
+				char = f'{char * maxcol}\n'
+			else:
+				char = char * maxcol
+
+			if i == focus_row:
+				markup.append(('markselect', char))
+			else:
+				markup.append(('Lineno', char))
+
+		return urwid.Text(markup, wrap='clip').render((maxcol,))
+
 
 class BinaryFileWalker(urwid.ListWalker):
 	def __init__(self, fh, file_size, data=None):
@@ -137,6 +755,7 @@ class BinaryFileWalker(urwid.ListWalker):
 		self.search_backwards = False
 		self.highligh_buffer = None
 		self.highligh_buffer_pos = None
+		self.rows = collections.OrderedDict()
 
 		len_address = len(hex(file_size - 1).split('x')[1])
 		len_address += len_address % 2
@@ -165,146 +784,144 @@ class BinaryFileWalker(urwid.ListWalker):
 
 		return pos
 
-	def start_search(self, expression, backwards):
+	def set_search(self, expression, backwards):
 		self.search_expression = expression
 		self.search_backwards = backwards
-		position = self.focus
-		position = position - (position % self.line_width)
-		pos = self.search_from_pos(position, backwards)
-
-		if pos is None:
-			self.search_expression = None
-
+		self.rows.clear()
 		self._modified()
 
-		return pos
-
 	def stop_search(self):
 		self.search_expression = None
+		self.rows.clear()
 		self._modified()
 
-	def search_next(self):
-		if self.search_backwards:
-			position = self.focus
-			position = position - (position % self.line_width)
-			pos = position - 1
-			if pos < 0:
-				pos = self.file_size - 1
-		else:
-			position = self.focus
-			position = position - (position % self.line_width)
-			pos = position + self.line_width
-			if pos >= self.file_size:
-				pos = 0
-
-		pos = self.search_from_pos(pos, self.search_backwards)
+	def next_search_pos(self, direction):
+		backwards = (self.search_backwards != (direction < 0))
+		pos = self.focus - (self.focus % self.line_width)
 
-		self._modified()
+		if direction:
+			if backwards:
+				pos -= 1
+				if pos < 0:
+					pos = self.file_size - 1
+			else:
+				pos += self.line_width
+				if pos >= self.file_size:
+					pos = 0
 
-		return pos
+		return (pos, backwards)
 
-	def search_prev(self):
-		if self.search_backwards:
-			position = self.focus
-			position = position - (position % self.line_width)
-			pos = position + self.line_width
-			if pos >= self.file_size:
-				pos = 0
+	def read(self, pos, size):
+		if self.data:
+			return self.data[pos:pos+size]
 		else:
-			position = self.focus
-			position = position - (position % self.line_width)
-			pos = position - 1
-			if pos < 0:
-				pos = self.file_size - 1
-
-		pos = self.search_from_pos(pos, not self.search_backwards)
-
-		self._modified()
-
-		return pos
+			return os.pread(self.fh.fileno(), size, pos)
 
-	def search_from_pos(self, pos, backwards):
+	def search_from_pos(self, expression, pos, backwards, ev_cancel=None, progress=None):
 		starting_pos = pos
-		new_pos = None
 
 		block_size = 131072
+		done = 0
 
-		if new_pos is None:
+		if backwards:
+			ranges = [(pos, 0), (self.file_size - 1, starting_pos)]
+		else:
+			ranges = [(pos, self.file_size), (0, starting_pos)]
+
+		for (pos, end_pos) in ranges:
 			if backwards:
-				if self.data:
-					data = self.data[pos:pos+len(self.search_expression)]
-				else:
-					self.fh.seek(pos)
-					data = self.fh.read(len(self.search_expression))
+				data = self.read(pos, len(expression))
+				while pos >= end_pos:
+					if (ev_cancel is not None) and ev_cancel.is_set():
+						return None
 
-				while pos >= 0:
-					old_data = data[:len(self.search_expression)]
-					if self.data:
-						data = self.data[max(0, pos - block_size):pos] + old_data
-					else:
-						self.fh.seek(max(0, pos - block_size))
-						data = self.fh.read(min(pos, block_size)) + old_data
+					old_data = data[:len(expression)]
+					data = self.read(max(0, pos - block_size), min(pos, block_size)) + old_data
 
-					i = data.rfind(self.search_expression)
+					i = data.rfind(expression)
 					if i >= 0:
-						new_pos = ((pos + len(old_data)) - len(data)) + i
-						break
+						return ((pos + len(old_data)) - len(data)) + i
 
 					pos -= block_size
+					done += block_size
+					if progress is not None:
+						progress(done / self.file_size)
 			else:
-				data = b''
-				while pos < self.file_size:
-					old_data = data[-len(self.search_expression):]
-					if self.data:
-						data = old_data + self.data[pos:pos+block_size]
-					else:
-						self.fh.seek(pos)
-						data = old_data + self.fh.read(block_size)
+				def step(size):
+					nonlocal done
 
-					i = data.find(self.search_expression)
-					if i >= 0:
-						new_pos = (pos - len(old_data)) + i
-						break
+					done += size
+					if progress is not None:
+						progress(done / self.file_size)
 
-					pos += block_size
+				for i in self.iter_search(expression, pos, end_pos, ev_cancel, step):
+					return i
 
-		if new_pos is None:
-			data = b''
-			if backwards:
-				pos = self.file_size - 1
-				while pos >= starting_pos:
-					old_data = data[:len(self.search_expression)]
-					if self.data:
-						data = self.data[max(0, pos - block_size):pos] + old_data
-					else:
-						self.fh.seek(max(0, pos - block_size))
-						data = self.fh.read(min(pos, block_size)) + old_data
+		return None
 
-					i = data.rfind(self.search_expression)
-					if i >= 0:
-						new_pos = ((pos + len(old_data)) - len(data)) + i
-						break
+	def iter_search(self, expression, pos, end_pos, ev_cancel=None, progress=None):
+		# Yields the offsets of the matches starting between pos and end_pos,
+		# in order
+		block_size = 131072
+		len_overlap = len(expression) - 1
 
-					pos -= block_size
+		data = b''
+		while pos < end_pos:
+			if (ev_cancel is not None) and ev_cancel.is_set():
+				return
 
-			else:
-				pos = 0
-				while pos < starting_pos:
-					old_data = data[-len(self.search_expression):]
-					if self.data:
-						data = old_data + self.data[pos:pos+block_size]
-					else:
-						self.fh.seek(pos)
-						data = old_data + self.fh.read(block_size)
+			old_data = data[len(data)-len_overlap:]
+			data = old_data + self.read(pos, block_size)
+			data_pos = pos - len(old_data)
 
-					i = data.find(self.search_expression)
-					if i >= 0:
-						new_pos = (pos - len(old_data)) + i
-						break
+			i = data.find(expression)
+			while (i >= 0) and ((data_pos + i) < end_pos):
+				yield data_pos + i
+				i = data.find(expression, i + 1)
+
+			pos += block_size
+			if progress is not None:
+				progress(block_size)
+
+	def search_all(self, expression, ev_cancel=None):
+		return self.iter_search(expression, 0, self.file_size, ev_cancel)
+
+	def get_row(self, pos, attr):
+		# The rows are kept while scrolling, until the search or the width
+		# of the rows change
+		key = (pos, attr)
+		try:
+			w = self.rows[key]
+			self.rows.move_to_end(key)
+		except KeyError:
+			w = self.render_row(pos, attr)
+			self.rows[key] = w
+			if len(self.rows) > RENDER_CACHE_SIZE:
+				self.rows.popitem(last=False)
 
-					pos += block_size
+		return w
+
+	def get_focus(self):
+		position = self.focus
+		pos = position - (position % self.line_width)
+		if (pos < 0) or (pos >= self.file_size):
+			return (None, None)
 
-		return new_pos
+		return (self.get_row(pos, 'markselect'), pos)
+
+	def get_next(self, position):
+		pos = (position - (position % self.line_width)) + self.line_width
+		if pos >= self.file_size:
+			return (None, None)
+
+		return (self.get_row(pos, 'selected'), pos)
+
+	def get_prev(self, position):
+		pos = (position - (position % self.line_width)) - self.line_width
+		if pos < 0:
+			return (None, None)
+
+		return (self.get_row(pos, 'selected'), pos)
 
 	def highlight_line(self, pos):
 		if self.search_expression:
@@ -363,36 +980,9 @@ class DumpFileWalker(BinaryFileWalker):
 		self.line_width = 64
 		super().__init__(fh, file_size, data)
 
-	def get_focus(self):
-		position = self.focus
-		pos = position - (position % self.line_width)
-		if (pos < 0) or (pos >= self.file_size):
-			return (None, None)
-
-		line = self.highlight_line(pos)
-		w = urwid.Columns([(self.len_address, urwid.Text(('Lineno', self.fmt_address % (pos)), align='right')), urwid.Text(masked_string(line, 'Text', 'markselect'), wrap='clip')], dividechars=1)
-
-		return (w, pos)
-
-	def get_next(self, position):
-		pos = (position - (position % self.line_width)) + self.line_width
-		if pos >= self.file_size:
-			return (None, None)
-
+	def render_row(self, pos, attr):
 		line = self.highlight_line(pos)
-		w = urwid.Columns([(self.len_address, urwid.Text(('Lineno', self.fmt_address % (pos)), align='right')), urwid.Text(masked_string(line, 'Text', 'selected'), wrap='clip')], dividechars=1)
-
-		return (w, pos)
-
-	def get_prev(self, position):
-		pos = (position - (position % self.line_width)) - self.line_width
-		if pos < 0:
-			return (None, None)
-
-		line = self.highlight_line(pos)
-		w = urwid.Columns([(self.len_address, urwid.Text(('Lineno', self.fmt_address % (pos)), align='right')), urwid.Text(masked_string(line, 'Text', 'selected'), wrap='clip')], dividechars=1)
-
-		return (w, pos)
+		return urwid.Columns([(self.len_address, urwid.Text(('Lineno', self.fmt_address % (pos)), align='right')), urwid.Text(masked_string(line, 'Text', attr), wrap='clip')], dividechars=1)
 
 	def change_size(self, size):
 		width = size[0]
@@ -403,6 +993,7 @@ class DumpFileWalker(BinaryFileWalker):
 		self.line_width = line_width - (line_width % 16)
 
 		if self.line_width != old_width:
+			self.rows.clear()
 			self._modified()
 
 
@@ -412,39 +1003,10 @@ class HexFileWalker(BinaryFileWalker):
 		self.hex_width = int(self.line_width / 4) * 13
 		super().__init__(fh, file_size, data)
 
-	def get_focus(self):
-		position = self.focus
-		pos = position - (position % self.line_width)
-		if (pos < 0) or (pos >= self.file_size):
-			return (None, None)
-
+	def render_row(self, pos, attr):
 		line = self.highlight_line(pos)
-		h = hex_string(line, 'Text', 'markselect')
-		w = urwid.Columns([(self.len_address, urwid.Text(('Lineno', self.fmt_address % (pos)), align='right')), (self.hex_width, urwid.Text(h)), urwid.Text([('Operator', '|'), *masked_string(line, 'String', 'markselect'), ('Operator', '|')], wrap='clip')], dividechars=1)
-
-		return (w, pos)
-
-	def get_next(self, position):
-		pos = (position - (position % self.line_width)) + self.line_width
-		if pos >= self.file_size:
-			return (None, None)
-
-		line = self.highlight_line(pos)
-		h = hex_string(line, 'Text', 'selected')
-		w = urwid.Columns([(self.len_address, urwid.Text(('Lineno', self.fmt_address % (pos)), align='right')), (self.hex_width, urwid.Text(h)), urwid.Text([('Operator', '|'), *masked_string(line, 'String', 'selected'), ('Operator', '|')], wrap='clip')], dividechars=1)
-
-		return (w, pos)
-
-	def get_prev(self, position):
-		pos = (position - (position % self.line_width)) - self.line_width
-		if pos < 0:
-			return (None, None)
-
-		line = self.highlight_line(pos)
-		h = hex_string(line, 'Text', 'selected')
-		w = urwid.Columns([(self.len_address, urwid.Text(('Lineno', self.fmt_address % (pos)), align='right')), (self.hex_width, urwid.Text(h)), urwid.Text([('Operator', '|'), *masked_string(line, 'String', 'selected'), ('Operator', '|')], wrap='clip')], dividechars=1)
-
-		return (w, pos)
+		h = hex_string(line, 'Text', attr)
+		return urwid.Columns([(self.len_address, urwid.Text(('Lineno', self.fmt_address % (pos)), align='right')), (self.hex_width, urwid.Text(h)), urwid.Text([('Operator', '|'), *masked_string(line, 'String', attr), ('Operator', '|')], wrap='clip')], dividechars=1)
 
 	def change_size(self, size):
 		width = size[0]
@@ -456,6 +1018,7 @@ class HexFileWalker(BinaryFileWalker):
 		self.hex_width = int(self.line_width / 4) * 13
 
 		if self.line_width != old_width:
+			self.rows.clear()
 			self._modified()
 
 
@@ -484,88 +1047,161 @@ class BaseTextFileWalker(urwid.ListWalker):
 
 		return pos
 
-	def start_search(self, expression, backwards):
+	def set_search(self, expression, backwards):
 		self.search_expression = expression
 		self.search_backwards = backwards
-		pos = self.search_from_pos(self.focus, backwards)
-
-		if pos is None:
-			self.search_expression = None
-
 		self._modified()
 
-		return pos
-
 	def stop_search(self):
 		self.search_expression = None
 		self._modified()
 
-	def search_next(self):
-		if self.search_backwards:
-			pos = self.focus - 1
-			if pos < 0:
-				pos = self.len_lines - 1
-		else:
-			pos = self.focus + 1
-			if pos >= self.len_lines:
-				pos = 0
+	def has_line(self, pos):
+		return pos < self.len_lines
 
-		pos = self.search_from_pos(pos, self.search_backwards)
+	def next_search_pos(self, direction):
+		# Going backwards from the first line, the search starts from the end
+		# of the file, that is None
+		backwards = (self.search_backwards != (direction < 0))
+		pos = self.focus
 
-		self._modified()
+		if direction:
+			if backwards:
+				pos -= 1
+				if pos < 0:
+					pos = None
+			else:
+				pos += 1
+				if not self.has_line(pos):
+					pos = 0
 
-		return pos
+		return (pos, backwards)
 
-	def search_prev(self):
-		if self.search_backwards:
-			pos = self.focus + 1
-			if pos >= self.len_lines:
-				pos = 0
-		else:
-			pos = self.focus - 1
-			if pos < 0:
-				pos = self.len_lines - 1
+	def get_search_index(self):
+		if self.search_index is None:
+			self.search_index = LineIndex(''.join([f'{ReNewLine.sub("", x)}\n' for x in self.code]), '\n')
 
-		pos = self.search_from_pos(pos, not self.search_backwards)
+		return self.search_index
 
-		self._modified()
+	def decode_chunk(self, data):
+		return data
 
-		return pos
+	def search_from_pos(self, expression, pos, backwards, ev_cancel=None, progress=None):
+		# The text is searched with a single regex, a chunk of whole lines at
+		# a time, and the offsets of the matches are turned into lines
+		index = self.get_search_index()
+		data = index.data
+		newline = index.newline
+		chunk_expression = re.compile(expression.pattern, expression.flags | re.MULTILINE)
 
-	def search_from_pos(self, pos, backwards):
-		new_pos = None
+		done = 0
+		def step(size):
+			nonlocal done
 
-		if new_pos is None:
-			if backwards:
-				slice = self.code[pos::-1]
+			done += size
+			if progress is not None:
+				progress(done / index.size)
+
+		if backwards:
+			if (pos is None) or (not index.has_line(pos + 1)):
+				split = index.size
 			else:
-				slice = self.code[pos:]
+				split = index[pos + 1]
+
+			for (start, end) in [(0, split), (split, index.size)]:
+				while start < end:
+					if (ev_cancel is not None) and ev_cancel.is_set():
+						return None
+
+					chunk_start = max(start, end - SEARCH_CHUNK_SIZE)
+					if chunk_start > start:
+						chunk_start = max(start, data.rfind(newline, start, chunk_start) + 1)
+
+					text = self.decode_chunk(data[chunk_start:end])
+					matches = []
+					line = index.line_from_offset(chunk_start)
+					line_pos = 0
+					for m in chunk_expression.finditer(text):
+						line += text.count('\n', line_pos, m.start())
+						line_pos = m.start()
+						matches.append((m, line))
+
+					for (m, line) in reversed(matches):
+						# A match going on to the next lines may hide the
+						# matches starting inside of it
+						for i in range(line + m.group().count('\n', 0, len(m.group()) - 1), line, -1):
+							if self.line_matches(expression, i):
+								return i
+
+						if self.check_match(expression, m, line):
+							return line
+
+					step(end - chunk_start)
+					end = chunk_start
+		else:
+			split = index[pos]
+			for (start, end) in [(split, index.size), (0, split)]:
+				for line in self.iter_search(expression, start, end, ev_cancel, step):
+					return line
+
+		return None
+
+	def iter_search(self, expression, start, end, ev_cancel=None, progress=None):
+		# Yields the lines matching between the offsets start and end, in
+		# order, each one only once
+		index = self.get_search_index()
+		data = index.data
+		newline = index.newline
+		chunk_expression = re.compile(expression.pattern, expression.flags | re.MULTILINE)
+
+		first_line = index.line_from_offset(start)
+		while start < end:
+			if (ev_cancel is not None) and ev_cancel.is_set():
+				return
+
+			chunk_end = min(end, start + SEARCH_CHUNK_SIZE)
+			if chunk_end < end:
+				i = data.find(newline, chunk_end, end)
+				if i < 0:
+					chunk_end = end
+				else:
+					chunk_end = i + 1
+
+			text = self.decode_chunk(data[start:chunk_end])
+			line = first_line
+			line_pos = 0
+			m = chunk_expression.search(text)
+			while m:
+				line += text.count('\n', line_pos, m.start())
+				line_pos = m.start()
+				if self.check_match(expression, m, line):
+					yield line
+
+					i = text.find('\n', m.start())
+					if i < 0:
+						break
 
-			for i, line in enumerate(slice):
-				if self.search_expression.search(line):
-					if backwards:
-						new_pos = pos - i
-					else:
-						new_pos = pos + i
+					m = chunk_expression.search(text, i + 1)
+				else:
+					m = chunk_expression.search(text, m.start() + 1)
 
-					break
+			first_line += text.count('\n')
+			if progress is not None:
+				progress(chunk_end - start)
 
-		if new_pos is None:
-			if backwards:
-				slice = self.code[:pos:-1]
-			else:
-				slice = self.code[:pos]
+			start = chunk_end
 
-			for i, line in enumerate(slice):
-				if self.search_expression.search(line):
-					if backwards:
-						new_pos = (self.len_lines - 1) - i
-					else:
-						new_pos = i
+	def search_all(self, expression, ev_cancel=None):
+		return self.iter_search(expression, 0, self.get_search_index().size, ev_cancel)
 
-					break
+	def check_match(self, expression, m, line):
+		# A match containing a newline counts only if its line matches by
+		# itself
+		return ('\n' not in m.group()) or self.line_matches(expression, line)
 
-		return new_pos
+	def line_matches(self, expression, line):
+		line_text = ReNewLine.sub('', self.decode_chunk(self.get_search_index().get_line(line)))
+		return expression.search(line_text) is not None
 
 	def highlight_line(self, line, attr):
 		if not self.search_expression:
@@ -632,97 +1268,56 @@ class TextFileWalker(BaseTextFileWalker):
 		self.search_backwards = False
 		self.wrap = 'clip'
 
-		try:
-			name = self.filename.name
-			if name == name.upper():
-				filename = self.filename.parent / self.filename.name.lower()
-			else:
-				filename = self.filename
+		self.len_lines = len(self.code)
+		self.digits = len(str(self.len_lines))
+		self.search_index = None
+		self.text = None
+		self.text_offsets = None
 
-			self.lexer = pygments.lexers.get_lexer_for_filename(filename, stripnl=False, tabsize=self.tabsize)
-		except pygments.util.ClassNotFound:
-			try:
-				self.lexer = pygments.lexers.guess_lexer(code, stripnl=False, tabsize=self.tabsize)
-			except pygments.util.ClassNotFound:
-				self.lexer = pygments.lexers.special.TextLexer(stripnl=False, tabsize=self.tabsize)
+		self.highlighter = Highlighter(get_lexer(self.filename, code, self.tabsize), self.get_text, self.has_line)
 
-		if self.use_line_highlight:
-			self.lines = self.code
-		else:
-			self.lines = []
-			line = []
-			result = pygments.lex(code, self.lexer)
-			for tokentype, value in result:
-				for k, v in StyleFromToken.items():
-					if tokentype in k:
-						style = v
-						break
-				else:
-					style = 'Text'
+	def get_line(self, pos):
+		return ReNewLine.sub('', self.code[pos]).expandtabs(self.tabsize)
 
-				for l in value.splitlines(keepends=True):
-					if ReNewLine.search(l):
-						line.append((style, ReNewLine.sub('', l)))
-						self.lines.append(line)
-						line = []
-					else:
-						line.append((style, l))
+	def get_text(self, pos, size):
+		# The file fits in memory, so the lexer gets all the text from pos on
+		if self.text is None:
+			lines = [self.get_line(i) for i in range(self.len_lines)]
+			self.text = ''.join([f'{x}\n' for x in lines])
+			self.text_offsets = array.array('Q', itertools.accumulate([len(x) + 1 for x in lines], initial=0))
 
-		self.len_lines = len(self.lines)
-		self.digits = len(str(self.len_lines))
+		return (self.text[self.text_offsets[pos]:], True)
 
 	def get_focus(self):
 		pos = self.focus
-		if (pos < 0) or (pos >= self.len_lines):
+		if (pos < 0) or (not self.has_line(pos)):
 			return (None, None)
 
-
-		line = self.highlight_line(self.lines[pos], 'markselect')
+		line = self.highlight_line(self.highlighter.get_tokens(pos), 'markselect')
 		w = urwid.Columns([(self.digits, urwid.Text(('Lineno', f'{pos+1}'), align='right')), urwid.Text(line, wrap=self.wrap)], dividechars=1)
 
 		return (w, pos)
 
 	def get_next(self, position):
 		pos = position + 1
-		if pos >= self.len_lines:
+		if not self.has_line(pos):
 			return (None, None)
 
-		line = self.highlight_line(self.lines[pos], 'selected')
+		line = self.highlight_line(self.highlighter.get_tokens(pos), 'selected')
 		w = urwid.Columns([(self.digits, urwid.Text(('Lineno', f'{pos+1}'), align='right')), urwid.Text(line, wrap=self.wrap)], dividechars=1)
 
 		return (w, pos)
 
 	def get_prev(self, position):
 		pos = position - 1
-		if pos < 0:
+		if (pos < 0) or (not self.has_line(pos)):
 			return (None, None)
 
-		line = self.highlight_line(self.lines[pos], 'selected')
+		line = self.highlight_line(self.highlighter.get_tokens(pos), 'selected')
 		w = urwid.Columns([(self.digits, urwid.Text(('Lineno', f'{pos+1}'), align='right')), urwid.Text(line, wrap=self.wrap)], dividechars=1)
 
 		return (w, pos)
 
-	def highlight_line(self, code, attr):
-		if self.use_line_highlight:
-			line = []
-			result = pygments.lex(code, self.lexer)
-			for tokentype, value in result:
-				for k, v in StyleFromToken.items():
-					if tokentype in k:
-						style = v
-						break
-				else:
-					style = 'Text'
-
-				if ReNewLine.search(value):
-					line.append((style, ReNewLine.sub('', value)))
-				else:
-					line.append((style, value))
-		else:
-			line = code
-
-		return super().highlight_line(line, attr)
-
 	def toggle_wrap(self):
 		if self.wrap == 'space':
 			self.wrap = 'clip'
@@ -732,9 +1327,80 @@ class TextFileWalker(BaseTextFileWalker):
 		self._modified()
 
 
+class MappedTextFileWalker(TextFileWalker):
+	def __init__(self, line_index, encoding, filename, tabsize):
+		self.line_index = line_index
+		self.file_size = line_index.size
+		self.encoding = encoding
+		self.filename = filename
+		self.tabsize = tabsize
+		self.focus = 0
+		self.search_expression = None
+		self.search_backwards = False
+		self.wrap = 'clip'
+
+		code = line_index.data[:GUESS_LEXER_SIZE].decode(self.encoding, errors='replace')
+		self.highlighter = Highlighter(get_lexer(self.filename, code, self.tabsize), self.get_text, self.has_line)
+
+	@property
+	def len_lines(self):
+		return len(self.line_index)
+
+	@property
+	def digits(self):
+		return len(str(len(self.line_index)))
+
+	def get_focus_offset(self, offset):
+		self.line_index.index_to_line(self.focus + offset)
+		return super().get_focus_offset(offset)
+
+	def has_line(self, pos):
+		return self.line_index.has_line(pos)
+
+	def get_line(self, pos, max_size=None):
+		data = self.line_index.get_line(pos)
+		if max_size is not None:
+			data = data[:max_size]
+
+		line = data.decode(self.encoding, errors='replace')
+		return ReNewLine.sub('', line).expandtabs(self.tabsize)
+
+	def get_text(self, pos, size):
+		# The lines are decoded all at once, unless one of them is too long
+		# to be shown whole
+		index = self.line_index
+		if not index.has_line(pos):
+			return ('', True)
+
+		start = index[pos]
+		end_pos = index.line_from_offset(min(start + size, index.size - 1)) + 1
+		at_eof = not index.has_line(end_pos)
+		if at_eof:
+			end = index.size
+		else:
+			end = index[end_pos]
+
+		offsets = index.offsets[pos:end_pos+1]
+		if (len(offsets) < 2) or (max(map(operator.sub, offsets[1:], offsets)) > MAX_LINE_SIZE):
+			lines = [f'{self.get_line(x, max_size=MAX_LINE_SIZE)}\n' for x in range(pos, end_pos)]
+			return (''.join(lines), at_eof)
+
+		text = index.data[start:end].decode(self.encoding, errors='replace')
+		if not text.endswith('\n'):
+			text = f'{text}\n'
+
+		return (text.replace('\r\n', '\n').expandtabs(self.tabsize), at_eof)
+
+	def get_search_index(self):
+		return self.line_index
+
+	def decode_chunk(self, data):
+		return data.decode(self.encoding, errors='replace').replace('\r\n', '\n')
+
+
 class TextDirectoryWalker(BaseTextFileWalker):
 	def __init__(self, files, filename):
-		files.sort(key=functools.cmp_to_key(sort_by_name))
+		files = sort_files(files, 'sort_by_name')
 
 		self.fh = None
 		self.file_size = 0
@@ -748,6 +1414,7 @@ class TextDirectoryWalker(BaseTextFileWalker):
 
 		self.len_lines = len(self.lines)
 		self.digits = len(str(self.len_lines))
+		self.search_index = None
 
 	def get_focus(self):
 		pos = self.focus
@@ -784,68 +1451,85 @@ class TextDirectoryWalker(BaseTextFileWalker):
 		return (w, pos)
 
 
-class FileViewListBox(urwid.ListBox):
-	def __init__(self, controller, tabsize, use_line_highlight):
-		self.controller = controller
+class FileView(object):
+	# Everything that is read from a file to show it, so that it can be read
+	# away from the UI thread, and kept around
+	def __init__(self, filename, tabsize, use_line_highlight, ev_cancel=None):
+		self.filename = filename
 		self.tabsize = tabsize
 		self.use_line_highlight = use_line_highlight
-		self.clear_walker = urwid.SimpleFocusListWalker([])
-		self.walker = self.clear_walker
-		self.hex_walker = None
-
-		self.old_size = None
-
-		super().__init__(self.walker)
-
-	def clear(self):
-		self.walker = self.clear_walker
+		self.ev_cancel = ev_cancel
+		self.fh = None
+		self.mmap = None
+		self.file_size = 0
+		self.text_file = True
+		self.walker = None
 		self.hex_walker = None
+		self.lines = []
+		self.len_lines = 0
+		self.line_offset = [0]
+		self.line_index = None
+
+	def check_cancel(self):
+		if (self.ev_cancel is not None) and self.ev_cancel.is_set():
+			raise InterruptError()
+
+	def close(self):
+		# The background indexing stops before the mapping goes away
+		if self.line_index is not None:
+			self.line_index.cancel()
+			with self.line_index.lock:
+				if self.mmap is not None:
+					self.mmap.close()
+		elif self.mmap is not None:
+			self.mmap.close()
+
+		if self.fh is not None:
+			self.fh.close()
+
+		self.mmap = None
+		self.fh = None
 
-		self.body = self.walker
-
-	def read_file(self, filename, file_size):
-		self.filename = filename
+	def read_file(self, file_size):
 		self.file_size = file_size
 
-		fh = open(filename, 'rb')
+		fh = open(self.filename, 'rb')
+		self.fh = fh
 
 		text_file = True
-		if file_size > MAX_TEXT_FILE_SIZE:
-			text_file = False
-		else:
-			data = fh.read(131072)
+		data = fh.read(131072)
+		self.check_cancel()
 
-			if b'\0' in data:
-				text_file = False
+		if b'\0' in data:
+			text_file = False
 
-			if text_file:
-				try:
-					encoding = sys.getdefaultencoding()
-					data.decode(encoding)
-				except UnicodeDecodeError:
-					if encoding == 'windows-1252':
+		if text_file:
+			try:
+				encoding = sys.getdefaultencoding()
+				data.decode(encoding)
+			except UnicodeDecodeError:
+				if encoding == 'windows-1252':
+					text_file = False
+				else:
+					try:
+						encoding = 'windows-1252'
+						data.decode(encoding)
+					except UnicodeDecodeError:
 						text_file = False
-					else:
-						try:
-							encoding = 'windows-1252'
-							data.decode(encoding)
-						except UnicodeDecodeError:
-							text_file = False
 
 		self.text_file = text_file
-		if text_file:
+		if text_file and (file_size > MAX_TEXT_FILE_SIZE):
+			self.walker = self.read_mapped_file(fh, encoding)
+		elif text_file:
 			self.walker = self.read_text_file(fh, encoding)
 		else:
 			self.walker = DumpFileWalker(fh, self.file_size)
 			self.hex_walker = HexFileWalker(fh, self.file_size)
 
-		self.old_size = None
-
-		self.body = self.walker
-
 	def read_text_file(self, fh, encoding):
 		fh.seek(0)
 		data = fh.read(MAX_TEXT_FILE_SIZE)
+		self.check_cancel()
 
 		self.hex_walker = HexFileWalker(fh, len(data), data)
 
@@ -862,6 +1546,8 @@ class FileViewListBox(urwid.ListBox):
 					self.text_file = False
 					return DumpFileWalker(fh, self.file_size)
 
+		self.check_cancel()
+
 		self.file_size = len(data)
 
 		lines_data = data.splitlines(keepends=True)
@@ -874,16 +1560,36 @@ class FileViewListBox(urwid.ListBox):
 		del self.line_offset[-1]
 
 		w = TextFileWalker(fh, self.file_size, code, self.filename, self.tabsize, self.use_line_highlight)
-		self.lines = w.lines
 		self.len_lines = w.len_lines
 
 		return w
 
-	def read_directory(self, filename):
+	def read_mapped_file(self, fh, encoding):
+		# Big files are not read at all, only the lines that are shown get
+		# decoded, and the lines are indexed while they are needed
+		try:
+			data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+		except (OSError, ValueError):
+			return self.read_text_file(fh, encoding)
+
+		self.mmap = data
+		self.file_size = len(data)
+		self.line_index = LineIndex(data)
+		self.line_offset = self.line_index
+		self.hex_walker = HexFileWalker(fh, self.file_size, data)
+
+		w = MappedTextFileWalker(self.line_index, encoding, self.filename, self.tabsize)
+		self.len_lines = w.len_lines
+
+		return w
+
+	def read_directory(self):
 		self.text_file = True
 
-		files = get_file_list(filename, count_directories=False)
-		w = TextDirectoryWalker(files, filename)
+		files = get_file_list(self.filename, count_directories=False)
+		self.check_cancel()
+
+		w = TextDirectoryWalker(files, self.filename)
 		self.lines = w.lines
 		self.len_lines = w.len_lines
 		self.file_size = self.len_lines
@@ -900,10 +1606,90 @@ class FileViewListBox(urwid.ListBox):
 		self.walker = w
 		self.hex_walker = HexFileWalker(None, len(data), data)
 
+
+class FileViewListBox(urwid.ListBox):
+	signals = ['matches']
+
+	def __init__(self, controller, tabsize, use_line_highlight):
+		self.controller = controller
+		self.tabsize = tabsize
+		self.use_line_highlight = use_line_highlight
+		self.clear_walker = urwid.SimpleFocusListWalker([])
+		self.walker = self.clear_walker
+		self.hex_walker = None
+		self.line_index = None
+		self.own_view = None
+
+		self.ev_search_cancel = threading.Event()
+		self.search_dialog = None
+		self.match_index = None
+		self.matches_text = ''
+
+		self.old_size = None
+
+		super().__init__(self.walker)
+
+	def clear(self):
+		self.cancel_search()
+		self.cancel_match_index()
+
+		self.walker = self.clear_walker
+		self.hex_walker = None
+
+		if self.line_index is not None:
+			self.line_index.cancel()
+			self.line_index = None
+
+		# Only the views read here are closed, the ones set from outside
+		# belong to whoever made them
+		if self.own_view is not None:
+			self.own_view.close()
+			self.own_view = None
+
+		self.body = self.walker
+
+		self.update_matches()
+
+	def read_file(self, filename, file_size):
+		view = FileView(filename, self.tabsize, self.use_line_highlight)
+		view.read_file(file_size)
+		self.set_view(view)
+		self.own_view = view
+
+		# The whole file gets indexed in the background, so that jumping
+		# around does not need to wait for it
+		if self.line_index is not None:
+			self.line_index.start()
+
+	def read_directory(self, filename):
+		view = FileView(filename, self.tabsize, self.use_line_highlight)
+		view.read_directory()
+		self.set_view(view)
+		self.own_view = view
+
+	def set_view(self, view):
+		if (self.own_view is not None) and (self.own_view is not view):
+			self.own_view.close()
+			self.own_view = None
+
+		self.filename = view.filename
+		self.file_size = view.file_size
+		self.text_file = view.text_file
+		self.walker = view.walker
+		self.hex_walker = view.hex_walker
+		self.lines = view.lines
+		self.len_lines = view.len_lines
+		self.line_offset = view.line_offset
+		self.line_index = view.line_index
+
 		self.old_size = None
 
+		self.cancel_match_index()
+
 		self.body = self.walker
 
+		self.update_matches()
+
 	def use_hex_offset(self):
 		if self.text_file:
 			return self.body == self.hex_walker
@@ -911,6 +1697,9 @@ class FileViewListBox(urwid.ListBox):
 			return True
 
 	def line_from_offset(self, offset):
+		if self.line_index is not None:
+			return self.line_index.line_from_offset(offset)
+
 		low = 0;
 		high = len(self.line_offset) - 1
 		while low <= high:
@@ -941,6 +1730,10 @@ class FileViewListBox(urwid.ListBox):
 			if pos >= self.file_size:
 				pos = self.file_size - 1
 		else:
+			if self.line_index is not None:
+				self.line_index.index_to_line(pos)
+				self.len_lines = len(self.line_index)
+
 			if pos >= self.len_lines:
 				pos = self.len_lines - 1
 
@@ -957,8 +1750,7 @@ class FileViewListBox(urwid.ListBox):
 		self.controller.screen.close_dialog()
 
 		if not text:
-			self.body.stop_search()
-			self._invalidate()
+			self.stop_search()
 			return
 
 		if self.use_hex_offset():
@@ -1006,35 +1798,88 @@ class FileViewListBox(urwid.ListBox):
 
 			expression = re.compile(expression, re_flags)
 
-		self.controller.screen.error('Searching...', title='Search', error=False)
-		self.controller.loop.draw_screen()
+		self.body.set_search(expression, flags.backwards)
+		self.start_match_index()
+		self.start_search(0)
 
-		pos = self.body.start_search(expression, flags.backwards)
+	def stop_search(self):
+		self.cancel_search()
+		self.cancel_match_index()
+		self.body.stop_search()
+		self.update_matches()
+		self._invalidate()
 
-		self.controller.screen.close_dialog()
-		self.controller.loop.draw_screen()
+	def search_next(self):
+		if self.body.search_expression is None:
+			return
 
-		if pos is not None:
-			try:
-				self.set_focus(pos)
-				self.set_focus_valign('top')
-				self._invalidate()
-			except IndexError:
-				pass
-		else:
-			self.controller.screen.error('Search string not found', title='Search', error=False)
+		self.start_search(1)
 
-	def search_next(self):
+	def search_prev(self):
 		if self.body.search_expression is None:
 			return
 
-		self.controller.screen.error('Searching...', title='Search', error=False)
-		self.controller.loop.draw_screen()
+		self.start_search(-1)
 
-		pos = self.body.search_next()
+	def start_search(self, direction):
+		# The search runs in a thread, and a dialog to cancel it shows up
+		# only if it takes a while
+		self.cancel_search()
 
-		self.controller.screen.close_dialog()
-		self.controller.loop.draw_screen()
+		(pos, backwards) = self.body.next_search_pos(direction)
+
+		# Once the matches around pos are indexed, there is no need to search
+		match_index = self.get_match_index()
+		if match_index is not None:
+			(known, found_pos) = match_index.find(pos, backwards)
+			if known:
+				self.on_search_result(self.body, direction, found_pos)
+				return
+
+		q = queue.Queue()
+		self.ev_search_cancel = threading.Event()
+		fd = self.controller.loop.watch_pipe(functools.partial(self.on_search_data, self.body, direction, q, self.ev_search_cancel))
+		threading.Thread(target=rnr_search, args=(self.body, self.body.search_expression, pos, backwards, fd, q, self.ev_search_cancel), daemon=True).start()
+
+	def cancel_search(self):
+		self.ev_search_cancel.set()
+
+		if self.search_dialog is not None:
+			self.search_dialog = None
+			self.controller.screen.close_dialog()
+
+	def on_search_data(self, walker, direction, q, ev_cancel, data):
+		retval = None
+		while True:
+			try:
+				info = q.get_nowait()
+			except queue.Empty:
+				break
+
+			if 'result' in info:
+				retval = False
+
+			if ev_cancel.is_set():
+				continue
+
+			if 'progress' in info:
+				message = f'Searching... {int(info["progress"] * 100):3d}%'
+				if self.search_dialog is None:
+					self.search_dialog = self.controller.screen.open_cancelable('Search', message, self.cancel_search)
+				else:
+					self.search_dialog.set_message(message)
+			elif 'result' in info:
+				if self.search_dialog is not None:
+					self.search_dialog = None
+					self.controller.screen.close_dialog()
+
+				self.on_search_result(walker, direction, info['result'])
+
+		return retval
+
+	def on_search_result(self, walker, direction, pos):
+		if walker is not self.body:
+			return
 
 		if pos is not None:
 			try:
@@ -1043,30 +1888,74 @@ class FileViewListBox(urwid.ListBox):
 				self._invalidate()
 			except IndexError:
 				pass
+
+			self.update_matches()
 		else:
+			if direction == 0:
+				self.stop_search()
+
 			self.controller.screen.error('Search string not found', title='Search', error=False)
 
-	def search_prev(self):
-		if self.body.search_expression is None:
-			return
+	def start_match_index(self):
+		# All the matches get indexed in the background, for counting them and
+		# for jumping between them without searching
+		self.cancel_match_index()
 
-		self.controller.screen.error('Searching...', title='Search', error=False)
-		self.controller.loop.draw_screen()
+		self.match_index = MatchIndex(self.body)
+		fd = self.controller.loop.watch_pipe(functools.partial(self.on_match_index, self.match_index))
+		threading.Thread(target=rnr_match_index, args=(self.body, self.match_index, fd), daemon=True).start()
 
-		pos = self.body.search_prev()
+	def cancel_match_index(self):
+		if self.match_index is not None:
+			self.match_index.ev_cancel.set()
+			self.match_index = None
 
-		self.controller.screen.close_dialog()
-		self.controller.loop.draw_screen()
+	def on_match_index(self, match_index, data):
+		if match_index is self.match_index:
+			self.update_matches()
+			self._invalidate()
 
-		if pos is not None:
+		if match_index.done or match_index.ev_cancel.is_set():
+			return False
+
+	def get_match_index(self):
+		match_index = self.match_index
+		if (match_index is None) or (match_index.walker is not self.body) or (match_index.search_expression is not self.body.search_expression):
+			return None
+
+		return match_index
+
+	def get_search_extent(self):
+		if self.use_hex_offset():
+			return self.body.file_size
+		else:
+			return self.body.len_lines
+
+	def update_matches(self):
+		match_index = self.get_match_index()
+		if match_index is None:
+			text = ''
+		else:
 			try:
-				self.set_focus(pos)
-				self.set_focus_valign('top')
-				self._invalidate()
+				pos = self.focus_position
 			except IndexError:
-				pass
-		else:
-			self.controller.screen.error('Search string not found', title='Search', error=False)
+				pos = 0
+
+			if self.use_hex_offset():
+				pos = (pos - (pos % self.body.line_width)) + self.body.line_width - 1
+
+			num_match = match_index.count(pos)
+			if num_match is None:
+				num_match = '?'
+
+			if match_index.is_complete():
+				text = f'Match {num_match} of {len(match_index)}'
+			else:
+				text = f'Match {num_match} of {len(match_index)}+'
+
+		if text != self.matches_text:
+			self.matches_text = text
+			self._emit('matches', text)
 
 	def render(self, size, *args, **kwargs):
 		if size != self.old_size:
@@ -1191,10 +2080,15 @@ class FileViewListBox(urwid.ListBox):
 			except AttributeError:
 				pass
 		else:
-			return super().keypress(size, key)
+			key = super().keypress(size, key)
+			self.update_matches()
+			return key
+
+		self.update_matches()
 
 	def mouse_event(self, size, event, button, col, row, focus):
 		super().mouse_event(size, event, button, col, row, focus)
+		self.update_matches()
 
 		if 'press' not in event.split():
 			return
@@ -1217,13 +2111,16 @@ class Screen(urwid.WidgetWrap):
 		top = TopBar(filename)
 
 		self.list_box = FileViewListBox(controller, tabsize, use_line_highlight=False)
+		urwid.connect_signal(self.list_box, 'matches', top.on_matches)
+
+		w = urwid.Columns([self.list_box, (1, MatchMap(self.list_box))])
 
 		try:
 			self.list_box.read_file(filename, file_size)
-			self.center = urwid.AttrMap(self.list_box, 'Text')
+			self.center = urwid.AttrMap(w, 'Text')
 		except IsADirectoryError:
 			self.list_box.read_directory(filename)
-			self.center = urwid.AttrMap(self.list_box, 'panel')
+			self.center = urwid.AttrMap(w, 'panel')
 
 		pile_widgets = [(1, urwid.Filler(top)), self.center]
 
@@ -1237,6 +2134,13 @@ class Screen(urwid.WidgetWrap):
 
 		super().__init__(self.pile)
 
+	def get_dialog(self):
+		w = self.pile.contents[self.main_area][0]
+		if w is self.center:
+			return None
+
+		return w.top_w
+
 	def close_dialog(self):
 		self.pile.contents[self.main_area] = (self.center, self.pile.options())
 
@@ -1250,6 +2154,17 @@ class Screen(urwid.WidgetWrap):
 
 		self.in_error = True
 
+	def open_cancelable(self, title, message, on_cancel):
+		dlg = DlgCancelable(self, title, message, on_cancel)
+		self.pile.contents[self.main_area] = (urwid.Overlay(dlg, self.center,
+			'center', len(message) + 6,
+			'middle', 'pack',
+		), self.pile.options())
+
+		self.in_error = True
+
+		return dlg
+
 
 class App(object):
 	def __init__(self, filename, file_size, monochrome, tabsize):
@@ -1272,12 +2187,12 @@ class App(object):
 
 def keypress(controller, key):
 	if controller.screen.in_error:
+		controller.screen.list_box.cancel_search()
 		controller.screen.close_dialog()
 		return
 
 	if key == 'esc':
-		controller.screen.list_box.body.stop_search()
-		controller.screen.list_box._invalidate()
+		controller.screen.list_box.stop_search()
 	elif key in ('q', 'Q', 'v', 'f3', 'f10'):
 		try:
 			controller.close_viewer(key)
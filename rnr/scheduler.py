@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+import itertools
+
+from .debug_print import (debug_print, debug_pprint)
+
+
+class JobScheduler(object):
+	def __init__(self, max_jobs_per_device):
+		self.max_jobs_per_device = max_jobs_per_device
+		self.jobs = []
+		self.counter = itertools.count()
+
+	def submit(self, job):
+		job.setdefault('priority', 0)
+		job['seq'] = next(self.counter)
+		job['status'] = 'QUEUED'
+		self.jobs.append(job)
+
+		self.schedule()
+
+		return job['status'] == 'RUNNING'
+
+	def finish(self, job):
+		try:
+			self.jobs.remove(job)
+		except ValueError:
+			return
+
+		self.schedule()
+
+	def set_priority(self, job, priority):
+		job['priority'] = priority
+
+		self.schedule()
+
+	def running_jobs(self, dev):
+		return sum(1 for x in self.jobs if (x['status'] == 'RUNNING') and (not x.get('background')) and (dev in x['devices']))
+
+	def can_run(self, job):
+		if (self.max_jobs_per_device <= 0) or job.get('background'):
+			return True
+
+		return all(self.running_jobs(dev) < self.max_jobs_per_device for dev in job['devices'])
+
+	def schedule(self):
+		queued = sorted([x for x in self.jobs if x['status'] == 'QUEUED'], key=lambda x: (-x['priority'], x['seq']))
+		blocked = set()
+		for job in queued:
+			# A higher priority job waiting for a device keeps it reserved, so that
+			# lower priority jobs can't starve it by grabbing the device first
+			if (not blocked.isdisjoint(job['devices'])) or (not self.can_run(job)):
+				blocked.update(job['devices'])
+				continue
+
+			job['status'] = 'RUNNING'
+			job['start']()
+
+		# The background jobs run outside of the device budget, and pause
+		# while any other job is running on one of their devices
+		busy = set()
+		for job in self.jobs:
+			if (job['status'] == 'RUNNING') and (not job.get('background')):
+				busy.update(job['devices'])
+
+		for job in self.jobs:
+			if (job['status'] == 'RUNNING') and job.get('background'):
+				if busy.isdisjoint(job['devices']):
+					job['ev_suspend'].set()
+				else:
+					job['ev_suspend'].clear()
+
+	def get_status(self, job):
+		if (job['status'] == 'RUNNING') and (not job['ev_suspend'].is_set()):
+			return 'SUSPENDED'
+
+		return job['status']
+
+	def get_jobs(self):
+		return sorted(self.jobs, key=lambda x: (x['status'] != 'RUNNING', -x['priority'], x['seq']))
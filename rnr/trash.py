@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2020-2022  Franco Bugnano
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import os
+
+import stat
+import errno
+import tempfile
+
+from .database import DataBase
+from .utils import InterruptError
+from .debug_print import (debug_print, debug_pprint)
+
+
+def find_mountpoint(path):
+	path = os.path.realpath(path)
+	dev = os.lstat(path).st_dev
+
+	while True:
+		parent = os.path.dirname(path)
+		if (parent == path) or (os.lstat(parent).st_dev != dev):
+			return path
+
+		path = parent
+
+def get_trash_dir(path, fallback_dir):
+	dev = os.lstat(path).st_dev
+
+	for trash_dir in (os.path.join(find_mountpoint(path), f'.rnr-trash-{os.getuid()}'), str(fallback_dir)):
+		try:
+			os.makedirs(trash_dir, mode=0o700, exist_ok=True)
+
+			# A trash directory that is not ours, or that is on another
+			# filesystem, cannot be used: renaming into it must be atomic
+			lstat = os.lstat(trash_dir)
+			if stat.S_ISDIR(lstat.st_mode) and (lstat.st_uid == os.getuid()) and (lstat.st_dev == dev):
+				return trash_dir
+		except OSError:
+			pass
+
+	raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+def new_trash_slot(file, fallback_dir):
+	trash_dir = get_trash_dir(os.path.dirname(file), fallback_dir)
+	holder = tempfile.mkdtemp(dir=trash_dir)
+
+	return os.path.join(holder, os.path.basename(file))
+
+def remove_tree(path, ev_suspend, ev_interrupt):
+	for root, dirs, files, root_fd in os.fwalk(path, topdown=False):
+		ev_suspend.wait()
+
+		if ev_interrupt.is_set():
+			raise InterruptError()
+
+		for name in files:
+			os.unlink(name, dir_fd=root_fd)
+
+		for name in dirs:
+			try:
+				os.rmdir(name, dir_fd=root_fd)
+			except NotADirectoryError:
+				os.unlink(name, dir_fd=root_fd)
+
+	os.rmdir(path)
+
+def rnr_reap(entries, fd, q, ev_suspend, ev_interrupt, dbfile):
+	db = DataBase(dbfile)
+
+	reaped = []
+	error = []
+	for entry in entries:
+		ev_suspend.wait()
+
+		if ev_interrupt.is_set():
+			break
+
+		# An undo may have taken the entry in the meantime
+		if not db.claim_trash(entry['id'], 'REAPING'):
+			continue
+
+		holder = os.path.dirname(entry['trash'])
+		try:
+			if os.path.lexists(holder):
+				remove_tree(holder, ev_suspend, ev_interrupt)
+
+			db.delete_trash(entry['id'])
+			reaped.append(entry['file'])
+		except InterruptError:
+			db.set_trash_status(entry['id'], 'TRASHED')
+			break
+		except OSError as e:
+			db.set_trash_status(entry['id'], 'ERROR')
+			error.append({'file': entry['file'], 'message': f'{e.strerror} ({e.errno})'})
+
+	try:
+		# The wake up comes first: with the process backend a large result
+		# would fill the queue pipe before the UI starts reading it
+		os.write(fd, b'\n')
+		q.put({'result': reaped, 'error': error})
+	except OSError:
+		pass
+	os.close(fd)
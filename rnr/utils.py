@@ -75,7 +75,19 @@ def try_int(s):
 		return (s, 0)
 
 def natsort_key(s):
-	return [try_int(x) for x in ReNumbers.split(unicodedata.normalize('NFKD', s.casefold()))]
+	# The numbers are always at the odd positions of the split
+	parts = ReNumbers.split(unicodedata.normalize('NFKD', s.casefold()))
+	key = [(x, 0) for x in parts]
+	key[1::2] = [('0', int(x)) for x in parts[1::2]]
+
+	return key
+
+def existing_dir(path):
+	path = Path(path)
+	while (not path.is_dir()) and (path.parent != path):
+		path = path.parent
+
+	return path
 
 def tar_stem(file):
 	p = Path(file)